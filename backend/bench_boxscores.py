@@ -0,0 +1,239 @@
+'''
+Compares building a box score response against the row-by-row version it replaced.
+
+  python bench_boxscores.py                      # synthetic finished game
+  python bench_boxscores.py --traditional box.json --summary summary.json --runs 50
+
+Fixtures are the raw JSON stats.nba.com returns for boxscoretraditionalv3 and
+boxscoresummaryv3, e.g. BoxScoreTraditionalV3(game_id="0022500397").get_json().
+'''
+import argparse
+import json
+import random
+from statistics import median
+from time import perf_counter
+
+import pandas as pd
+from nba_api.stats.endpoints import boxscoretraditionalv3, boxscoresummaryv3
+from nba_api.stats.library.http import NBAStatsResponse
+
+from boxscores import Boxscores, _summaryHeader
+
+_GAME_ID = "0022500397"
+_TEAMS = [
+  {"teamId": 1610612739, "teamCity": "Cleveland", "teamName": "Cavaliers", "teamTricode": "CLE", "teamSlug": "cavaliers"},
+  {"teamId": 1610612744, "teamCity": "Golden State", "teamName": "Warriors", "teamTricode": "GSW", "teamSlug": "warriors"},
+]
+_POSITIONS = ["F", "F", "C", "G", "G"]
+
+def _stats(rng: random.Random, played: bool) -> dict:
+  if not played:
+    counts = dict.fromkeys(["fgm", "fga", "fg3m", "fg3a", "ftm", "fta", "oreb", "dreb", "ast", "stl", "blk", "tov", "pf"], 0)
+    minutes = ""
+  else:
+    fga = rng.randint(0, 20)
+    fg3a = rng.randint(0, fga)
+    fta = rng.randint(0, 10)
+    counts = {"fga": fga, "fgm": rng.randint(0, fga), "fg3a": fg3a, "fg3m": 0, "fta": fta, "ftm": rng.randint(0, fta),
+              "oreb": rng.randint(0, 4), "dreb": rng.randint(0, 10), "ast": rng.randint(0, 10),
+              "stl": rng.randint(0, 3), "blk": rng.randint(0, 3), "tov": rng.randint(0, 5), "pf": rng.randint(0, 6)}
+    counts["fg3m"] = rng.randint(0, min(fg3a, counts["fgm"]))
+    minutes = f"{rng.randint(1, 40)}:{rng.randint(0, 59):02d}"
+  return _statistics(minutes, counts)
+
+def _statistics(minutes: str, c: dict) -> dict:
+  def pct(made, attempted):
+    return round(made / attempted, 3) if attempted else 0.0
+  return {
+    "minutes": minutes, "fieldGoalsMade": c["fgm"], "fieldGoalsAttempted": c["fga"],
+    "fieldGoalsPercentage": pct(c["fgm"], c["fga"]), "threePointersMade": c["fg3m"],
+    "threePointersAttempted": c["fg3a"], "threePointersPercentage": pct(c["fg3m"], c["fg3a"]),
+    "freeThrowsMade": c["ftm"], "freeThrowsAttempted": c["fta"], "freeThrowsPercentage": pct(c["ftm"], c["fta"]),
+    "reboundsOffensive": c["oreb"], "reboundsDefensive": c["dreb"], "reboundsTotal": c["oreb"] + c["dreb"],
+    "assists": c["ast"], "steals": c["stl"], "blocks": c["blk"], "turnovers": c["tov"],
+    "foulsPersonal": c["pf"], "points": 2 * c["fgm"] + c["fg3m"] + c["ftm"], "plusMinusPoints": 0.0
+  }
+
+def syntheticTraditionalResponse(players_per_team: int = 15, seed: int = 0) -> str:
+  '''A boxscoretraditionalv3 response for a finished game, with a few DNPs per team'''
+  rng = random.Random(seed)
+  box = {"gameId": _GAME_ID, "homeTeamId": _TEAMS[0]["teamId"], "awayTeamId": _TEAMS[1]["teamId"]}
+  for key, team in zip(("homeTeam", "awayTeam"), _TEAMS):
+    players = []
+    for n in range(players_per_team):
+      played = n < players_per_team - 3
+      players.append({
+        "personId": 1630000 + 100 * team["teamId"] % 7 + n, "firstName": f"First{n}", "familyName": f"Last{n}",
+        "nameI": f"F. Last{n}", "playerSlug": f"first{n}-last{n}",
+        "position": _POSITIONS[n] if n < len(_POSITIONS) else "",
+        "comment": "" if played else "DNP - Coach's Decision", "jerseyNum": str(n),
+        "statistics": _stats(rng, played)
+      })
+    totals = {stat: sum(player["statistics"][stat] for player in players)
+              for stat in ("fieldGoalsMade", "fieldGoalsAttempted", "threePointersMade", "threePointersAttempted",
+                           "freeThrowsMade", "freeThrowsAttempted", "reboundsOffensive", "reboundsDefensive",
+                           "assists", "steals", "blocks", "turnovers", "foulsPersonal")}
+    counts = {"fgm": totals["fieldGoalsMade"], "fga": totals["fieldGoalsAttempted"],
+              "fg3m": totals["threePointersMade"], "fg3a": totals["threePointersAttempted"],
+              "ftm": totals["freeThrowsMade"], "fta": totals["freeThrowsAttempted"],
+              "oreb": totals["reboundsOffensive"], "dreb": totals["reboundsDefensive"], "ast": totals["assists"],
+              "stl": totals["steals"], "blk": totals["blocks"], "tov": totals["turnovers"], "pf": totals["foulsPersonal"]}
+    box[key] = {**team, "players": players, "statistics": _statistics("240:00", counts)}
+  return json.dumps({"meta": {}, "boxScoreTraditional": box})
+
+def syntheticSummaryResponse(status: str = "Final") -> str:
+  '''The parts of a boxscoresummaryv3 response the box score reads'''
+  summary = {"gameId": _GAME_ID, "gameStatus": 3 if status.startswith("Final") else 1, "gameStatusText": status,
+             "homeTeamId": _TEAMS[0]["teamId"], "awayTeamId": _TEAMS[1]["teamId"],
+             "homeTeam": dict(_TEAMS[0]), "awayTeam": dict(_TEAMS[1]),
+             "postgameCharts": {"homeTeam": dict(_TEAMS[0]), "awayTeam": dict(_TEAMS[1])}}
+  return json.dumps({"meta": {}, "boxScoreSummary": summary})
+
+def _load(endpoint_class, text: str):
+  '''Builds the endpoint object from a saved response without any network access'''
+  endpoint = endpoint_class.__new__(endpoint_class)
+  endpoint.nba_response = NBAStatsResponse(response=text, status_code=200, url="")
+  endpoint.load_response()
+  return endpoint
+
+def loadTraditional(text: str) -> boxscoretraditionalv3.BoxScoreTraditionalV3:
+  return _load(boxscoretraditionalv3.BoxScoreTraditionalV3, text)
+
+def loadSummary(text: str) -> boxscoresummaryv3.BoxScoreSummaryV3:
+  return _load(boxscoresummaryv3.BoxScoreSummaryV3, text)
+
+class _StatObj:
+  '''The per-row StatObj the box score used to be built with'''
+  def __init__(self):
+    self.values = {}
+    self._statList = ['fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb',
+                      'ast', 'blk', 'stl', 'pts', 'pf', 'min']
+    for stat in self._statList:
+      self.values[stat] = None
+
+  def getValues(self) -> dict:
+    copy = self.values.copy()
+    copy['reb'] = copy['oreb'] + copy['dreb']
+    copy['fg_pct'] = 0 if copy['fga'] == 0 else copy['fgm'] / copy['fga']
+    copy['fg3_pct'] = 0 if copy['fg3a'] == 0 else copy['fg3m'] / copy['fg3a']
+    copy['ft_pct'] = 0 if copy['fta'] == 0 else copy['ftm'] / copy['fta']
+    copy['efg_pct'] = 0 if copy['fga'] == 0 else ( copy['fgm'] + 0.5 * copy['fg3m'] ) / copy['fga']
+    return copy
+
+  @staticmethod
+  def loadFromSeries(source: pd.Series) -> "_StatObj":
+    newObj = _StatObj()
+    for stat in newObj._statList:
+      try:
+        newObj.values[stat] = source.loc[stat]
+      except KeyError:
+        newObj.values[stat] = 0
+    return newObj
+
+_RENAMED = {"teamId": "team_id", "teamCity": "team_city", "personId": "player_id", "nameI": "player_name",
+            "minutes": "min", "fieldGoalsMade": "fgm", "fieldGoalsAttempted": "fga", "threePointersMade": "fg3m",
+            "threePointersAttempted": "fg3a", "freeThrowsMade": "ftm", "freeThrowsAttempted": "fta",
+            "reboundsOffensive": "oreb", "reboundsDefensive": "dreb", "assists": "ast", "steals": "stl",
+            "blocks": "blk", "turnovers": "tov", "points": "pts", "foulsPersonal": "pf"}
+_TEAM_COLUMNS = ["teamId", "teamCity", "minutes", "fieldGoalsMade", "fieldGoalsAttempted", "threePointersMade",
+                 "threePointersAttempted", "freeThrowsMade", "freeThrowsAttempted", "reboundsOffensive",
+                 "reboundsDefensive", "assists", "steals", "blocks", "turnovers", "points", "foulsPersonal"]
+_PLAYER_COLUMNS = ["teamId", "personId", "nameI", "position", "jerseyNum"] + _TEAM_COLUMNS[2:]
+
+def legacyBoxscore(boxscore, summary, score_exists: bool) -> dict:
+  '''The iterrows/StatObj version of Boxscores._buildBoxscore'''
+  def statsDict(row: pd.Series) -> dict:
+    return _StatObj.loadFromSeries(row).getValues()
+
+  score = {
+    "team_0": {},
+    "team_1": {},
+    "score_exists": score_exists,
+    "status": summary.game_summary.get_data_frame().iloc[0].loc['gameStatusText']
+  }
+  if score_exists:
+    team_stats_df = boxscore.team_stats.get_data_frame()[_TEAM_COLUMNS].rename(columns=_RENAMED)
+    sample_team = {"team_id": None, "team_city": None, "team_logo": None, "team_stats": {}}
+    score["team_0"] = sample_team.copy()
+    score["team_1"] = sample_team.copy()
+    score["team_0"]["player_stats"] = []
+    score["team_1"]["player_stats"] = []
+
+    i = 0
+    for _, row in team_stats_df.iterrows():
+      team = score[f"team_{i}"]
+      team["team_id"] = row.loc['team_id']
+      team["team_city"] = row.loc['team_city']
+      team["team_logo"] = f"https://cdn.nba.com/logos/nba/{team['team_id']}/primary/L/logo.svg"
+      team["team_stats"] = statsDict(row)
+      i += 1
+
+    player_stats_df = boxscore.player_stats.get_data_frame()[_PLAYER_COLUMNS].rename(columns=_RENAMED)
+    for _, row in player_stats_df.iterrows():
+      player = {}
+      player["player_name"] = row.loc["player_name"]
+      player["player_id"] = row.loc["player_id"]
+      player["position"] = row.loc["position"]
+      player["started"] = player["position"] != ""
+      player["stats"] = statsDict(row)
+      if row.loc["team_id"] == score["team_0"]["team_id"]:
+        score["team_0"]['player_stats'].append(player)
+      elif row.loc["team_id"] == score["team_1"]["team_id"]:
+        score["team_1"]['player_stats'].append(player)
+  else:
+    team_info_df = summary.other_stats.get_data_frame()[["teamId", "teamCity"]].rename(columns=_RENAMED)
+    sample_team = {"team_id": None, "team_city": None, "team_logo": None}
+    score["team_0"] = sample_team.copy()
+    score["team_1"] = sample_team.copy()
+    i = 0
+    for _, row in team_info_df.iterrows():
+      team = score[f"team_{i}"]
+      team["team_id"] = row.loc["team_id"]
+      team["team_city"] = row.loc["team_city"]
+      team["team_logo"] = f"https://cdn.nba.com/logos/nba/{team['team_id']}/primary/L/logo.svg"
+      i += 1
+  return score
+
+def _plain(value):
+  '''numpy scalars as the Python values they serialize to, tagged with their JSON type'''
+  if isinstance(value, dict):
+    return {key: _plain(item) for key, item in value.items()}
+  if isinstance(value, list):
+    return [_plain(item) for item in value]
+  if hasattr(value, 'item'):
+    value = value.item()
+  return (type(value).__name__, value)
+
+def sameBoxscore(a: dict, b: dict) -> bool:
+  return json.dumps(_plain(a)) == json.dumps(_plain(b))
+
+def _measure(func, runs: int) -> float:
+  times = []
+  for _ in range(runs):
+    start = perf_counter()
+    func()
+    times.append(perf_counter() - start)
+  return median(times)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--traditional", help="saved boxscoretraditionalv3 response")
+  parser.add_argument("--summary", help="saved boxscoresummaryv3 response")
+  parser.add_argument("--runs", type=int, default=20)
+  args = parser.parse_args()
+
+  boxscore = loadTraditional(open(args.traditional).read() if args.traditional else syntheticTraditionalResponse())
+  summary = loadSummary(open(args.summary).read() if args.summary else syntheticSummaryResponse())
+  service = Boxscores(None)
+  if not sameBoxscore(legacyBoxscore(boxscore, summary, True), service._buildBoxscore(boxscore, _summaryHeader(summary), True)):
+    raise AssertionError("box scores differ")
+
+  old_time = _measure(lambda: legacyBoxscore(boxscore, summary, True), args.runs)
+  new_time = _measure(lambda: service._buildBoxscore(boxscore, _summaryHeader(summary), True), args.runs)
+  rows = len(boxscore.player_stats.get_dict()['data'])
+  print(f"box score ({rows} player rows)")
+  print(f"  iterrows + StatObj   {old_time * 1000:8.2f} ms")
+  print(f"  vectorized           {new_time * 1000:8.2f} ms  ({old_time / new_time:.0f}x faster)")
+
+if __name__ == "__main__":
+  main()
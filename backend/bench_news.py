@@ -0,0 +1,96 @@
+'''
+Compares news page extraction against the BeautifulSoup approach it replaced.
+
+  python bench_news.py                       # synthetic pages
+  python bench_news.py --nba nba.html --yahoo yahoo.html --runs 50
+
+Saved pages can be captured with curl from NBA_NEWS_URL and YAHOO_NEWS_URL.
+'''
+import argparse
+import json
+import tracemalloc
+from statistics import median
+from time import perf_counter
+
+from bs4 import BeautifulSoup
+
+from news import _extractNbaArticles, _extractYahooStream
+
+# Roughly the size of the real pages: lots of markup and unrelated scripts around the data
+_FILLER_BLOCKS = 3000
+_ARTICLES = 40
+
+def _filler() -> str:
+  blocks = []
+  for i in range(_FILLER_BLOCKS):
+    blocks.append(f'<div class="card c{i}"><a href="/x/{i}"><span>Item {i}</span></a></div>')
+    if i % 100 == 0:
+      blocks.append(f'<script>window.__cfg{i} = {json.dumps({"k": "v" * 200})};</script>')
+  return "".join(blocks)
+
+def syntheticNbaPage() -> bytes:
+  items = [{"shortTitle": f"Story {i}", "permalink": f"https://www.nba.com/news/story-{i}",
+            "date": "2024-01-01T00:00:00Z", "excerpt": "x" * 300} for i in range(_ARTICLES)]
+  data = {"props": {"pageProps": {"category": {"latest": {"items": items}}}}}
+  return (f'<html><head></head><body>{_filler()}'
+          f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(data)}</script>'
+          f'</body></html>').encode()
+
+def syntheticYahooPage() -> bytes:
+  stream = [{"data": {"content": {"title": f"Story {i}", "pubDate": "2024-01-01T00:00:00Z",
+                                  "clickThroughUrl": {"url": f"https://sports.yahoo.com/{i}"}}}}
+            for i in range(_ARTICLES)]
+  row = "2a:" + json.dumps(["$", "$L2b", None, {"id": "ntk-assetlist-stream", "stream": stream}],
+                           separators=(",", ":")) + "\n"
+  push = "self.__next_f.push(" + json.dumps([1, row], separators=(",", ":")) + ")"
+  return f'<html><body>{_filler()}<script>{push}</script>{_filler()}</body></html>'.encode()
+
+def _legacyNba(page: bytes) -> list:
+  soup = BeautifulSoup(page.decode(), 'html.parser')
+  scripts = soup.find_all('script', attrs={"id": "__NEXT_DATA__"})
+  return json.loads(scripts[0].text)['props']['pageProps']['category']['latest']['items']
+
+def _legacyYahoo(page: bytes) -> list:
+  soup = BeautifulSoup(page.decode(), 'html.parser')
+  script = [s for s in soup.find_all('script') if "ntk-assetlist-stream" in s.text][0]
+  text = script.text[19:-1]
+  text = text.replace("\\\"", "\"").replace("\\n", "").replace("\\\\\"", "'")[7:-2]
+  return json.loads(text)[3]['stream']
+
+def _measure(func, page: bytes, runs: int) -> tuple:
+  times = []
+  for _ in range(runs):
+    start = perf_counter()
+    func(page)
+    times.append(perf_counter() - start)
+
+  tracemalloc.start()
+  func(page)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return median(times), peak
+
+def _report(name: str, page: bytes, legacy, current, runs: int) -> None:
+  if len(legacy(page)) != len(current(page)):
+    raise AssertionError(f"{name}: extraction results differ")
+  old_time, old_peak = _measure(legacy, page, runs)
+  new_time, new_peak = _measure(current, page, runs)
+  print(f"{name} ({len(page) / 1024:.0f} KB)")
+  print(f"  beautifulsoup  {old_time * 1000:8.2f} ms  {old_peak / 1024:8.0f} KB peak")
+  print(f"  byte slicing   {new_time * 1000:8.2f} ms  {new_peak / 1024:8.0f} KB peak"
+        f"  ({old_time / new_time:.0f}x faster)")
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--nba", help="saved NBA.com top stories page")
+  parser.add_argument("--yahoo", help="saved Yahoo NBA news page")
+  parser.add_argument("--runs", type=int, default=20)
+  args = parser.parse_args()
+
+  nba_page = open(args.nba, "rb").read() if args.nba else syntheticNbaPage()
+  yahoo_page = open(args.yahoo, "rb").read() if args.yahoo else syntheticYahooPage()
+  _report("NBA.com", nba_page, _legacyNba, _extractNbaArticles, args.runs)
+  _report("Yahoo! Sports", yahoo_page, _legacyYahoo, _extractYahooStream, args.runs)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,180 @@
+'''
+Compares building the career stats tree against the row-by-row version it replaced,
+and the memory a cached career takes as a PlayerStatsOut tree against a Career.
+
+  python bench_players.py                        # synthetic 20 season career
+  python bench_players.py --fixture career.json --runs 50
+
+A fixture is the raw JSON stats.nba.com returns for playercareerstats
+(per_mode36=Totals), e.g. PlayerCareerStats(player_id=2544).get_json().
+'''
+import argparse
+import json
+import random
+from statistics import median
+from time import perf_counter
+
+import pandas as pd
+from nba_api.stats.endpoints import playercareerstats
+from nba_api.stats.library.http import NBAStatsResponse
+
+from cache import estimateSize
+from players import PlayerStats, PlayerStatsOut, Statline, REGULAR_STR, PLAYOFF_STR, TOTAL_STR, PERGAME_STR, CAREER_STR, SEASON_STR
+
+_COUNTING = ['GP', 'GS', 'MIN', 'FGM', 'FGA', 'FG_PCT', 'FG3M', 'FG3A', 'FG3_PCT', 'FTM', 'FTA', 'FT_PCT',
+             'OREB', 'DREB', 'REB', 'AST', 'STL', 'BLK', 'TOV', 'PF', 'PTS']
+_SEASON_HEADERS = ['PLAYER_ID', 'SEASON_ID', 'LEAGUE_ID', 'TEAM_ID', 'TEAM_ABBREVIATION', 'PLAYER_AGE'] + _COUNTING
+_CAREER_HEADERS = ['PLAYER_ID', 'LEAGUE_ID', 'TEAM_ID'] + _COUNTING
+_UNUSED_SETS = ['CareerTotalsAllStarSeason', 'CareerTotalsCollegeSeason', 'SeasonRankingsPostSeason',
+                'SeasonRankingsRegularSeason', 'SeasonTotalsAllStarSeason', 'SeasonTotalsCollegeSeason']
+
+def _line(rng: random.Random, gp: int) -> dict:
+  fga = rng.randint(0, 20) * gp
+  fgm = rng.randint(0, fga)
+  fg3a = rng.randint(0, fga)
+  fg3m = rng.randint(0, min(fg3a, fgm))
+  fta = rng.randint(0, 10) * gp
+  ftm = rng.randint(0, fta)
+  oreb, dreb = rng.randint(0, 3 * gp), rng.randint(0, 8 * gp)
+  return {
+    'GP': gp, 'GS': rng.randint(0, gp), 'MIN': rng.randint(0, 40 * gp),
+    'FGM': fgm, 'FGA': fga, 'FG_PCT': round(fgm / fga, 3) if fga else 0.0,
+    'FG3M': fg3m, 'FG3A': fg3a, 'FG3_PCT': round(fg3m / fg3a, 3) if fg3a else 0.0,
+    'FTM': ftm, 'FTA': fta, 'FT_PCT': round(ftm / fta, 3) if fta else 0.0,
+    'OREB': oreb, 'DREB': dreb, 'REB': oreb + dreb, 'AST': rng.randint(0, 8 * gp),
+    'STL': rng.randint(0, 2 * gp), 'BLK': rng.randint(0, 2 * gp), 'TOV': rng.randint(0, 4 * gp),
+    'PF': rng.randint(0, 4 * gp), 'PTS': 2 * fgm + fg3m + ftm
+  }
+
+def _careerRow(lines: list[dict]) -> dict:
+  total = {stat: sum(line[stat] for line in lines) for stat in _COUNTING}
+  for pct, made, attempted in (('FG_PCT', 'FGM', 'FGA'), ('FG3_PCT', 'FG3M', 'FG3A'), ('FT_PCT', 'FTM', 'FTA')):
+    total[pct] = round(total[made] / total[attempted], 3) if total[attempted] else 0.0
+  return total
+
+def _resultSet(name: str, headers: list[str], rows: list[dict]) -> dict:
+  return {"name": name, "headers": headers, "rowSet": [[row[h] for h in headers] for row in rows]}
+
+def syntheticCareerResponse(seasons: int = 20, playoff_seasons: int = 12, traded_every: int = 6,
+                            seed: int = 0) -> str:
+  '''A playercareerstats response, with a TOT row plus team rows for traded seasons'''
+  rng = random.Random(seed)
+  ids = {'PLAYER_ID': 1, 'LEAGUE_ID': '00'}
+
+  def seasonRows(count: int, traded: bool) -> list[dict]:
+    rows = []
+    for i in range(count):
+      season = {'SEASON_ID': f"{2000 + i}-{(i + 1) % 100:02d}", 'PLAYER_AGE': 19.0 + i}
+      if traded and traded_every and i % traded_every == traded_every - 1:
+        halves = [_line(rng, 30), _line(rng, 40)]
+        tot = _careerRow(halves)
+        rows.append({**ids, **season, 'TEAM_ID': 0, 'TEAM_ABBREVIATION': 'TOT', **tot})
+        for n, half in enumerate(halves):
+          rows.append({**ids, **season, 'TEAM_ID': 1610612737 + n, 'TEAM_ABBREVIATION': f"T{n}", **half})
+      else:
+        line = _line(rng, 82 if traded else 10)
+        rows.append({**ids, **season, 'TEAM_ID': 1610612739, 'TEAM_ABBREVIATION': 'CLE', **line})
+    return rows
+
+  regular = seasonRows(seasons, True)
+  playoff = seasonRows(playoff_seasons, False)
+  result_sets = [
+    _resultSet("SeasonTotalsRegularSeason", _SEASON_HEADERS, regular),
+    _resultSet("CareerTotalsRegularSeason", _CAREER_HEADERS,
+               [{**ids, 'TEAM_ID': 0, **_careerRow([r for r in regular if r['TEAM_ABBREVIATION'] in ('TOT', 'CLE')])}]),
+    _resultSet("SeasonTotalsPostSeason", _SEASON_HEADERS, playoff),
+    _resultSet("CareerTotalsPostSeason", _CAREER_HEADERS,
+               [{**ids, 'TEAM_ID': 0, **_careerRow(playoff)}] if playoff else []),
+  ]
+  result_sets += [{"name": name, "headers": ['PLAYER_ID'], "rowSet": []} for name in _UNUSED_SETS]
+  return json.dumps({"resource": "playercareerstats", "parameters": {}, "resultSets": result_sets})
+
+def loadCareer(text: str) -> playercareerstats.PlayerCareerStats:
+  '''Builds the endpoint object from a saved response without any network access'''
+  career = playercareerstats.PlayerCareerStats.__new__(playercareerstats.PlayerCareerStats)
+  career.nba_response = NBAStatsResponse(response=text, status_code=200, url="")
+  career.load_response()
+  return career
+
+def legacyStats(nba_res) -> dict:
+  '''The iterrows/Statline version of PlayerStats._buildStats'''
+  def perGame(totals: pd.DataFrame) -> pd.DataFrame:
+    ignored_cols = ['GS', 'GP', 'FG_PCT', 'FG3_PCT', 'FT_PCT', 'SEASON_ID', 'TEAM_ABBREVIATION', 'PLAYER_AGE']
+    per_game_stats = totals.copy(deep = True)
+    altered_cols = per_game_stats.columns.difference(ignored_cols)
+    per_game_stats[altered_cols] = per_game_stats[altered_cols].div(per_game_stats['GP'], axis=0)
+    return per_game_stats
+
+  def seasonDict(row: pd.Series) -> dict:
+    season_dict = Statline.loadFromSeries(row).model_dump()
+    season_dict['season'] = row.loc['SEASON_ID']
+    season_dict['team'] = row.loc['TEAM_ABBREVIATION']
+    return season_dict
+
+  dropped_cols = ['PLAYER_ID', 'LEAGUE_ID', 'TEAM_ID']
+  frames = {
+    REGULAR_STR: (nba_res.career_totals_regular_season.get_data_frame().drop(columns=dropped_cols),
+                  nba_res.season_totals_regular_season.get_data_frame().drop(columns=dropped_cols)),
+    PLAYOFF_STR: (nba_res.career_totals_post_season.get_data_frame().drop(columns=dropped_cols),
+                  nba_res.season_totals_post_season.get_data_frame().drop(columns=dropped_cols)),
+  }
+  stats = {}
+  for season_type, (career, seasons) in frames.items():
+    if career.empty:
+      continue
+    stats[season_type] = {}
+    for stat_mode, career_df, season_df in ((TOTAL_STR, career, seasons),
+                                            (PERGAME_STR, perGame(career), perGame(seasons))):
+      stats[season_type][stat_mode] = {
+        CAREER_STR: Statline.loadFromSeries(career_df.iloc[0]).model_dump(),
+        SEASON_STR: [seasonDict(row) for _, row in season_df.iterrows()]
+      }
+  return stats
+
+def _typed(value):
+  '''Makes 1 and 1.0 compare unequal, since they serialize differently'''
+  if isinstance(value, dict):
+    return {key: _typed(item) for key, item in value.items()}
+  if isinstance(value, list):
+    return [_typed(item) for item in value]
+  return (type(value).__name__, value)
+
+def sameStats(a: dict, b: dict) -> bool:
+  return json.dumps(_typed(a), sort_keys=False) == json.dumps(_typed(b), sort_keys=False)
+
+def _measure(func, career, runs: int) -> float:
+  times = []
+  for _ in range(runs):
+    start = perf_counter()
+    func(career)
+    times.append(perf_counter() - start)
+  return median(times)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--fixture", help="saved playercareerstats response")
+  parser.add_argument("--seasons", type=int, default=20)
+  parser.add_argument("--runs", type=int, default=20)
+  args = parser.parse_args()
+
+  text = open(args.fixture).read() if args.fixture else syntheticCareerResponse(args.seasons)
+  career = loadCareer(text)
+  if not sameStats(legacyStats(career), PlayerStats._buildStats(career)):
+    raise AssertionError("stats trees differ")
+
+  old_time = _measure(legacyStats, career, args.runs)
+  new_time = _measure(PlayerStats._buildStats, career, args.runs)
+  rows = len(career.season_totals_regular_season.get_dict()['data']) + len(career.season_totals_post_season.get_dict()['data'])
+  print(f"career stats ({rows} season rows)")
+  print(f"  iterrows + Statline  {old_time * 1000:8.2f} ms")
+  print(f"  vectorized           {new_time * 1000:8.2f} ms  ({old_time / new_time:.0f}x faster)")
+
+  tree = PlayerStatsOut(player_name="", player_id=1, player_headshot="", stats=legacyStats(career))
+  compact = PlayerStats._buildCareer(1, "", "", career)
+  old_size, new_size = estimateSize(tree), estimateSize(compact)
+  print("cached career")
+  print(f"  PlayerStatsOut tree  {old_size / 1024:8.1f} KB")
+  print(f"  Career tables        {new_size / 1024:8.1f} KB  ({old_size / new_size:.0f}x smaller)")
+
+if __name__ == "__main__":
+  main()
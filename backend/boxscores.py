@@ -1,41 +1,70 @@
 from nba_api.stats.endpoints import boxscoretraditionalv3, boxscoresummaryv3
 
-from time import monotonic, sleep
+import asyncio
 from abc import ABC, abstractmethod
-import pandas as pd
-
-from callQueue import CallQueue
-
-class StatObj:
-  def __init__(self):
-    self.values = {}
-    self._statList = ['fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb',
-                      'ast', 'blk', 'stl', 'pts', 'pf', 'min']
-    for stat in self._statList:
-      self.values[stat] = None
-
-  def getValues(self) -> dict:
-    # work on a copy so the returned value doesnt affect the source
-    copy = self.values.copy()
-
-    # extra stats
-    copy['reb'] = copy['oreb'] + copy['dreb']
-    copy['fg_pct'] = 0 if copy['fga'] == 0 else copy['fgm'] / copy['fga']
-    copy['fg3_pct'] = 0 if copy['fg3a'] == 0 else copy['fg3m'] / copy['fg3a']
-    copy['ft_pct'] = 0 if copy['fta'] == 0 else copy['ftm'] / copy['fta']
-    copy['efg_pct'] = 0 if copy['fga'] == 0 else ( copy['fgm'] + 0.5 * copy['fg3m'] ) / copy['fga']
-
-    return copy
-  
-  @staticmethod
-  def loadFromSeries(source: pd.Series) -> "StatObj":
-    newObj = StatObj()
-    for stat in newObj._statList:
-      try:
-        newObj.values[stat] = source.loc[stat]
-      except KeyError:
-        newObj.values[stat] = 0
-    return newObj
+import numpy as np
+
+from cachedService import CachedService, Freshness
+from callQueue import CallQueue, Priority
+from executor import runBlocking
+from singleFlight import SingleFlight
+from upstream import observe, UpstreamUnavailable
+from store import CacheStore
+from seasons import currentSeasonStartYear, gameSeasonStartYear
+from games import Games
+
+# V3 stat columns and the keys they are returned under, in response order
+_STAT_COLUMNS = {
+  "fieldGoalsMade": "fgm", "fieldGoalsAttempted": "fga",
+  "threePointersMade": "fg3m", "threePointersAttempted": "fg3a",
+  "freeThrowsMade": "ftm", "freeThrowsAttempted": "fta",
+  "reboundsOffensive": "oreb", "reboundsDefensive": "dreb",
+  "assists": "ast", "blocks": "blk", "steals": "stl",
+  "points": "pts", "foulsPersonal": "pf", "minutes": "min"
+}
+
+def _columns(data_set) -> dict[str, tuple]:
+  data = data_set.get_dict()
+  return dict(zip(data['headers'], zip(*data['data'])))
+
+def _pct(made: np.ndarray, attempted: np.ndarray) -> list:
+  with np.errstate(divide='ignore', invalid='ignore'):
+    pct = made / attempted
+  # No attempts is a plain 0, not 0.0
+  return [value if tried != 0 else 0 for value, tried in zip(pct.tolist(), attempted.tolist())]
+
+def _statLines(columns: dict[str, tuple], rows: int) -> list[dict]:
+  '''Stat dicts for every row, with rebounds and shooting percentages derived column-wise'''
+  # A column upstream leaves out counts as zeros
+  stats = {key: columns.get(column, (0,) * rows) for column, key in _STAT_COLUMNS.items()}
+  arrays = {key: np.asarray(stats[key]) for key in ('fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb')}
+
+  stats['reb'] = (arrays['oreb'] + arrays['dreb']).tolist()
+  stats['fg_pct'] = _pct(arrays['fgm'], arrays['fga'])
+  stats['fg3_pct'] = _pct(arrays['fg3m'], arrays['fg3a'])
+  stats['ft_pct'] = _pct(arrays['ftm'], arrays['fta'])
+  stats['efg_pct'] = _pct(arrays['fgm'] + 0.5 * arrays['fg3m'], arrays['fga'])
+  return [dict(zip(stats, row)) for row in zip(*stats.values())]
+
+def _teamLogo(team_id: int) -> str:
+  return f"https://cdn.nba.com/logos/nba/{team_id}/primary/L/logo.svg"
+
+def _summaryHeader(summary: boxscoresummaryv3.BoxScoreSummaryV3) -> dict:
+  '''Status and (team_id, team_city) pairs, home team first, from a box score summary'''
+  game_summary = _columns(summary.game_summary)
+  team_columns = _columns(summary.other_stats)
+  return {
+    "status": game_summary['gameStatusText'][0],
+    "teams": list(zip(team_columns.get('teamId', ()), team_columns.get('teamCity', ())))
+  }
+
+def _scoreboardHeader(game: dict) -> dict:
+  '''The same, from a Games scoreboard entry'''
+  return {
+    "status": game['status'],
+    "teams": [(game['home_team']['team_id'], game['home_team']['city']),
+              (game['away_team']['team_id'], game['away_team']['city'])]
+  }
 
 class BoxscoreInterface(ABC):
   @abstractmethod
@@ -46,13 +75,33 @@ class BoxscoreInterface(ABC):
   def getBoxscore(self, game_id: str) -> dict:
     pass
 
-class Boxscores(BoxscoreInterface):
-  def __init__(self, call_queue: CallQueue):
-    self.boxscores = {}
-    self.last_access = {}
-    self.call_queue = call_queue
+  @abstractmethod
+  async def getBoxscoreAsync(self, game_id: str) -> dict:
+    pass
 
-    self.wait_time = 30
+class Boxscores(BoxscoreInterface, CachedService):
+  SOFT_TTL = 30
+  HARD_TTL = 60 * 60
+  # Full player lines make these the largest entries we hold
+  MAX_ENTRIES = 500
+  MAX_BYTES = 64 * 1024 * 1024
+
+  def __init__(self, call_queue: CallQueue, inflight: SingleFlight = None, serve_stale: bool = True,
+               store: CacheStore = None, games: Games = None):
+    CachedService.__init__(self, "boxscores", call_queue, inflight, serve_stale, store)
+    self.boxscores = self.cache
+    # Scoreboards already know the status of finished games
+    self.games = games
+    self.summaries_fetched = 0
+    self.summaries_skipped = 0
+
+  def _classify(self, game_id: str, score: dict) -> Freshness:
+    if not score["status"].startswith("Final"):
+      return Freshness.LIVE
+    # Stat corrections only land during the season the game was played
+    if gameSeasonStartYear(game_id) < currentSeasonStartYear():
+      return Freshness.FINAL
+    return Freshness.SETTLING
 
   def _validateId(self, game_id: str):
     if not isinstance(game_id, str):
@@ -60,169 +109,144 @@ class Boxscores(BoxscoreInterface):
     if len(game_id) != 10 or not game_id.isnumeric():
       raise ValueError("game_id must be numeric and have length 10")
 
-  def _getTeamStatsDf(self, res: boxscoretraditionalv3.BoxScoreTraditionalV3) -> pd.DataFrame:
-    team_stats_df = res.team_stats.get_data_frame()[["teamId", 'teamCity', 'minutes',
-                                                     'fieldGoalsMade', 'fieldGoalsAttempted',
-                                                     'threePointersMade', 'threePointersAttempted',
-                                                     'freeThrowsMade', 'freeThrowsAttempted',
-                                                     'reboundsOffensive', 'reboundsDefensive',
-                                                     'assists', 'steals', 'blocks', 'turnovers',
-                                                     'points', 'foulsPersonal']]
-    
-    team_stats_df = team_stats_df.rename(columns={"teamId": "team_id", "teamCity": "team_city",
-                                                  "minutes": "min", "fieldGoalsMade": "fgm",
-                                                  "fieldGoalsAttempted": "fga",
-                                                  "threePointersMade": "fg3m",
-                                                  "threePointersAttempted": "fg3a",
-                                                  "freeThrowsMade": "ftm", "freeThrowsAttempted":
-                                                  "fta", "reboundsOffensive": "oreb",
-                                                  "reboundsDefensive": "dreb", "assists": "ast",
-                                                  "steals": "stl", "blocks": "blk", "turnovers":
-                                                  "tov", "points": "pts", "foulsPersonal": "pf"})
-
-    return team_stats_df
-  
-  def _getPlayerStatsDf(self, boxscore: boxscoretraditionalv3.BoxScoreTraditionalV3) -> pd.DataFrame:
-    player_stats_df = boxscore.player_stats.get_data_frame()[["teamId", "personId", "nameI",
-                                                              "position", "jerseyNum", "minutes",
-                                                              "fieldGoalsMade",
-                                                              "fieldGoalsAttempted",
-                                                              "threePointersMade",
-                                                              "threePointersAttempted",
-                                                              "freeThrowsMade",
-                                                              "freeThrowsAttempted",
-                                                              "reboundsOffensive",
-                                                              "reboundsDefensive",
-                                                              "assists", "steals", "blocks",
-                                                              "turnovers", "points",
-                                                              "foulsPersonal"]]
-    
-    player_stats_df = player_stats_df.rename(columns={"teamId": "team_id", "personId": "player_id",
-                                                      "nameI": "player_name", "jerseyNum":
-                                                      "jersey", "minutes": "min", "fieldGoalsMade":
-                                                      "fgm", "fieldGoalsAttempted": "fga",
-                                                      "threePointersMade": "fg3m",
-                                                      "threePointersAttempted": "fg3a",
-                                                      "freeThrowsMade": "ftm",
-                                                      "freeThrowsAttempted": "fta",
-                                                      "reboundsOffensive": "oreb",
-                                                      "reboundsDefensive": "dreb", "assists":
-                                                      "ast", "steals": "stl", "blocks": "blk",
-                                                      "turnovers": "tov", "points": "pts",
-                                                      "foulsPersonal": "pf"})
-
-    return player_stats_df
-
-  def _getTeamInfoDf(self, res: boxscoresummaryv3.BoxScoreSummaryV3) -> pd.DataFrame:
-    team_info_df = res.other_stats.get_data_frame()[["teamId", "teamCity"]]
-    team_info_df = team_info_df.rename(columns={"teamId": "team_id", "teamCity": "team_city"})
-
-    return team_info_df
-
-  def _waitForCall(self) -> None:
-    c = self.call_queue.addCall()
-    delay = c.ready_time - monotonic()
-    if delay > 0:
-      sleep(delay)
-
-  def _getApiRes(self, game_id: str):
-    self._waitForCall()
+  def _fetchSummary(self, game_id: str):
     try:
-      summary = boxscoresummaryv3.BoxScoreSummaryV3(game_id=game_id)
-    except:
-      # If summary doesn't exist, neither does the game
-      return None, None, None
-    
-    score_exists = True
-    self._waitForCall()
+      return observe(self.call_queue, boxscoresummaryv3.BoxScoreSummaryV3, game_id=game_id)
+    except UpstreamUnavailable:
+      raise
+    except Exception:
+      return None
+
+  def _fetchTraditional(self, game_id: str):
     try:
       # Game exists and so does its box score
-      boxscore = boxscoretraditionalv3.BoxScoreTraditionalV3(game_id=game_id)
+      boxscore = observe(self.call_queue, boxscoretraditionalv3.BoxScoreTraditionalV3, game_id=game_id)
       if len(boxscore.player_stats.get_dict()['data']) == 0:
+        return None, None
+    except UpstreamUnavailable:
+      raise
+    except Exception:
+      return None, False
+    return boxscore, True
+
+  def _knownHeader(self, game_id: str) -> dict:
+    game = None if self.games is None else self.games.finishedGame(game_id)
+    if game is None:
+      return None
+    self.summaries_skipped += 1
+    return _scoreboardHeader(game)
+
+  def _getApiRes(self, game_id: str):
+    header = self._knownHeader(game_id)
+    if header is None:
+      self.call_queue.wait()
+      summary = self._fetchSummary(game_id)
+      if summary is None:
+        # If summary doesn't exist, neither does the game
         return None, None, None
-    except:
-      boxscore = None
-      score_exists = False
-    return boxscore, summary, score_exists
+      self.summaries_fetched += 1
+      header = _summaryHeader(summary)
+    
+    self.call_queue.wait()
+    boxscore, score_exists = self._fetchTraditional(game_id)
+    if score_exists is None:
+      return None, None, None
+    return boxscore, header, score_exists
 
-  def _getStatsDict(self, row: pd.Series):
-    stats = StatObj.loadFromSeries(row).getValues()
-    return stats
+  async def _getApiResAsync(self, game_id: str, priority: Priority = Priority.INTERACTIVE):
+    async def summary():
+      await self.call_queue.acquire(priority)
+      return await runBlocking(self._fetchSummary, game_id)
 
-  def getBoxscore(self, game_id: str) -> dict:
-    if game_id in self.boxscores.keys() and (monotonic() - self.last_access[game_id]) <= self.wait_time:
-      return self.boxscores[game_id]
+    async def traditional():
+      await self.call_queue.acquire(priority)
+      return await runBlocking(self._fetchTraditional, game_id)
 
-    self._validateId(game_id)
-    boxscore, summary, score_exists = self._getApiRes(game_id)
+    header = self._knownHeader(game_id)
+    if header is not None:
+      boxscore, score_exists = await traditional()
+    else:
+      if await self.call_queue.availableAsync(2):
+        # Both slots are free right now, so the calls go out together
+        res, (boxscore, score_exists) = await asyncio.gather(summary(), traditional())
+      else:
+        # Overlapping would save nothing, and a game without a summary
+        # shouldn't spend a second slot
+        res = await summary()
+        boxscore, score_exists = (None, None) if res is None else await traditional()
+      if res is None:
+        return None, None, None
+      self.summaries_fetched += 1
+      header = _summaryHeader(res)
+
+    if score_exists is None:
+      return None, None, None
+    return boxscore, header, score_exists
+
+  def _load(self, game_id: str) -> dict:
+    boxscore, header, score_exists = self._getApiRes(game_id)
+    if score_exists is None:
+      return None
+    return self._buildBoxscore(boxscore, header, score_exists)
+
+  async def _loadAsync(self, game_id: str, priority: Priority = Priority.INTERACTIVE) -> dict:
+    boxscore, header, score_exists = await self._getApiResAsync(game_id, priority)
     if score_exists is None:
       return None
-    self.last_access[game_id] = monotonic()
+    return await runBlocking(self._buildBoxscore, boxscore, header, score_exists)
+
+  def stats(self) -> dict:
+    return {
+      "summaries_fetched": self.summaries_fetched,
+      "summaries_skipped": self.summaries_skipped
+    }
 
+  def getBoxscore(self, game_id: str) -> dict:
+    self._validateId(game_id)
+    return self._getCached(game_id)
+
+  async def getBoxscoreAsync(self, game_id: str) -> dict:
+    self._validateId(game_id)
+    return await self._getCachedAsync(game_id)
+
+  def _buildBoxscore(self, boxscore, header: dict, score_exists: bool) -> dict:
     score = {
       "team_0": {},
       "team_1": {},
       "score_exists": score_exists,
-      "status": summary.game_summary.get_data_frame().iloc[0].loc['gameStatusText']
+      "status": header["status"]
     }
 
     if score_exists:
-      team_stats_df = self._getTeamStatsDf(boxscore)
-
-      sample_team = {
-        "team_id" : None,
-        "team_city" : None,
-        "team_logo" : None,
-        "team_stats" : {},
-      }
-      score["team_0"] = sample_team.copy()
-      score["team_1"] = sample_team.copy()
-
-      score["team_0"]["player_stats"] = []
-      score["team_1"]["player_stats"] = []
-
-      i = 0
-      for _, row in team_stats_df.iterrows():
-        team = score[f"team_{i}"]
-        team["team_id"] = row.loc['team_id']
-        team["team_city"] = row.loc['team_city']
-        team["team_logo"] = f"https://cdn.nba.com/logos/nba/{team['team_id']}/primary/L/logo.svg"
-        team["team_stats"] = self._getStatsDict(row)
-        i += 1
-
-      player_stats_df = self._getPlayerStatsDf(boxscore)
-      for _, row in player_stats_df.iterrows():
-        player = {}
-        player["player_name"] = row.loc["player_name"]
-        player["player_id"] = row.loc["player_id"]
-        player["position"] = row.loc["position"]
-        player["started"] = player["position"] != ""
-        #player["jersey"] = row.loc["jersey"]
-        player["stats"] = self._getStatsDict(row)
-
-        if row.loc["team_id"] == score["team_0"]["team_id"]:
-          score["team_0"]['player_stats'].append(player)
-        elif row.loc["team_id"] == score["team_1"]["team_id"]:
-          score["team_1"]['player_stats'].append(player)
+      team_columns = _columns(boxscore.team_stats)
+      team_ids = list(team_columns['teamId'])
+      team_lines = _statLines(team_columns, len(team_ids))
+      for i in range(2):
+        score[f"team_{i}"] = {"team_id": None, "team_city": None, "team_logo": None, "team_stats": {}, "player_stats": []}
+      for i, team_id in enumerate(team_ids[:2]):
+        score[f"team_{i}"].update(team_id=team_id, team_city=team_columns['teamCity'][i],
+                                  team_logo=_teamLogo(team_id), team_stats=team_lines[i])
+
+      player_columns = _columns(boxscore.player_stats)
+      player_team_ids = np.asarray(player_columns['teamId'])
+      player_lines = _statLines(player_columns, len(player_team_ids))
+      names = player_columns['nameI']
+      player_ids = player_columns['personId']
+      positions = player_columns['position']
+      # Rows of players on neither team are dropped
+      for i, team_id in enumerate(team_ids[:2]):
+        score[f"team_{i}"]["player_stats"] = [{
+          "player_name": names[row],
+          "player_id": player_ids[row],
+          "position": positions[row],
+          "started": positions[row] != "",
+          "stats": player_lines[row]
+        } for row in np.flatnonzero(player_team_ids == team_id).tolist()]
 
     else:
-      team_info_df = self._getTeamInfoDf(summary)
-
-      sample_team = {
-        "team_id" : None,
-        "team_city" : None,
-        "team_logo" : None
-      }
-      score["team_0"] = sample_team.copy()
-      score["team_1"] = sample_team.copy()
-
-      i = 0
-      for _, row in team_info_df.iterrows():
-        team = score[f"team_{i}"]
-        team["team_id"] = row.loc["team_id"]
-        team["team_city"] = row.loc["team_city"]
-        team["team_logo"] = f"https://cdn.nba.com/logos/nba/{team['team_id']}/primary/L/logo.svg"
-        i += 1
-
-    self.boxscores[game_id] = score
-    return score
\ No newline at end of file
+      for i in range(2):
+        score[f"team_{i}"] = {"team_id": None, "team_city": None, "team_logo": None}
+      for i, (team_id, team_city) in enumerate(header["teams"][:2]):
+        score[f"team_{i}"].update(team_id=team_id, team_city=team_city, team_logo=_teamLogo(team_id))
+
+    return score
@@ -0,0 +1,85 @@
+from time import monotonic
+from threading import Lock
+from enum import Enum
+
+from upstream import UpstreamUnavailable
+
+class CircuitOpen(UpstreamUnavailable):
+  pass
+
+class BreakerState(Enum):
+  CLOSED = 1     # calls go through
+  OPEN = 2       # upstream is failing, calls are refused without trying
+  HALF_OPEN = 3  # one trial call is allowed through to test recovery
+
+class CircuitBreaker:
+  '''
+  Stops queueing calls for an endpoint that keeps failing. After
+  failure_threshold consecutive upstream failures the breaker opens and
+  check() raises CircuitOpen straight away. Once reset_timeout has passed a
+  single trial call is let through; its result closes or reopens the breaker.
+  '''
+  def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+    self.name = name
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+
+    self.state = BreakerState.CLOSED
+    self.failures = 0
+    self.opened_at = 0.0
+    self.rejected = 0
+    self._trial_running = False
+    self._lock = Lock()
+
+  def __repr__(self) -> str:
+    return f'{self.name}: {self.state.name.lower()} | {self.failures} failures | {self.rejected} rejected'
+
+  def allows(self) -> bool:
+    '''Whether check() would currently let a call through, without claiming the trial'''
+    with self._lock:
+      if self.state == BreakerState.CLOSED:
+        return True
+      if self.state == BreakerState.OPEN:
+        return monotonic() - self.opened_at >= self.reset_timeout
+      return not self._trial_running
+
+  def check(self) -> None:
+    '''Raises CircuitOpen if a call should not be attempted right now'''
+    with self._lock:
+      if self.state == BreakerState.OPEN and monotonic() - self.opened_at >= self.reset_timeout:
+        self.state = BreakerState.HALF_OPEN
+        self._trial_running = False
+      if self.state == BreakerState.CLOSED:
+        return
+      if self.state == BreakerState.HALF_OPEN and not self._trial_running:
+        self._trial_running = True
+        return
+      self.rejected += 1
+    raise CircuitOpen(f"{self.name} is unavailable")
+
+  def recordSuccess(self) -> None:
+    with self._lock:
+      self.state = BreakerState.CLOSED
+      self.failures = 0
+      self._trial_running = False
+
+  def recordFailure(self) -> None:
+    with self._lock:
+      self.failures += 1
+      if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+        self.state = BreakerState.OPEN
+        self.opened_at = monotonic()
+      self._trial_running = False
+
+  def abandonTrial(self) -> None:
+    '''Frees the trial slot when a call ended without telling us anything about upstream'''
+    with self._lock:
+      self._trial_running = False
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        "state": self.state.name.lower(),
+        "failures": self.failures,
+        "rejected": self.rejected
+      }
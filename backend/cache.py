@@ -0,0 +1,201 @@
+from time import monotonic
+from threading import Lock
+from collections import OrderedDict
+import sys
+
+# Marks a TTL argument that was not given, since None means "never"
+_DEFAULT = object()
+
+def estimateSize(value) -> int:
+  '''Rough deep size in bytes of a cached value'''
+  seen = set()
+  total = 0
+  stack = [value]
+  while stack:
+    obj = stack.pop()
+    if id(obj) in seen:
+      continue
+    seen.add(id(obj))
+    total += sys.getsizeof(obj)
+
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+      continue
+    if isinstance(obj, dict):
+      stack.extend(obj.keys())
+      stack.extend(obj.values())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+      stack.extend(obj)
+    else:
+      if hasattr(obj, 'nbytes'):
+        # numpy arrays report their buffer separately
+        total += obj.nbytes
+      if hasattr(obj, '__dict__'):
+        stack.append(vars(obj))
+      for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+          stack.append(getattr(obj, slot))
+  return total
+
+class CacheEntry:
+  def __init__(self, value, soft_ttl: float, hard_ttl: float = None, size: int = 0, age: float = 0.0):
+    self.value = value
+    self.fetched_at = monotonic() - age
+    self.soft_ttl = soft_ttl
+    self.hard_ttl = hard_ttl
+    self.size = size
+
+  def age(self) -> float:
+    return monotonic() - self.fetched_at
+
+  def isFresh(self) -> bool:
+    '''Fresh entries are served without contacting upstream'''
+    return self.soft_ttl is None or self.age() <= self.soft_ttl
+
+  def isExpired(self) -> bool:
+    '''Expired entries are too old to serve while refreshing in the background'''
+    return self.hard_ttl is not None and self.age() > self.hard_ttl
+
+class Cache:
+  '''
+  Bounded keyed store of CacheEntry objects with a soft and a hard TTL.
+
+  Between the two TTLs an entry is stale: still servable, but due a refresh.
+  A hard_ttl of None means entries never expire. Expired entries are dropped
+  unless keep_expired is set, in which case they stay around as a fallback
+  but are the first to go when the cache is over max_entries or max_bytes.
+  After that the least recently used entries are evicted.
+  '''
+  def __init__(self, soft_ttl: float, hard_ttl: float = None, max_entries: int = None,
+               max_bytes: int = None, keep_expired: bool = False):
+    if hard_ttl is not None and hard_ttl < soft_ttl:
+      raise ValueError("hard_ttl must not be shorter than soft_ttl")
+    self.soft_ttl = soft_ttl
+    self.hard_ttl = hard_ttl
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.keep_expired = keep_expired
+
+    self._entries: OrderedDict = OrderedDict()
+    self._lock = Lock()
+    self.total_bytes = 0
+
+    self.hits = 0
+    self.stale_hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+
+  def __repr__(self) -> str:
+    return f'{len(self)} entries ({self.total_bytes} bytes) | {self.hits} hits | {self.misses} misses | {self.evictions} evictions'
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def __contains__(self, key) -> bool:
+    return key in self._entries
+
+  def lookup(self, key) -> CacheEntry:
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      if entry.isExpired() and not self.keep_expired:
+        self._remove(key)
+        self.expirations += 1
+        self.misses += 1
+        return None
+
+      self._entries.move_to_end(key)
+      if entry.isFresh():
+        self.hits += 1
+      else:
+        self.stale_hits += 1
+      return entry
+
+  def peek(self, key) -> CacheEntry:
+    '''Returns the entry for key, if any, without touching LRU order or counters'''
+    with self._lock:
+      return self._entries.get(key)
+
+  def get(self, key):
+    '''Returns the value for key if it is fresh, otherwise None'''
+    entry = self.lookup(key)
+    if entry is None or not entry.isFresh():
+      return None
+    return entry.value
+
+  def set(self, key, value, soft_ttl: float = _DEFAULT, hard_ttl: float = _DEFAULT,
+          age: float = 0.0) -> CacheEntry:
+    '''
+    Stores value under key. Passing None for a TTL means the entry never goes
+    stale or expires, and age backdates values that were fetched earlier.
+    '''
+    size = estimateSize(value) if self.max_bytes is not None else 0
+    entry = CacheEntry(value,
+                       self.soft_ttl if soft_ttl is _DEFAULT else soft_ttl,
+                       self.hard_ttl if hard_ttl is _DEFAULT else hard_ttl,
+                       size, age)
+    with self._lock:
+      if key in self._entries:
+        self._remove(key)
+      self._entries[key] = entry
+      self.total_bytes += size
+      self._enforceLimits()
+    return entry
+
+  def invalidate(self, key) -> None:
+    with self._lock:
+      if key in self._entries:
+        self._remove(key)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+      self.total_bytes = 0
+
+  def prune(self) -> int:
+    '''Drops every expired entry, returning how many were removed'''
+    with self._lock:
+      return self._pruneExpired()
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        "entries": len(self._entries),
+        "bytes": self.total_bytes,
+        "hits": self.hits,
+        "stale_hits": self.stale_hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "expirations": self.expirations
+      }
+
+  def _remove(self, key) -> CacheEntry:
+    entry = self._entries.pop(key)
+    self.total_bytes -= entry.size
+    return entry
+
+  def _overLimit(self) -> bool:
+    if self.max_entries is not None and len(self._entries) > self.max_entries:
+      return True
+    if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+      return True
+    return False
+
+  def _pruneExpired(self) -> int:
+    expired = [key for key, entry in self._entries.items() if entry.isExpired()]
+    for key in expired:
+      self._remove(key)
+    self.expirations += len(expired)
+    return len(expired)
+
+  def _enforceLimits(self) -> None:
+    if not self._overLimit():
+      return
+    self._pruneExpired()
+    # Always keep the newest entry, even if it alone is over max_bytes
+    while self._overLimit() and len(self._entries) > 1:
+      key = next(iter(self._entries))
+      self._remove(key)
+      self.evictions += 1
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import logging
+from enum import Enum
+
+from cache import Cache, CacheEntry
+from callQueue import CallQueue, Priority
+from executor import runBlocking, runIo
+from singleFlight import SingleFlight
+from store import CacheStore
+from breaker import CircuitBreaker
+from upstream import UpstreamUnavailable
+
+# Bumped when the envelope written to the store changes
+STORE_FORMAT = 1
+
+log = logging.getLogger(__name__)
+
+def _jsonDefault(obj):
+  # numpy scalars from DataFrame rows
+  if hasattr(obj, 'item'):
+    return obj.item()
+  raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+class Freshness(Enum):
+  LIVE = 1      # may change at any moment
+  SETTLING = 2  # finished, but stat corrections can still land
+  FINAL = 3     # will never change again
+
+class CachedService:
+  '''
+  Read-through caching shared by the nba_api backed services.
+
+  Fresh entries are returned straight from the cache. A stale entry is still
+  returned, and a background task refetches it through the CallQueue. Only a
+  missing or expired entry makes the caller wait for upstream, and if that
+  fetch fails an expired entry is served instead when serve_stale is set.
+
+  Keys upstream has no data for are cached as None for NEGATIVE_TTL, so
+  repeated requests for a bad id don't spend rate-limit slots. When
+  upstream itself is failing, the service's circuit breaker opens and
+  misses raise UpstreamUnavailable without queueing for a slot.
+
+  Subclasses implement _fetch(key), a blocking call returning the value to
+  cache or None when nothing could be loaded, and size their cache through
+  the class attributes below. Overriding _classify lets settled data use
+  longer TTLs, and final data is cached with no TTL at all so rate-limit
+  slots only go to data that can still change.
+
+  With a store, entries are written through to it and local misses read
+  from it, so warm data survives restarts and is shared between workers.
+  The async paths do store I/O on a small pool of its own, so it never waits
+  behind slow fetches, and a failing store only costs the hit or the
+  write-through, never the request. Bump CACHE_VERSION whenever the shape of
+  a service's values changes.
+  '''
+  SOFT_TTL = 60
+  HARD_TTL = 60 * 60
+  SETTLING_SOFT_TTL = 6 * 60 * 60
+  SETTLING_HARD_TTL = 7 * 24 * 60 * 60
+  NEGATIVE_TTL = 5 * 60
+  CACHE_VERSION = 1
+  MAX_ENTRIES = 1000
+  MAX_BYTES = 32 * 1024 * 1024
+
+  def __init__(self, name: str, call_queue: CallQueue, inflight: SingleFlight = None,
+               serve_stale: bool = True, store: CacheStore = None):
+    self.name = name
+    self.call_queue = call_queue
+    self.store = store
+    # Expired entries are only worth keeping if they may be served on failure
+    self.cache = Cache(self.SOFT_TTL, self.HARD_TTL, self.MAX_ENTRIES, self.MAX_BYTES,
+                       keep_expired=serve_stale)
+    self.inflight = inflight if inflight is not None else SingleFlight()
+    self.serve_stale = serve_stale
+    self.breaker = CircuitBreaker(name)
+    self._refreshes: set[asyncio.Task] = set()
+
+  def _fetch(self, key):
+    raise NotImplementedError
+
+  def _load(self, key):
+    self.call_queue.wait()
+    return self._fetch(key)
+
+  async def _loadAsync(self, key, priority: Priority = Priority.INTERACTIVE):
+    await self.call_queue.acquire(priority)
+    return await runBlocking(self._fetch, key)
+
+  def _classify(self, key, value) -> Freshness:
+    return Freshness.LIVE
+
+  def _ttls(self, freshness: Freshness) -> tuple:
+    if freshness == Freshness.FINAL:
+      return None, None
+    if freshness == Freshness.SETTLING:
+      return self.SETTLING_SOFT_TTL, self.SETTLING_HARD_TTL
+    return self.SOFT_TTL, self.HARD_TTL
+
+  def _serialize(self, value):
+    '''Converts a value into something json.dumps accepts'''
+    return value
+
+  def _deserialize(self, data):
+    return data
+
+  def _storeKey(self, key) -> str:
+    return str(key)
+
+  def _storeVersion(self) -> str:
+    return f"{STORE_FORMAT}.{self.CACHE_VERSION}"
+
+  def _cacheValue(self, key, value) -> tuple:
+    '''Caches value locally and returns its TTLs, or None if it was not cached'''
+    if value is None:
+      existing = self.cache.peek(key)
+      if existing is not None and existing.value is not None:
+        # Don't forget data we had because one refresh came back empty, but
+        # don't spend another slot on it until NEGATIVE_TTL has passed either
+        hard_ttl = existing.hard_ttl
+        if hard_ttl is not None:
+          hard_ttl = max(hard_ttl - existing.age(), self.NEGATIVE_TTL)
+        self.cache.set(key, existing.value, self.NEGATIVE_TTL, hard_ttl)
+        return None
+      soft_ttl = hard_ttl = self.NEGATIVE_TTL
+    else:
+      soft_ttl, hard_ttl = self._ttls(self._classify(key, value))
+    self.cache.set(key, value, soft_ttl, hard_ttl)
+    return soft_ttl, hard_ttl
+
+  def _writeThrough(self, key, value, soft_ttl: float, hard_ttl: float) -> None:
+    payload = json.dumps(None if value is None else self._serialize(value), default=_jsonDefault)
+    try:
+      self.store.set(self.name, self._storeKey(key), self._storeVersion(), payload, soft_ttl, hard_ttl)
+    except Exception:
+      # The value is cached locally either way; other workers just miss it
+      log.warning("%s: skipped storing %r", self.name, key, exc_info=True)
+
+  def _store(self, key, value):
+    ttls = self._cacheValue(key, value)
+    if ttls is not None and self.store is not None:
+      self._writeThrough(key, value, *ttls)
+    return value
+
+  async def _storeAsync(self, key, value):
+    ttls = self._cacheValue(key, value)
+    if ttls is not None and self.store is not None:
+      await runIo(self._writeThrough, key, value, *ttls)
+    return value
+
+  def _lookup(self, key) -> CacheEntry:
+    entry = self.cache.lookup(key)
+    if self.store is None or (entry is not None and entry.isFresh()):
+      return entry
+    return self._readThrough(key, entry)
+
+  async def _lookupAsync(self, key) -> CacheEntry:
+    entry = self.cache.lookup(key)
+    if self.store is None or (entry is not None and entry.isFresh()):
+      return entry
+    return await runIo(self._readThrough, key, entry)
+
+  def _readThrough(self, key, entry: CacheEntry) -> CacheEntry:
+    # Another worker may have fetched (or refreshed) this key already
+    try:
+      item = self.store.get(self.name, self._storeKey(key), self._storeVersion())
+    except Exception:
+      log.warning("%s: store lookup failed for %r", self.name, key, exc_info=True)
+      return entry
+    if item is None or (entry is not None and item.age() >= entry.age()):
+      return entry
+    try:
+      data = json.loads(item.payload)
+      value = None if data is None else self._deserialize(data)
+    except (ValueError, TypeError, KeyError):
+      return entry
+    return self.cache.set(key, value, item.soft_ttl, item.hard_ttl, age=item.age())
+
+  def _fallback(self, entry: CacheEntry, value):
+    if value is None and entry is not None and self.serve_stale:
+      return entry.value
+    return value
+
+  def _loadGuarded(self, key):
+    self.breaker.check()
+    try:
+      value = self._load(key)
+    except UpstreamUnavailable:
+      self.breaker.recordFailure()
+      raise
+    except BaseException:
+      self.breaker.abandonTrial()
+      raise
+    self.breaker.recordSuccess()
+    return value
+
+  def _getCached(self, key):
+    entry = self._lookup(key)
+    if entry is not None and entry.isFresh():
+      return entry.value
+
+    # Without an event loop there is nothing to refresh in the background
+    try:
+      value = self._store(key, self._loadGuarded(key))
+    except UpstreamUnavailable:
+      if entry is not None and entry.value is not None and self.serve_stale:
+        return entry.value
+      raise
+    return self._fallback(entry, value)
+
+  async def _getCachedAsync(self, key):
+    entry = await self._lookupAsync(key)
+    if entry is not None and entry.isFresh():
+      return entry.value
+    if entry is not None and not entry.isExpired():
+      self._scheduleRefresh(key)
+      return entry.value
+
+    # Concurrent misses for the same key share one fetch
+    try:
+      value = await self.inflight.do(self.name, key, lambda: self._refreshAsync(key))
+    except UpstreamUnavailable:
+      if entry is not None and entry.value is not None and self.serve_stale:
+        return entry.value
+      raise
+    return self._fallback(entry, value)
+
+  async def _refreshAsync(self, key, priority: Priority = Priority.INTERACTIVE):
+    if self.store is not None:
+      # Skip upstream if another worker refreshed this key while we waited
+      entry = await self._lookupAsync(key)
+      if entry is not None and entry.isFresh():
+        return entry.value
+    # Fail fast rather than queue for a slot while upstream is down
+    self.breaker.check()
+    try:
+      value = await self._loadAsync(key, priority)
+    except UpstreamUnavailable:
+      self.breaker.recordFailure()
+      raise
+    except BaseException:
+      self.breaker.abandonTrial()
+      raise
+    self.breaker.recordSuccess()
+    return await self._storeAsync(key, value)
+
+  def _scheduleRefresh(self, key) -> None:
+    if self.inflight.inFlight(self.name, key) or not self.breaker.allows():
+      return
+    # Nobody is waiting on this fetch, so let interactive requests go first
+    task = asyncio.ensure_future(self.inflight.do(self.name, key, lambda: self._refreshAsync(key, Priority.REFRESH)))
+    self._refreshes.add(task)
+    task.add_done_callback(self._refreshDone)
+
+  def _refreshDone(self, task: asyncio.Task) -> None:
+    self._refreshes.discard(task)
+    # A failed refresh leaves the old entry in place
+    if not task.cancelled():
+      task.exception()
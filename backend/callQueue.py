@@ -1,5 +1,20 @@
-from time import monotonic
+from time import monotonic, sleep, time
 from threading import Lock
+from enum import Enum, IntEnum
+import threading
+import asyncio
+import heapq
+import json
+import itertools
+import sqlite3
+
+from executor import runIo
+
+class Priority(IntEnum):
+    '''Lower values are served first'''
+    INTERACTIVE = 0  # a user is waiting on the response
+    REFRESH = 1      # revalidating data we can already serve
+    PREFETCH = 2     # warming data nobody has asked for yet
 
 class Call:
     def __init__(self, ready_time: float):
@@ -8,30 +23,335 @@ class Call:
     def isReady(self) -> bool:
         return monotonic() >= self.ready_time
 
+    def remaining(self) -> float:
+        return max(0.0, self.ready_time - monotonic())
+
+    def wait(self) -> None:
+        '''Blocks the calling thread until the call is ready'''
+        delay = self.remaining()
+        if delay > 0:
+            sleep(delay)
+
+    async def waitAsync(self) -> None:
+        '''Suspends the calling coroutine until the call is ready'''
+        delay = self.remaining()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class Outcome(Enum):
+    OK = 1         # upstream answered normally
+    FAILED = 2     # upstream answered, but with an error unrelated to load (bad id, missing data)
+    THROTTLED = 3  # rate limited, erroring, timed out, unreachable or very slow
+
+class _WaitStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float) -> None:
+        self.calls += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def toDict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "avg_wait": self.total_wait / self.calls if self.calls else 0.0,
+            "max_wait": self.max_wait
+        }
+
 class CallQueue:
-    def __init__(self, request_delay):
+    '''
+    Hands out upstream call slots spaced request_delay seconds apart.
+
+    With burst > 1 this acts as a token bucket: after an idle period up to
+    burst calls may start at once, with the bucket refilling one call every
+    request_delay seconds. Passing window_calls additionally caps how many
+    calls may start in any window seconds, so bursts can't push a minute
+    over its budget.
+    '''
+    # AIMD steps: healthy calls add to the rate a little at a time, throttling halves it
+    INCREASE_STEP = 0.5 / 60
+    DECREASE_FACTOR = 0.5
+
+    def __init__(self, request_delay, burst: int = 1, window_calls: int = None, window: float = 60.0,
+                 min_delay: float = None, max_delay: float = None):
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
         self.delay = request_delay
+        self.request_delay = request_delay
+        # The delay only adapts if these bounds leave it room to move
+        self.min_delay = request_delay if min_delay is None else min_delay
+        self.max_delay = request_delay if max_delay is None else max_delay
+        if not self.min_delay <= request_delay <= self.max_delay:
+            raise ValueError("request_delay must lie between min_delay and max_delay")
+        self._last_backoff = -float('inf')
+        self._outcomes = {outcome: 0 for outcome in Outcome}
+        self.burst = burst
+        self.window_calls = window_calls
+        self.window = window
         self.last_request = 0.0
         self.total_calls = 0
         self._lock = Lock()
 
+        # Theoretical arrival time of the next call, and the recent slots counted against the window
+        self._tat = 0.0
+        self._recent: list = []
+
+        # Async waiters, ordered by (priority, arrival)
+        self._waiters: list = []
+        self._arrivals = itertools.count()
+        self._dispatcher: asyncio.Task = None
+        self._wait_stats = {priority: _WaitStats() for priority in Priority}
+
     def __repr__(self) -> str:
         return f'{self.total_calls} calls (last call: {self.last_request:.2f}) | {self.delay:.2f} second delay'
 
+    @property
+    def effective_rate(self) -> float:
+        '''Sustained calls per minute at the current delay'''
+        return 60 / self.delay
+
+    def _adjustedDelay(self, delay: float, outcome: Outcome, last_backoff: float, now: float) -> tuple:
+        '''Returns (new_delay, new_last_backoff) after a call finished with outcome'''
+        if outcome == Outcome.THROTTLED:
+            # Calls already in flight will report the same trouble; back off once per slot
+            if now - last_backoff < delay:
+                return delay, last_backoff
+            rate = self.DECREASE_FACTOR / delay
+            return min(self.max_delay, max(self.min_delay, 1 / rate)), now
+        if outcome == Outcome.OK:
+            rate = 1 / delay + self.INCREASE_STEP
+            return min(self.max_delay, max(self.min_delay, 1 / rate)), last_backoff
+        return delay, last_backoff
+
+    def report(self, outcome: Outcome) -> None:
+        '''
+        Feeds the result of an upstream call back into the delay. Latency
+        only counts through the outcome: a very slow call reports THROTTLED.
+        '''
+        with self._lock:
+            self._outcomes[outcome] += 1
+            self.delay, self._last_backoff = self._adjustedDelay(self.delay, outcome, self._last_backoff, monotonic())
+
+    def outcomeStats(self) -> dict:
+        return {outcome.name.lower(): count for outcome, count in self._outcomes.items()}
+
+    def _nextSlot(self, now: float, tat: float, recent: list) -> tuple:
+        '''
+        Works out the next slot from the schedule state, returning
+        (ready_time, new_tat, new_recent). Each call pushes the theoretical
+        arrival time back by delay, and a call may start up to burst - 1
+        delays ahead of it (GCRA); with burst = 1 that is plain spacing.
+        '''
+        tolerance = (self.burst - 1) * self.delay
+        ready_time = max(now, tat - tolerance)
+
+        if self.window_calls is not None:
+            recent = [t for t in recent if t > ready_time - self.window]
+            if len(recent) >= self.window_calls:
+                ready_time = max(ready_time, recent[-self.window_calls] + self.window)
+                recent = [t for t in recent if t > ready_time - self.window]
+            recent.append(ready_time)
+
+        tat = max(tat, ready_time) + self.delay
+        return ready_time, tat, recent
+
+    def _reserve(self) -> float:
+        '''Claims the next free slot and returns when it starts'''
+        ready_time, self._tat, self._recent = self._nextSlot(monotonic(), self._tat, self._recent)
+        self.last_request = ready_time
+        return ready_time
+
     def addCall(self) -> Call:
         with self._lock:
-            now = monotonic()
-            if now - self.last_request >= self.delay:
-                ready_time = now
-            else:
-                ready_time = self.last_request + self.delay
-            self.last_request = ready_time
+            ready_time = self._reserve()
             self.total_calls += 1
 
             c = Call(ready_time)
             return c
 
+    async def _addCallAsync(self) -> Call:
+        '''addCall for the dispatcher; reserving a local slot never blocks'''
+        return self.addCall()
+
+    def _schedule(self) -> tuple:
+        with self._lock:
+            return monotonic(), self._tat, list(self._recent)
+
+    def _slotsFree(self, calls: int) -> bool:
+        now, tat, recent = self._schedule()
+        for _ in range(calls):
+            ready_time, tat, recent = self._nextSlot(now, tat, recent)
+            if ready_time > now:
+                return False
+        return True
+
+    def available(self, calls: int = 1) -> bool:
+        '''Whether calls slots could all start right now, with nobody queued ahead of them'''
+        return not self.waiting() and self._slotsFree(calls)
+
+    async def availableAsync(self, calls: int = 1) -> bool:
+        return self.available(calls)
+
+    def wait(self) -> Call:
+        '''Takes a place in the queue and blocks until it is our turn'''
+        c = self.addCall()
+        c.wait()
+        return c
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE) -> Call:
+        '''
+        Waits for a slot without blocking the event loop. Slots are handed out
+        one at a time, each to the highest priority waiter at the moment it
+        opens, so lower priority work only gets the slots nobody else wants.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), monotonic(), future))
+        if self._dispatcher is None or self._dispatcher.done() or self._dispatcher.get_loop() is not loop:
+            self._dispatcher = loop.create_task(self._dispatch())
+        return await future
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            c = await self._addCallAsync()
+            await c.waitAsync()
+            while self._waiters:
+                priority, _, enqueued, future = heapq.heappop(self._waiters)
+                # Skip waiters whose request was cancelled while queued
+                if future.done():
+                    continue
+                self._wait_stats[priority].record(monotonic() - enqueued)
+                future.set_result(c)
+                break
+
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter[3].done())
+
+    def waitStats(self) -> dict:
+        return {priority.name.lower(): stats.toDict() for priority, stats in self._wait_stats.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.last_request = 0
+            self.total_calls = 0
+            self.delay = self.request_delay
+            self._last_backoff = -float('inf')
+            self._tat = 0.0
+            self._recent = []
+            self._wait_stats = {priority: _WaitStats() for priority in Priority}
+            self._outcomes = {outcome: 0 for outcome in Outcome}
+
+class SharedCallQueue(CallQueue):
+    '''
+    CallQueue whose schedule is kept in a SQLite file, so every worker process
+    on the host draws from the same budget. Each reservation is a short
+    BEGIN IMMEDIATE transaction, which SQLite serializes with a file lock.
+    The dispatcher waits for that lock on the local I/O pool, and the in-process
+    lock is never held while waiting on it.
+    '''
+    def __init__(self, request_delay, path: str, name: str = "nba_api", timeout: float = 10.0,
+                 burst: int = 1, window_calls: int = None, window: float = 60.0,
+                 min_delay: float = None, max_delay: float = None):
+        super().__init__(request_delay, burst, window_calls, window, min_delay, max_delay)
+        self.path = path
+        self.name = name
+        self.timeout = timeout
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS call_schedule (
+                name        TEXT PRIMARY KEY,
+                tat         REAL NOT NULL,
+                recent      TEXT NOT NULL,
+                total_calls INTEGER NOT NULL,
+                delay       REAL NOT NULL,
+                last_backoff REAL NOT NULL
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO call_schedule (name, tat, recent, total_calls, delay, last_backoff) VALUES (?, 0, '[]', 0, ?, 0)",
+                     (name, request_delay))
+
+    def __repr__(self) -> str:
+        return f'{super().__repr__()} | shared via {self.path}'
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode, so transactions are only the ones we open
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _reserve(self) -> float:
+        # Monotonic clocks aren't comparable between processes, so the shared
+        # schedule is kept in wall clock time and converted back afterwards
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now_wall = time()
+            now = monotonic()
+            tat, recent, delay = conn.execute("SELECT tat, recent, delay FROM call_schedule WHERE name = ?", (self.name,)).fetchone()
+            # Every worker follows the delay adapted from all of their feedback
+            self.delay = min(self.max_delay, max(self.min_delay, delay))
+            ready_wall, tat, recent = self._nextSlot(now_wall, tat, json.loads(recent))
+            conn.execute("UPDATE call_schedule SET tat = ?, recent = ?, total_calls = total_calls + 1 WHERE name = ?",
+                         (tat, json.dumps(recent), self.name))
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+        return now + (ready_wall - now_wall)
+
+    def addCall(self) -> Call:
+        # The transaction already serializes reservations between threads
+        ready_time = self._reserve()
+        with self._lock:
+            self.last_request = ready_time
+            self.total_calls += 1
+        return Call(ready_time)
+
+    async def _addCallAsync(self) -> Call:
+        return await runIo(self.addCall)
+
+    def _schedule(self) -> tuple:
+        tat, recent = self._conn().execute("SELECT tat, recent FROM call_schedule WHERE name = ?", (self.name,)).fetchone()
+        return time(), tat, json.loads(recent)
+
+    async def availableAsync(self, calls: int = 1) -> bool:
+        return not self.waiting() and await runIo(self._slotsFree, calls)
+
+    def report(self, outcome: Outcome) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            delay, last_backoff = conn.execute("SELECT delay, last_backoff FROM call_schedule WHERE name = ?", (self.name,)).fetchone()
+            delay = min(self.max_delay, max(self.min_delay, delay))
+            delay, last_backoff = self._adjustedDelay(delay, outcome, last_backoff, time())
+            conn.execute("UPDATE call_schedule SET delay = ?, last_backoff = ? WHERE name = ?",
+                         (delay, last_backoff, self.name))
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._outcomes[outcome] += 1
+            self.delay = delay
+
+    def sharedCalls(self) -> int:
+        '''Calls made by every process using this queue'''
+        return self._conn().execute("SELECT total_calls FROM call_schedule WHERE name = ?", (self.name,)).fetchone()[0]
+
     def reset(self) -> None:
         with self._lock:
             self.last_request = 0
-            self.total_calls = 0
\ No newline at end of file
+            self.total_calls = 0
+            self._wait_stats = {priority: _WaitStats() for priority in Priority}
+            self.delay = self.request_delay
+            self._outcomes = {outcome: 0 for outcome in Outcome}
+        self._conn().execute("UPDATE call_schedule SET tat = 0, recent = '[]', total_calls = 0, delay = ?, last_backoff = 0 WHERE name = ?",
+                             (self.request_delay, self.name))
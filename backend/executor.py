@@ -0,0 +1,34 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Blocking work (nba_api requests and the DataFrame handling that follows them)
+# runs here so the event loop stays free to serve cached responses.
+DEFAULT_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="fetch")
+
+# Local SQLite reads and writes get their own threads, so they never queue
+# behind slow upstream calls on the fetch pool.
+IO_WORKERS = 2
+
+_io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+def configure(max_workers: int) -> None:
+  '''Replaces the shared pool with one bounded to max_workers threads'''
+  global _executor
+  if max_workers < 1:
+    raise ValueError("max_workers must be at least 1")
+  old = _executor
+  _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+  old.shutdown(wait=False)
+
+async def runBlocking(func, *args, **kwargs):
+  '''Runs func(*args, **kwargs) on the bounded pool and awaits its result'''
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+async def runIo(func, *args, **kwargs):
+  '''Runs func(*args, **kwargs) on the local I/O pool and awaits its result'''
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(_io_executor, partial(func, *args, **kwargs))
@@ -1,18 +1,32 @@
 from nba_api.stats.endpoints import scoreboardv3
 import pandas as pd
 import numpy as np
-from time import monotonic, sleep
 from datetime import date, timedelta
 
 from abc import ABC, abstractmethod
 
-from callQueue import Call, CallQueue
+from cachedService import CachedService, Freshness
+from callQueue import CallQueue
+from singleFlight import SingleFlight
+from upstream import observe, UpstreamUnavailable
+from store import CacheStore
+from cache import Cache
+
+# Days after which finished scoreboards stop receiving corrections
+_SETTLE_DAYS = 3
+_POSTPONED_DAYS = 7
+# About a season's worth of games
+_KNOWN_GAMES = 2048
 
 class GameInterface(ABC):
   @abstractmethod
   def getGamesFromDay(self, day: date) -> dict:
     pass
 
+  @abstractmethod
+  async def getGamesFromDayAsync(self, day: date) -> dict:
+    pass
+
   def getGamesFromRange(self, start_day: date, end_day: date) -> list:
     pass
 
@@ -64,14 +78,19 @@ class GameObj:
       "away_team" : self.away_team.toDict()
     }
 
-class Games(GameInterface):
-  def __init__(self, call_queue = CallQueue):
-    super().__init__()
-    self.games = {}
-    self.last_access = {}
-    self.call_queue = call_queue
+class Games(GameInterface, CachedService):
+  # Scores change quickly, but a slightly old scoreboard beats waiting on the queue
+  SOFT_TTL = 30
+  HARD_TTL = 60 * 60
+  MAX_ENTRIES = 400
+  MAX_BYTES = 8 * 1024 * 1024
 
-    self.wait_time = 30
+  def __init__(self, call_queue = CallQueue, inflight: SingleFlight = None, serve_stale: bool = True,
+               store: CacheStore = None):
+    CachedService.__init__(self, "games", call_queue, inflight, serve_stale, store)
+    self.games = self.cache
+    # Games seen on any scoreboard, by id, so box scores can reuse their status
+    self.known_games = Cache(None, max_entries=_KNOWN_GAMES)
 
   @staticmethod
   def _buildTeamFromRow(row: pd.DataFrame) -> TeamObj:
@@ -85,27 +104,46 @@ class Games(GameInterface):
 
     return team
 
-  def getGamesFromDay(self, day: date) -> list:
+  def _classify(self, day: date, game_list: list) -> Freshness:
+    today = date.today()
+    # Server and arena timezones differ, so yesterday may still be in progress
+    if day >= today - timedelta(days=1):
+      return Freshness.LIVE
+    if not all(game['status'].startswith('Final') for game in game_list):
+      # Games that never finished were postponed and get replayed on another day
+      return Freshness.FINAL if day < today - timedelta(days=_POSTPONED_DAYS) else Freshness.LIVE
+    if day < today - timedelta(days=_SETTLE_DAYS):
+      return Freshness.FINAL
+    return Freshness.SETTLING
+
+  def _remember(self, game_list: list) -> list:
+    for game in game_list:
+      self.known_games.set(game['game_id'], game)
+    return game_list
+
+  def _deserialize(self, game_list: list) -> list:
+    return self._remember(game_list)
+
+  def finishedGame(self, game_id: str) -> dict:
+    '''Returns the scoreboard entry of game_id if a scoreboard has shown it as final'''
+    game = self.known_games.get(int(game_id))
+    if game is None or not game['status'].startswith('Final'):
+      return None
+    return game
+
+  def _validateDay(self, day: date) -> None:
     if not isinstance(day, date):
       raise TypeError("day must be of type date")
 
-    # If already cached and its been a short time, just return it from cache
-    if day in self.games.keys() and (monotonic() - self.last_access[day]) <= self.wait_time:
-      return self.games[day]
-    
-    # Wait for our turn
-    c: Call = self.call_queue.addCall()
-    delay = c.ready_time - monotonic()
-    if (delay > 0):
-      sleep(delay)
-
+  def _fetch(self, day: date) -> list:
     day_str = day.strftime('%m/%d/%Y')
 
     try:
-      found_games = scoreboardv3.ScoreboardV3(game_date=day_str)
-    except:
+      found_games = observe(self.call_queue, scoreboardv3.ScoreboardV3, game_date=day_str)
+    except UpstreamUnavailable:
+      raise
+    except Exception:
       return None
-    self.last_access[day] = monotonic()
 
     headers = found_games.game_header.get_data_frame()[['gameId', 'gameStatus', 'gameStatusText', 'period', 'gameClock', 'gameCode']]
     linescores = found_games.line_score.get_data_frame()[['gameId', 'teamId', 'teamCity', 'teamTricode', 'score']]
@@ -130,5 +168,13 @@ class Games(GameInterface):
 
       game_list.append(game.toDict())
 
-    self.games[day] = game_list
-    return game_list
\ No newline at end of file
+    return self._remember(game_list)
+
+  def getGamesFromDay(self, day: date) -> list:
+    self._validateDay(day)
+    return self._getCached(day)
+
+  async def getGamesFromDayAsync(self, day: date) -> list:
+    self._validateDay(day)
+    # Cache hits never leave the event loop
+    return await self._getCachedAsync(day)
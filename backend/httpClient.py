@@ -0,0 +1,80 @@
+import requests
+from requests.adapters import HTTPAdapter
+from threading import Lock
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_HEADERS = {
+  "User-Agent": "Mozilla/5.0",
+  "Accept-Encoding": "gzip, deflate",
+}
+
+class _Page:
+  def __init__(self, etag: str, last_modified: str, result):
+    self.etag = etag
+    self.last_modified = last_modified
+    self.result = result
+
+class HttpClient:
+  '''
+  Pooled keep-alive session for the scraped sites with conditional requests.
+
+  get() remembers the ETag/Last-Modified validators of each URL along with
+  the parsed result. When the server answers 304 Not Modified the remembered
+  result is returned and the page is neither downloaded nor parsed again.
+  '''
+  def __init__(self, pool_size: int = 4, headers: dict = None):
+    self.session = requests.Session()
+    self.session.headers.update(DEFAULT_HEADERS if headers is None else headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    self.session.mount("https://", adapter)
+    self.session.mount("http://", adapter)
+
+    self._pages: dict[str, _Page] = {}
+    self._lock = Lock()
+    self.requests = 0
+    self.not_modified = 0
+
+  def get(self, url: str, parse, timeout: float = DEFAULT_TIMEOUT):
+    '''Returns parse(response) for url, reusing the last result if the page hasn't changed'''
+    with self._lock:
+      page = self._pages.get(url)
+      self.requests += 1
+
+    headers = {}
+    if page is not None:
+      if page.etag is not None:
+        headers["If-None-Match"] = page.etag
+      if page.last_modified is not None:
+        headers["If-Modified-Since"] = page.last_modified
+
+    r = self.session.get(url, headers=headers, timeout=timeout)
+    if r.status_code == 304 and page is not None:
+      with self._lock:
+        self.not_modified += 1
+      return page.result
+    r.raise_for_status()
+
+    result = parse(r)
+    etag = r.headers.get("ETag")
+    last_modified = r.headers.get("Last-Modified")
+    with self._lock:
+      if etag is not None or last_modified is not None:
+        self._pages[url] = _Page(etag, last_modified, result)
+      else:
+        self._pages.pop(url, None)
+    return result
+
+  def forget(self, url: str = None) -> None:
+    '''Drops remembered validators so the next get() downloads the page again'''
+    with self._lock:
+      if url is None:
+        self._pages.clear()
+      else:
+        self._pages.pop(url, None)
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        "requests": self.requests,
+        "not_modified": self.not_modified
+      }
@@ -1,33 +1,88 @@
 from dotenv import load_dotenv
 import os
+import asyncio
+from contextlib import asynccontextmanager
 
 from datetime import date, datetime
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from callQueue import CallQueue
+from callQueue import CallQueue, SharedCallQueue
+from singleFlight import SingleFlight
+from store import SqliteStore
+from upstream import UpstreamUnavailable
+import executor
 from standings import Standings
 from games import Games
 from boxscores import Boxscores
-from players import searchPlayers, PlayerStats, CompareMode, InvalidComparisonException, PlayerStatsOut, PlayerCompareResult
+from players import searchPlayers, searchStats, PlayerStats, CompareMode, StatView, InvalidComparisonException, PlayerStatsOut, PlayerCompareResult, PlayerGroupCompareResult
 from news import News
 
 load_dotenv("../.env")
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS").split(",")
 
-calls_per_minute = 10
+calls_per_minute = int(os.getenv("CALLS_PER_MINUTE", 10))
 minute_length = 60
 call_delay = minute_length / calls_per_minute
-
-app = FastAPI()
-call_queue = CallQueue(call_delay)
-standings = Standings(call_queue)
-games = Games(call_queue)
-boxscores = Boxscores(call_queue)
-playerStats = PlayerStats(call_queue)
+# The queue slows down when stats.nba.com throttles us and speeds back up while it is healthy
+min_calls_per_minute = float(os.getenv("MIN_CALLS_PER_MINUTE", 2))
+max_calls_per_minute = float(os.getenv("MAX_CALLS_PER_MINUTE", calls_per_minute))
+min_delay = minute_length / max_calls_per_minute
+max_delay = minute_length / min_calls_per_minute
+# Calls allowed back to back after an idle period; the per-minute budget still holds
+call_burst = int(os.getenv("CALL_BURST", 1))
+window_calls = int(max_calls_per_minute) if call_burst > 1 else None
+
+# Threads available for blocking upstream calls
+fetch_workers = int(os.getenv("FETCH_WORKERS", executor.DEFAULT_WORKERS))
+executor.configure(fetch_workers)
+
+# Shared by every worker on the host; set CACHE_DB to an empty string to keep caches in memory only
+cache_db = os.getenv("CACHE_DB", "cache.sqlite3")
+cache_db_max_rows = int(os.getenv("CACHE_DB_MAX_ROWS", SqliteStore.MAX_ROWS))
+cache_store = SqliteStore(cache_db, max_rows=cache_db_max_rows) if cache_db else None
+# Expired rows are kept a day past their hard TTL in case upstream is down
+store_grace = 24 * 60 * 60
+store_prune_interval = 60 * 60
+
+# Workers coordinate their upstream calls through this file; empty keeps the limit per process
+rate_limit_db = os.getenv("RATE_LIMIT_DB", cache_db)
+if rate_limit_db:
+    call_queue = SharedCallQueue(call_delay, rate_limit_db, burst=call_burst, window_calls=window_calls, window=minute_length,
+                                 min_delay=min_delay, max_delay=max_delay)
+else:
+    call_queue = CallQueue(call_delay, burst=call_burst, window_calls=window_calls, window=minute_length,
+                           min_delay=min_delay, max_delay=max_delay)
+inflight = SingleFlight()
+standings = Standings(call_queue, inflight, store=cache_store)
+games = Games(call_queue, inflight, store=cache_store)
+boxscores = Boxscores(call_queue, inflight, store=cache_store, games=games)
+playerStats = PlayerStats(call_queue, inflight, store=cache_store)
 news = News()
 
+async def pruneStore():
+    while True:
+        try:
+            await executor.runIo(cache_store.prune, store_grace)
+        except Exception:
+            pass  # try again next interval
+        await asyncio.sleep(store_prune_interval)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep the news feed warm so /news/ never waits on the scraped sites
+    news.start()
+    # The store only shrinks when pruned, so keep doing it while serving
+    pruning = asyncio.ensure_future(pruneStore()) if cache_store is not None else None
+    yield
+    if pruning is not None:
+        pruning.cancel()
+    await news.stop()
+
+app = FastAPI(lifespan=lifespan)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins = ALLOWED_ORIGINS,
@@ -35,9 +90,15 @@ app.add_middleware(
     allow_headers = ["*"]
 )
 
+@app.exception_handler(UpstreamUnavailable)
+async def upstreamUnavailable(request: Request, exc: UpstreamUnavailable):
+    # Nothing cached to fall back on and stats.nba.com is failing or throttling us
+    return JSONResponse(status_code=503, content={"detail": "Upstream stats service unavailable, try again later."},
+                        headers={"Retry-After": str(int(standings.breaker.reset_timeout))})
+
 @app.get("/standings/{season_id}")
 async def returnStandings(season_id: str):
-    res = standings.getStandings(season_id)
+    res = await standings.getStandingsAsync(season_id)
     if res is None:
         raise HTTPException(status_code=404, detail=f"Season {season_id} not found.")
     return res
@@ -48,7 +109,7 @@ async def returnGames(game_day: str):
         date_obj = datetime.strptime(game_day, "%Y-%m-%d").date()
     except ValueError:
         raise HTTPException(status_code=400, detail=f"Could not resolve date {game_day}.")
-    res = games.getGamesFromDay(date_obj)
+    res = await games.getGamesFromDayAsync(date_obj)
     if res is None:
         raise HTTPException(status_code=404, detail=f"Could not find games on {game_day}.")
     return res
@@ -56,7 +117,7 @@ async def returnGames(game_day: str):
 @app.get("/boxscore/{game_id}")
 async def returnBoxscore(game_id: str):
     try:
-        res = boxscores.getBoxscore(game_id)
+        res = await boxscores.getBoxscoreAsync(game_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="game_id must be 10 numeric digits.")
     if res is None:
@@ -64,16 +125,25 @@ async def returnBoxscore(game_id: str):
     return res
 
 @app.get("/search-player/{player_name}")
-async def playerSearch(player_name: str):
+async def playerSearch(player_name: str, limit: int = None, offset: int = 0):
     player_name = "".join(player_name.split())
     player_name = player_name.replace("+", " ")
-    res = searchPlayers(player_name)
+    try:
+        res = searchPlayers(player_name, limit, offset)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="limit and offset must not be negative")
     return res
 
 @app.get("/player-stats/{player_id}")
-async def returnPlayerStats(player_id: int):
+async def returnPlayerStats(player_id: int, season_type: str = None, stat_mode: str = None, scope: str = None):
+    # Clients that only display part of a career can ask for just that part
     try:
-        res: PlayerStatsOut = playerStats.getPlayerStats(player_id)
+        view = StatView(season_type, stat_mode, scope)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        res: PlayerStatsOut = await playerStats.getPlayerStatsAsync(player_id, view)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid format for player_id")
     if res is None:
@@ -81,17 +151,18 @@ async def returnPlayerStats(player_id: int):
     return res.model_dump()
 
 @app.get("/news/")
-async def returnNews():
+async def returnNews(after: int = None):
+    # Clients pass the largest cursor they have to only receive articles added since
     res = []
-    articles = news.getNews()
+    articles = await news.getNewsAsync(after)
     for article in articles:
         res.append(article.model_dump())
     return res
 
 @app.get("/compare/")
 async def returnCareerCompare(p1_id: int = None, p2_id: int = None,
-                              mode_type: str = None, season_name: str = None):
-    
+                              mode_type: str = None, season_name: str = None, include_players: bool = True):
+    # include_players=false leaves both careers out of the response
     if p1_id == None or p2_id == None or mode_type == None:
         raise HTTPException(status_code=400, detail="One or more arguments missing")
 
@@ -101,11 +172,63 @@ async def returnCareerCompare(p1_id: int = None, p2_id: int = None,
         raise HTTPException(status_code=400, detail="Could not derive compare mode from query")
     
     try:
-        comparison: PlayerCompareResult = playerStats.comparePlayerStats(p1_id, p2_id, compare_mode)
+        comparison: PlayerCompareResult = await playerStats.comparePlayerStatsAsync(p1_id, p2_id, compare_mode, include_players)
     except InvalidComparisonException:
         raise HTTPException(status_code=400, detail="Invalid comparison")
 
     if comparison == None:
         raise HTTPException(status_code=404, detail="One or more players not found")
     
-    return comparison.model_dump()
\ No newline at end of file
+    return comparison.model_dump()
+
+@app.get("/compare-group/")
+async def returnGroupCompare(player_ids: list[int] = Query(None), mode_type: str = None, season_name: str = None,
+                             include_players: bool = True):
+    # Called as /compare-group/?player_ids=2544&player_ids=201939&...&mode_type=career
+    if not player_ids or mode_type == None:
+        raise HTTPException(status_code=400, detail="One or more arguments missing")
+
+    try:
+        compare_mode = CompareMode(mode_type, season_name)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Could not derive compare mode from query")
+
+    try:
+        comparison: PlayerGroupCompareResult = await playerStats.comparePlayerGroupAsync(player_ids, compare_mode, include_players)
+    except InvalidComparisonException as e:
+        raise HTTPException(status_code=400, detail=f"Invalid comparison: {e}")
+
+    if comparison == None:
+        raise HTTPException(status_code=404, detail="One or more players not found")
+
+    return comparison.model_dump()
+
+@app.get("/metrics/")
+async def returnMetrics():
+    return {
+        "call_queue": {
+            "total_calls": call_queue.total_calls,
+            "delay": call_queue.delay,
+            "effective_rate": call_queue.effective_rate,
+            "outcomes": call_queue.outcomeStats(),
+            "waiting": call_queue.waiting(),
+            "wait_times": call_queue.waitStats()
+        },
+        "inflight": inflight.stats(),
+        "news": news.stats(),
+        "search": searchStats(),
+        "compare": playerStats.compareStats(),
+        "boxscores": boxscores.stats(),
+        "caches": {
+            "standings": standings.cache.stats(),
+            "games": games.cache.stats(),
+            "boxscores": boxscores.cache.stats(),
+            "players": playerStats.cache.stats()
+        },
+        "breakers": {
+            "standings": standings.breaker.stats(),
+            "games": games.breaker.stats(),
+            "boxscores": boxscores.breaker.stats(),
+            "players": playerStats.breaker.stats()
+        }
+    }
@@ -1,23 +1,38 @@
 from pydantic import BaseModel
 from abc import ABC, abstractmethod
 
-import requests
-from bs4 import BeautifulSoup, Tag, ResultSet, PageElement
+from requests import Response
 import json
+import asyncio
+import hashlib
+import re
+from bisect import bisect_left, insort
+from threading import Lock
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 
 from time import monotonic
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+from httpClient import HttpClient
 
 ESPN_API_URL = "https://site.api.espn.com/apis/site/v2/sports/basketball/nba/news?limit=40"
 NBA_NEWS_URL = "https://www.nba.com/news/category/top-stories"
 YAHOO_BASE_URL = "https://sports.yahoo.com"
 YAHOO_NEWS_URL = "https://sports.yahoo.com/nba/news/"
 
+# Seconds a single source gets before we give up on it for this refresh
+FETCH_TIMEOUT = 10
+# Every publish_time we serve uses this format, whatever the source sent
+PUBLISH_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
 class ArticleInfo(BaseModel):
   title: str
   source: str
   href: str
   publish_time: str
+  # Set by NewsFeed to when the article was first seen (epoch ms), not when it was published
+  cursor: int = None
 
   def __repr__(self):
     source_str = f"Source: {self.source}"
@@ -26,55 +41,72 @@ class ArticleInfo(BaseModel):
     published_str = f"Published: {self.publish_time}"
     return "\n".join([source_str, title_str, link_str, published_str])
 
-def _fetchEspnNews() -> list[ArticleInfo]:
-  # Request data
-  r = requests.get(ESPN_API_URL)
-  if not r.status_code == 200:
-    print("Unsuccessful request")
-    return []
-  
+# One keep-alive connection pool for every source; unchanged pages come back as 304
+_client = HttpClient()
+
+# Parsers raise on any failure so News can tell a broken source from a quiet one
+
+def _parseEspnNews(r: Response) -> list[ArticleInfo]:
   # Parse json
-  try:
-    response = r.json()
-  except requests.exceptions.JSONDecodeError:
-    return []
+  response = r.json()
   
   # Generate and return list
   good_article_types = ['HeadlineNews']
-  try:
-    res = []
-    espn_articles = response["articles"]
-    for article in espn_articles:
-      if article['type'] not in good_article_types:
-        # ESPN writes a lot of articles, so we only want the highlights
-        continue
-      article_title = article['headline']
-      article_source = "ESPN"
-      article_href = article['links']['web']['href']
-      article_publish_time = article['published']
-      res.append(ArticleInfo(title=article_title, source=article_source, href=article_href,
-                            publish_time=article_publish_time))
-    return res
-  except KeyError:
-    return []
-
-def _fetchNbaDotComNews() -> list[ArticleInfo]:
-  # Request data
-  r = requests.get(NBA_NEWS_URL)
-  if not r.status_code == 200:
-    return []
-  
+  res = []
+  espn_articles = response["articles"]
+  for article in espn_articles:
+    if article['type'] not in good_article_types:
+      # ESPN writes a lot of articles, so we only want the highlights
+      continue
+    article_title = article['headline']
+    article_source = "ESPN"
+    article_href = article['links']['web']['href']
+    article_publish_time = article['published']
+    res.append(ArticleInfo(title=article_title, source=article_source, href=article_href,
+                          publish_time=article_publish_time))
+  return res
+
+# Both pages embed their articles as JSON in a <script>. Slicing the blob out
+# of the raw bytes avoids building a DOM for a page of several hundred KB.
+_NEXT_DATA_MARKER = b'id="__NEXT_DATA__"'
+_YAHOO_STREAM_MARKER = b"ntk-assetlist-stream"
+_NEXT_PUSH_PREFIX = b"self.__next_f.push("
+
+def _scriptBody(page: bytes, marker: bytes) -> bytes:
+  '''Returns the body of the first <script> whose tag or text contains marker'''
+  pos = page.find(marker)
+  while pos != -1:
+    start = page.rfind(b"<script", 0, pos)
+    if start != -1:
+      body_start = page.find(b">", start) + 1
+      end = page.find(b"</script>", body_start)
+      if body_start > 0 and end > pos:
+        return page[body_start:end]
+    pos = page.find(marker, pos + len(marker))
+  return None
+
+def _extractNbaArticles(page: bytes) -> list:
+  body = _scriptBody(page, _NEXT_DATA_MARKER)
+  if body is None:
+    raise ValueError("NBA.com page has no __NEXT_DATA__ script")
+  response = json.loads(body)
+  return response['props']['pageProps']['category']['latest']['items']
+
+def _extractYahooStream(page: bytes) -> list:
+  body = _scriptBody(page, _YAHOO_STREAM_MARKER)
+  if body is None:
+    raise ValueError("Yahoo page has no article stream script")
+  # self.__next_f.push([1,"<row id>:<row json>"])
+  body = body.strip()
+  if not body.startswith(_NEXT_PUSH_PREFIX) or not body.endswith(b")"):
+    raise ValueError("Yahoo article stream script has an unexpected format")
+  row = json.loads(body[len(_NEXT_PUSH_PREFIX):-1])[1]
+  j = json.loads(row[row.index(":") + 1:])
+  return j[3]['stream']
+
+def _parseNbaDotComNews(r: Response) -> list[ArticleInfo]:
   # Scrape for json
-  page_text = r.text
-  soup = BeautifulSoup(page_text, 'html.parser')
-  scripts = soup.find_all('script', attrs={"id": "__NEXT_DATA__"})
-  if len(scripts) <= 0:
-    return []
-  response = json.loads(scripts[0].text)
-  try:
-    nba_articles = response['props']['pageProps']['category']['latest']['items']
-  except KeyError:
-    return []
+  nba_articles = _extractNbaArticles(r.content)
 
   # Generate and return list
   res = []
@@ -87,35 +119,9 @@ def _fetchNbaDotComNews() -> list[ArticleInfo]:
                            publish_time=article_publish_time))
   return res
 
-def _findScripts(scripts: ResultSet, target_str: str) -> list[PageElement]:
-  found_scripts = []
-  for script in scripts:
-    if target_str in script.text:
-      found_scripts.append(script)
-  return found_scripts
-
-def _cleanScriptText(text: str) -> str:
-  trimmed_text = text[19:-1]
-  clean_text = trimmed_text.replace("\\\"","\"").replace("\\n", "").replace("\\\\\"", "'")[7:-2]
-  return clean_text
-
-def _getStreamFromScriptText(text: str) -> list:
-  j = json.loads(text)
-  stream = j[3]['stream']
-  return stream
-
-def _fetchYahooNews() -> list[ArticleInfo]:
-  # Request data
-  r = requests.get(YAHOO_NEWS_URL)
-  if not r.status_code == 200:
-    return []
-  
+def _parseYahooNews(r: Response) -> list[ArticleInfo]:
   # Find stream json
-  soup = BeautifulSoup(r.text, 'html.parser')
-  scripts = soup.find_all('script')
-  script = _findScripts(scripts, "ntk-assetlist-stream")[0]
-  script_text = _cleanScriptText(script.text)
-  stream = _getStreamFromScriptText(script_text)
+  stream = _extractYahooStream(r.content)
 
   # Generate and return list
   res = []
@@ -134,30 +140,245 @@ def _fetchYahooNews() -> list[ArticleInfo]:
   return res
     
 
+def _fetchEspnNews(timeout: float = FETCH_TIMEOUT) -> list[ArticleInfo]:
+  return _client.get(ESPN_API_URL, _parseEspnNews, timeout)
+
+def _fetchNbaDotComNews(timeout: float = FETCH_TIMEOUT) -> list[ArticleInfo]:
+  return _client.get(NBA_NEWS_URL, _parseNbaDotComNews, timeout)
+
+def _fetchYahooNews(timeout: float = FETCH_TIMEOUT) -> list[ArticleInfo]:
+  return _client.get(YAHOO_NEWS_URL, _parseYahooNews, timeout)
+
+SOURCES = {
+  "ESPN": _fetchEspnNews,
+  "NBA.com": _fetchNbaDotComNews,
+  "Yahoo! Sports": _fetchYahooNews
+}
+
+def parsePublishTime(publish_time: str) -> datetime:
+  '''Parses the ISO 8601 variants the sources use into an aware UTC datetime'''
+  dt = datetime.fromisoformat(publish_time.strip().replace("Z", "+00:00"))
+  if dt.tzinfo is None:
+    dt = dt.replace(tzinfo=timezone.utc)
+  return dt.astimezone(timezone.utc)
+
+def _urlKey(href: str) -> str:
+  parts = urlsplit(href.strip())
+  host = parts.netloc.lower().removeprefix("www.")
+  return "url:" + host + parts.path.rstrip("/")
+
+def _titleKey(title: str) -> str:
+  # Sources reword punctuation and casing, not the words themselves
+  words = " ".join(re.findall(r"\w+", title.casefold()))
+  return "title:" + hashlib.sha1(words.encode()).hexdigest()
+
+class NewsFeed:
+  '''
+  Deduplicated articles ordered by publish time.
+
+  Articles are inserted as they arrive and skipped if their URL or title was
+  already seen, so the same story from two sources is only listed once. Each
+  one gets a cursor, the wall clock time in ms it was first seen, which
+  pollers pass back to only receive what was added after it, however late it
+  was published. Being a time rather than a counter, a cursor from one worker
+  or run still means the same thing to another; at worst a client is sent
+  an article again, never left without one.
+  Entries older than max_age, and the oldest beyond max_articles, are dropped.
+  '''
+  def __init__(self, max_articles: int = 200, max_age: timedelta = timedelta(days=3)):
+    self.max_articles = max_articles
+    self.max_age = max_age
+    # (timestamp, cursor, article, keys), oldest first
+    self._entries: list[tuple] = []
+    self._seen: dict[str, tuple] = {}
+    self._cursor = 0
+    self._lock = Lock()
+    self.version = 0
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def add(self, articles: list[ArticleInfo], now: datetime = None) -> int:
+    '''Inserts the articles not seen before and returns how many were added'''
+    now = datetime.now(timezone.utc) if now is None else now
+    added = 0
+    with self._lock:
+      for article in articles:
+        try:
+          dt = parsePublishTime(article.publish_time)
+        except ValueError:
+          continue
+        keys = (_urlKey(article.href), _titleKey(article.title))
+        if any(key in self._seen for key in keys):
+          continue
+
+        # Unique and increasing within this feed, even for articles seen in the same ms
+        self._cursor = max(int(now.timestamp() * 1000), self._cursor + 1)
+        article = article.model_copy(update={"publish_time": dt.strftime(PUBLISH_TIME_FORMAT),
+                                             "cursor": self._cursor})
+        entry = (dt.timestamp(), self._cursor, article, keys)
+        insort(self._entries, entry)
+        for key in keys:
+          self._seen[key] = entry
+        added += 1
+      removed = self._prune(now)
+      if added or removed:
+        self.version += 1
+    return added
+
+  def _prune(self, now: datetime = None) -> int:
+    now = datetime.now(timezone.utc) if now is None else now
+    cutoff = bisect_left(self._entries, ((now - self.max_age).timestamp(),))
+    drop = max(cutoff, len(self._entries) - self.max_articles)
+    for entry in self._entries[:drop]:
+      for key in entry[3]:
+        self._seen.pop(key, None)
+    del self._entries[:drop]
+    return drop
+
+  def articles(self, after: int = None) -> list[ArticleInfo]:
+    '''Newest first, limited to articles first seen after cursor after when given'''
+    with self._lock:
+      return [entry[2] for entry in reversed(self._entries) if after is None or entry[1] > after]
+
 class NewsInterface(ABC):
   @abstractmethod
-  def getNews(self) -> list[ArticleInfo]:
+  def getNews(self, after: int = None) -> list[ArticleInfo]:
     ...
 
-def _sortFunc(item: ArticleInfo) -> str:
-  return item.publish_time
+  @abstractmethod
+  async def getNewsAsync(self, after: int = None) -> list[ArticleInfo]:
+    ...
 
 class News(NewsInterface):
-  def __init__(self):
-    self.cache = []
+  '''
+  Merged feed of every source, held in memory.
+
+  Sources are fetched concurrently, each on its own thread with a timeout,
+  and each result is merged into a NewsFeed, so a source that fails or times
+  out keeps contributing the articles it gave before. Once start() is called
+  a background task refreshes the feed every wait_time seconds, so requests
+  are answered straight from memory.
+  '''
+  def __init__(self, wait_time: float = 60, timeout: float = FETCH_TIMEOUT, sources: dict = None,
+               max_articles: int = 200, max_age: timedelta = timedelta(days=3)):
+    self.cache: list[ArticleInfo] = []
+    self.feed = NewsFeed(max_articles, max_age)
+    self._cache_version = -1
     self.last_update = 0
-    self.wait_time = 60
+    self.wait_time = wait_time
+    self.timeout = timeout
+    self.sources = dict(SOURCES if sources is None else sources)
+
+    # Last good result and consecutive failures per source
+    self.latest: dict[str, list[ArticleInfo]] = {name: [] for name in self.sources}
+    self.failures: dict[str, int] = {name: 0 for name in self.sources}
+
+    # Scraping is kept off the nba_api pool so slow news sites can't delay stats calls
+    self._pool = ThreadPoolExecutor(max_workers=len(self.sources), thread_name_prefix="news")
+    self._refreshing: asyncio.Task = None
+    self._task: asyncio.Task = None
+
+  def isStale(self) -> bool:
+    return self.last_update == 0 or (monotonic() - self.last_update) > self.wait_time
+
+  def _update(self, name: str, result) -> None:
+    if isinstance(result, BaseException):
+      # Keep serving what this source gave us last time
+      self.failures[name] += 1
+      return
+    self.latest[name] = result
+    self.failures[name] = 0
+    self.feed.add(result)
 
-  def getNews(self) -> list[ArticleInfo]:
-    if (monotonic() - self.last_update) <= self.wait_time:
+  def _merge(self) -> list[ArticleInfo]:
+    # Also ages out old articles when no source sent anything new
+    self.feed.add([])
+    if self.feed.version != self._cache_version:
+      self._cache_version = self.feed.version
+      self.cache = self.feed.articles()
+    self.last_update = monotonic()
+    return self.cache
+
+  def refresh(self) -> list[ArticleInfo]:
+    futures = {name: self._pool.submit(fetch, self.timeout) for name, fetch in self.sources.items()}
+    for name, future in futures.items():
+      try:
+        self._update(name, future.result(timeout=self.timeout))
+      except Exception as e:
+        self._update(name, e)
+    return self._merge()
+
+  async def _fetchAsync(self, fetch):
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(self._pool, fetch, self.timeout), self.timeout)
+
+  async def _refreshAsync(self) -> list[ArticleInfo]:
+    names = list(self.sources)
+    results = await asyncio.gather(*(self._fetchAsync(self.sources[name]) for name in names),
+                                   return_exceptions=True)
+    for name, result in zip(names, results):
+      self._update(name, result)
+    return self._merge()
+
+  def _startRefresh(self) -> asyncio.Task:
+    # Requests arriving mid-refresh wait on the same fetches
+    if self._refreshing is None or self._refreshing.done():
+      self._refreshing = asyncio.ensure_future(self._refreshAsync())
+    return self._refreshing
+
+  async def refreshAsync(self) -> list[ArticleInfo]:
+    return await asyncio.shield(self._startRefresh())
+
+  def _select(self, after: int = None) -> list[ArticleInfo]:
+    if after is None:
       return self.cache
-    
-    espn_news = _fetchEspnNews()
-    nba_news = _fetchNbaDotComNews()
-    yahoo_news = _fetchYahooNews()
+    return self.feed.articles(after)
+
+  def getNews(self, after: int = None) -> list[ArticleInfo]:
+    if self.isStale():
+      self.refresh()
+    return self._select(after)
+
+  async def getNewsAsync(self, after: int = None) -> list[ArticleInfo]:
+    if self.last_update == 0:
+      # Nothing to serve yet, so the first request waits for the first refresh
+      await self.refreshAsync()
+    elif self.isStale() and not self.running():
+      self._startRefresh()
+    return self._select(after)
+
+  async def _run(self) -> None:
+    while True:
+      try:
+        await self.refreshAsync()
+      except Exception:
+        pass
+      await asyncio.sleep(self.wait_time)
+
+  def running(self) -> bool:
+    return self._task is not None and not self._task.done()
+
+  def start(self) -> None:
+    '''Starts refreshing in the background on the running event loop'''
+    if not self.running():
+      self._task = asyncio.ensure_future(self._run())
 
-    res = espn_news + nba_news + yahoo_news
-    res.sort(key=_sortFunc, reverse=True)
+  async def stop(self) -> None:
+    if self._task is None:
+      return
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+    self._task = None
 
-    self.cache = res
-    return res
\ No newline at end of file
+  def stats(self) -> dict:
+    return {
+      "articles": len(self.feed),
+      "age": None if self.last_update == 0 else monotonic() - self.last_update,
+      "http": _client.stats(),
+      "sources": {name: {"articles": len(self.latest[name]), "failures": self.failures[name]}
+                  for name in self.sources}
+    }
@@ -0,0 +1,206 @@
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from heapq import nsmallest
+from functools import lru_cache
+
+# Match tiers, best first
+EXACT = 0
+PREFIX = 1
+TOKEN_PREFIX = 2
+SUBSTRING = 3
+FUZZY = 4
+
+_DROPPED = re.compile(r"['’.]")
+_WORDS = re.compile(r"[^\W_]+")
+
+def foldName(text: str) -> str:
+  '''Lowercases, strips accents and punctuation: "Nikola Jokić" -> "nikola jokic", "D'Angelo" -> "dangelo"'''
+  text = unicodedata.normalize("NFKD", text)
+  text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+  return " ".join(_WORDS.findall(_DROPPED.sub("", text)))
+
+def _ngrams(text: str, n: int) -> set:
+  return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def _bigrams(token: str) -> set:
+  return _ngrams(f"${token}$", 2)
+
+def _editDistance(a: str, b: str, limit: int) -> int:
+  '''Optimal string alignment distance, giving up once it must exceed limit'''
+  if abs(len(a) - len(b)) > limit:
+    return limit + 1
+  prev2 = None
+  prev = list(range(len(b) + 1))
+  for i in range(1, len(a) + 1):
+    cur = [i] + [0] * len(b)
+    for j in range(1, len(b) + 1):
+      cost = 0 if a[i - 1] == b[j - 1] else 1
+      cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+      if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+        cur[j] = min(cur[j], prev2[j - 2] + 1)
+    if min(cur) > limit:
+      return limit + 1
+    prev2, prev = prev, cur
+  return prev[-1]
+
+# Shorter words match too many names with a typo to be useful; the word
+# still being typed needs one more letter since it is compared by prefix too
+_MIN_TYPO_LENGTH = 4
+
+def _typoLimit(token: str) -> int:
+  return 1 if len(token) <= 7 else 2
+
+class PlayerSearchIndex:
+  '''
+  In-memory index over the static player list, built once.
+
+  Names are accent folded and split into tokens. A sorted token list answers
+  prefix queries with bisect, trigrams of each name (spaces removed) answer
+  substring queries, and bigrams of each token find typo candidates, which
+  are confirmed with an edit distance check.
+
+  Results are ranked by match tier (exact name, name prefix, every query word
+  prefixing a name word, substring, typo), active players first within a
+  tier, then in the original list order. Typo matches are only looked for
+  when the other tiers don't fill the requested number of results and no
+  name matched exactly.
+  '''
+  def __init__(self, players: list[dict]):
+    self.players = players
+    self._names = [foldName(player['full_name']) for player in players]
+    self._compact = [name.replace(" ", "") for name in self._names]
+
+    token_players: dict[str, set] = {}
+    self._trigrams: dict[str, list[int]] = {}
+    for i, name in enumerate(self._names):
+      for token in name.split():
+        token_players.setdefault(token, set()).add(i)
+      for gram in _ngrams(self._compact[i], 3):
+        self._trigrams.setdefault(gram, []).append(i)
+
+    self._tokens = sorted(token_players)
+    self._token_players = [token_players[token] for token in self._tokens]
+    self._token_bigrams: dict[str, list[int]] = {}
+    for t, token in enumerate(self._tokens):
+      for gram in _bigrams(token):
+        self._token_bigrams.setdefault(gram, []).append(t)
+    # Typeahead repeats the same words keystroke after keystroke
+    self._typoTokens = lru_cache(maxsize=4096)(self._typoTokens)
+
+  def __len__(self) -> int:
+    return len(self.players)
+
+  def _prefixTokens(self, prefix: str) -> range:
+    start = bisect_left(self._tokens, prefix)
+    end = start
+    while end < len(self._tokens) and self._tokens[end].startswith(prefix):
+      end += 1
+    return range(start, end)
+
+  def _prefixPlayers(self, prefix: str) -> set:
+    res = set()
+    for t in self._prefixTokens(prefix):
+      res |= self._token_players[t]
+    return res
+
+  def _substringPlayers(self, compact: str) -> set:
+    grams = _ngrams(compact, 3)
+    if not grams:
+      return set()
+    postings = sorted((self._trigrams.get(gram, []) for gram in grams), key=len)
+    res = set(postings[0])
+    for posting in postings[1:]:
+      res.intersection_update(posting)
+      if not res:
+        break
+    return {i for i in res if compact in self._compact[i]}
+
+  def _typoTokens(self, token: str, partial: bool) -> dict:
+    '''Maps token ids within the typo limit of token to their distance'''
+    limit = _typoLimit(token)
+    grams = _bigrams(token)
+    counts = Counter()
+    for gram in grams:
+      counts.update(self._token_bigrams.get(gram, ()))
+    # Each edit breaks at most three bigrams (a swap), and a partial word is missing its end marker
+    needed = len(grams) - 3 * limit - (1 if partial else 0)
+
+    res = {}
+    for t, shared in counts.items():
+      if shared < needed:
+        continue
+      candidate = self._tokens[t]
+      # People rarely get the first letter wrong, short of swapping the first two
+      if candidate[0] != token[0] and candidate[:2] != token[1::-1]:
+        continue
+      distance = _editDistance(token, candidate, limit)
+      if partial and distance > limit and len(candidate) > len(token):
+        distance = _editDistance(token, candidate[:len(token)], limit)
+      if distance <= limit:
+        res[t] = distance
+    return res
+
+  def _tier(self, i: int, query: str, compact: str, default: int) -> int:
+    if self._names[i] == query or self._compact[i] == compact:
+      return EXACT
+    if self._names[i].startswith(query) or self._compact[i].startswith(compact):
+      return PREFIX
+    return default
+
+  def _fuzzy(self, tokens: list[str], prefixed: list[set], exclude: set) -> dict:
+    '''Players matching every query word by prefix or typo, mapped to their total distance'''
+    matched = None
+    for n, token in enumerate(tokens):
+      distances = dict.fromkeys(prefixed[n], 0)
+      partial = n == len(tokens) - 1
+      if len(token) >= _MIN_TYPO_LENGTH + partial:
+        for t, distance in self._typoTokens(token, partial).items():
+          for i in self._token_players[t]:
+            if distance < distances.get(i, distance + 1):
+              distances[i] = distance
+      if matched is None:
+        matched = distances
+      else:
+        matched = {i: matched[i] + d for i, d in distances.items() if i in matched}
+      if not matched:
+        return {}
+    return {i: d for i, d in matched.items() if d > 0 and i not in exclude}
+
+  def search(self, query: str, limit: int = None) -> list[dict]:
+    '''Returns the best matching players for query, at most limit of them'''
+    return [self.players[i] for i in self.rank(query, limit)]
+
+  def rank(self, query: str, limit: int = None) -> list[int]:
+    '''Like search, but returns positions in the player list'''
+    query = foldName(query)
+    if not query:
+      return []
+    compact = query.replace(" ", "")
+    tokens = query.split()
+
+    # Every query word must prefix some word of the name
+    prefixed = [self._prefixPlayers(token) for token in tokens]
+    candidates = set.intersection(*prefixed)
+
+    ranked = {}
+    for i in candidates:
+      ranked[i] = (self._tier(i, query, compact, TOKEN_PREFIX), 0)
+    for i in self._substringPlayers(compact):
+      if i not in ranked:
+        ranked[i] = (self._tier(i, query, compact, SUBSTRING), 0)
+
+    # Typo matches only pad out a short list, and never compete with an exact name
+    exact = any(tier == EXACT for tier, _ in ranked.values())
+    if not exact and len(ranked) < (1 if limit is None else limit):
+      for i, distance in self._fuzzy(tokens, prefixed, ranked.keys()).items():
+        ranked[i] = (FUZZY, distance)
+
+    def key(i):
+      tier, distance = ranked[i]
+      return (tier, not self.players[i]['is_active'], distance, i)
+
+    if limit is None:
+      return sorted(ranked, key=key)
+    return nsmallest(limit, ranked, key=key)
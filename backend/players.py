@@ -1,10 +1,18 @@
+import asyncio
+import itertools
 from abc import ABC, abstractmethod
 from pydantic import BaseModel, field_serializer
-from time import sleep, monotonic
 from enum import Enum
 import pandas as pd
+import numpy as np
 
+from cachedService import CachedService, Freshness
 from callQueue import CallQueue
+from singleFlight import SingleFlight
+from upstream import observe, UpstreamUnavailable
+from store import CacheStore
+from playerSearch import PlayerSearchIndex, foldName
+from cache import Cache
 
 from nba_api.stats.static import players as nba_players
 from nba_api.stats.endpoints import playercareerstats
@@ -19,21 +27,37 @@ SEASON_STR = 'season'
 def _getPlayerHeadshot(player_id: int) -> str:
   return f"https://cdn.nba.com/headshots/nba/latest/1040x760/{player_id}.png"
 
-def _sortFunc(item):
-  return not item['active']
-
-def searchPlayers(player_name: str) -> list:
-  nba_res = nba_players.find_players_by_full_name(player_name)
-  res = []
-  for player in nba_res:
-    res.append({
-      "player_id": player['id'],
-      "player_name": player['full_name'],
-      "active": player['is_active'],
-      "player_headshot": _getPlayerHeadshot(player['id'])
-    })
-  res.sort(key=_sortFunc)
-  return res
+def _getSearchResult(player: dict) -> dict:
+  return {
+    "player_id": player['id'],
+    "player_name": player['full_name'],
+    "active": player['is_active'],
+    "player_headshot": _getPlayerHeadshot(player['id'])
+  }
+
+# Built once at startup; the static player list ships with nba_api
+_search_index = PlayerSearchIndex(nba_players.get_players())
+# Every result list shares these dicts instead of building its own
+_search_results = [_getSearchResult(player) for player in _search_index.players]
+# Typeahead sends the same few prefixes over and over
+_search_cache = Cache(None, max_entries=512)
+
+def searchPlayers(player_name: str, limit: int = None, offset: int = 0) -> list:
+  if (limit is not None and limit < 0) or offset < 0:
+    raise ValueError("limit and offset must not be negative")
+  end = None if limit is None else offset + limit
+  key = (foldName(player_name), end)
+
+  res = _search_cache.get(key)
+  if res is None:
+    res = [_search_results[i] for i in _search_index.rank(player_name, end)]
+    _search_cache.set(key, res)
+  if offset == 0 and (end is None or len(res) <= end):
+    return res
+  return res[offset:end]
+
+def searchStats() -> dict:
+  return _search_cache.stats()
 
 class Statline(BaseModel):
   min: int | float
@@ -114,6 +138,17 @@ class Statline(BaseModel):
     )
     return res
 
+# Source column -> Statline field, in Statline's field order
+_STAT_COLUMNS = {
+  'MIN': 'min', 'GP': 'gp', 'GS': 'gs', 'PTS': 'pts', 'AST': 'ast', 'REB': 'reb', 'BLK': 'blk',
+  'STL': 'stl', 'TOV': 'tov', 'PF': 'pf', 'FGA': 'fga', 'FGM': 'fgm', 'FG_PCT': 'fg_pct',
+  'FG3A': 'fg3a', 'FG3M': 'fg3m', 'FG3_PCT': 'fg3_pct', 'FTA': 'fta', 'FTM': 'ftm',
+  'FT_PCT': 'ft_pct', 'OREB': 'oreb', 'DREB': 'dreb'
+}
+# Games, starts and percentages aren't averaged per game
+_PERGAME_COLUMNS = [column for column in _STAT_COLUMNS
+                    if column not in ('GP', 'GS', 'FG_PCT', 'FG3_PCT', 'FT_PCT')]
+
 class ModeTypeEnum(Enum):
   SEASON = 1
   CAREER = 2
@@ -140,6 +175,20 @@ class CompareMode:
     self.mode_type: ModeTypeEnum  = mode_type
     self.season_name: str         = season_name
 
+_SEASON_TYPES = (REGULAR_STR, PLAYOFF_STR)
+_STAT_MODES = (TOTAL_STR, PERGAME_STR)
+_SCOPES = (CAREER_STR, SEASON_STR)
+
+class StatView:
+  '''Selects the parts of a career to return, None meaning all of them'''
+  def __init__(self, season_type: str = None, stat_mode: str = None, scope: str = None):
+    for value, allowed in ((season_type, _SEASON_TYPES), (stat_mode, _STAT_MODES), (scope, _SCOPES)):
+      if value is not None and value not in allowed:
+        raise ValueError(f"{value} is not one of {', '.join(allowed)}")
+    self.season_types = _SEASON_TYPES if season_type is None else (season_type,)
+    self.stat_modes = _STAT_MODES if stat_mode is None else (stat_mode,)
+    self.scopes = _SCOPES if scope is None else (scope,)
+
 class PlayerStatsOut(BaseModel):
   player_name: str
   player_id: int
@@ -156,21 +205,214 @@ class PlayerStatsOut(BaseModel):
       return False
     return True
 
-def getSeasonOverlap(player_1: PlayerStatsOut, player_2: PlayerStatsOut) -> list[str]:
-  p1_seasons: list = [line[SEASON_STR] for line in player_1.stats[REGULAR_STR][TOTAL_STR][SEASON_STR]]
-  p2_seasons: list = [line[SEASON_STR] for line in player_2.stats[REGULAR_STR][TOTAL_STR][SEASON_STR]]
-  res = list(set(p1_seasons) & set(p2_seasons))
-  return res
+_STAT_INDEX = {column: j for j, column in enumerate(_STAT_COLUMNS)}
+_PERGAME_INDEX = [_STAT_INDEX[column] for column in _PERGAME_COLUMNS]
+# Career rows only hold numbers, which Statline used to read back as floats
+_CAREER_INTEGER = tuple(column in ('GP', 'GS') for column in _STAT_COLUMNS)
+
+def _statColumn(values: tuple) -> np.ndarray:
+  column = np.asarray(values)
+  if column.dtype == object:
+    # Missing values, which pandas would have read as NaN
+    column = np.asarray(values, dtype=float)
+  return column
+
+_STAT_NAMES = list(_STAT_COLUMNS.values()) + ['efg_pct']
+
+def _deriveStats(totals: np.ndarray, per_game: bool) -> tuple:
+  '''Returns the rows as per-game values when asked, and their efg_pct'''
+  values = totals
+  with np.errstate(divide='ignore', invalid='ignore'):
+    if per_game:
+      values = totals.copy()
+      values[:, _PERGAME_INDEX] /= totals[:, [_STAT_INDEX['GP']]]
+    efg_pct = (values[:, _STAT_INDEX['FGM']] + values[:, _STAT_INDEX['FG3M']]) / values[:, _STAT_INDEX['FGA']]
+  return values, efg_pct
+
+def _statMatrix(totals: np.ndarray, per_game: bool) -> np.ndarray:
+  '''Rows of totals as floats in _STAT_NAMES order, the numbers _statLines would produce'''
+  values, efg_pct = _deriveStats(totals, per_game)
+  efg_pct = np.where(values[:, _STAT_INDEX['FGA']] > 0, efg_pct, 0.0)
+  return np.column_stack([values, efg_pct])
+
+def _statLines(totals: np.ndarray, integer: tuple, per_game: bool, seasons: list = None,
+               teams: list = None) -> list[dict]:
+  '''Turns rows of totals into Statline-shaped dicts, deriving per-game values and efg_pct'''
+  values, efg_pct = _deriveStats(totals, per_game)
+  fga = values[:, _STAT_INDEX['FGA']]
+
+  keys = list(_STAT_NAMES)
+  columns = []
+  for j, column in enumerate(_STAT_COLUMNS):
+    averaged = per_game and column in _PERGAME_COLUMNS
+    if integer[j] and not averaged:
+      columns.append(values[:, j].astype(np.int64).tolist())
+    else:
+      columns.append(values[:, j].tolist())
+  columns.append([pct if attempted > 0 else 0 for pct, attempted in zip(efg_pct.tolist(), fga.tolist())])
+  if seasons is not None:
+    keys += [SEASON_STR, 'team']
+    columns += [seasons, teams]
+  return [dict(zip(keys, row)) for row in zip(*columns)]
+
+# Like the two player comparison, only turnovers count against a player
+_LOWER_IS_BETTER = np.array([name in ('tov',) for name in _STAT_NAMES])
+
+def rankStats(values: np.ndarray) -> np.ndarray:
+  '''
+  Ranks each column of a players x stats matrix, 1 being the best. Tied
+  players share a rank, and missing values rank last.
+  '''
+  scores = np.where(_LOWER_IS_BETTER, -values, values)
+  scores = np.where(np.isnan(scores), -np.inf, scores)
+  # Count, for every player and stat, the players strictly ahead
+  return (scores[np.newaxis, :, :] > scores[:, np.newaxis, :]).sum(axis=1) + 1
+
+# Team abbreviation of the combined line of a season played for several teams
+MULTI_TEAM_STR = 'TOT'
+
+def _seasonRows(seasons: list[str], teams: list[str]) -> dict[str, int]:
+  '''Maps each season to its row, the combined TOT row for traded players'''
+  rows = {}
+  for row, (season, team) in enumerate(zip(seasons, teams)):
+    if season not in rows or team == MULTI_TEAM_STR:
+      rows[season] = row
+  return rows
+
+class StatTable:
+  '''
+  Totals for one season type in a single float array, a row per season line
+  and a column per stat. Per-game values and efg_pct are derived when the
+  table is turned into response dicts, not stored.
+
+  A season played for several teams has a TOT line followed by a line per
+  team. season_rows resolves a season to one row, the TOT line in that case,
+  and is rebuilt on load rather than stored.
+  '''
+  __slots__ = ('career', 'totals', 'integer', 'seasons', 'teams', 'season_rows', 'season_set')
+
+  def __init__(self, career: np.ndarray, totals: np.ndarray, integer: tuple, seasons: list[str], teams: list[str]):
+    self.career = career
+    self.totals = totals
+    # Which columns were integers upstream, so they serialize as they always have
+    self.integer = integer
+    self.seasons = seasons
+    self.teams = teams
+    self.season_rows = _seasonRows(seasons, teams)
+    self.season_set = frozenset(self.season_rows)
 
-def findSeasonWithName(lines: list[Statline], season_name: str) -> Statline:
-  for line in lines:
-    if line[SEASON_STR] == season_name:
-      return line
-  return None
+  @staticmethod
+  def fromDataSets(career_set, season_set) -> "StatTable":
+    career_data = career_set.get_dict()
+    if not career_data['data']:
+      return None
+    career_row = dict(zip(career_data['headers'], career_data['data'][0]))
+    career = np.array([[career_row[column] for column in _STAT_COLUMNS]], dtype=float)
+
+    season_data = season_set.get_dict()
+    raw = dict(zip(season_data['headers'], zip(*season_data['data'])))
+    if not raw:
+      return StatTable(career, np.empty((0, len(_STAT_COLUMNS))), _CAREER_INTEGER, [], [])
+    columns = [_statColumn(raw[column]) for column in _STAT_COLUMNS]
+    totals = np.column_stack([column.astype(float) for column in columns])
+    integer = tuple(column.dtype.kind in 'iu' for column in columns)
+    return StatTable(career, totals, integer, list(raw['SEASON_ID']), list(raw['TEAM_ABBREVIATION']))
+
+  def careerLine(self, per_game: bool) -> dict:
+    return _statLines(self.career, _CAREER_INTEGER, per_game)[0]
+
+  def seasonLines(self, per_game: bool) -> list[dict]:
+    return _statLines(self.totals, self.integer, per_game, self.seasons, self.teams)
+
+  def seasonLine(self, per_game: bool, season_name: str) -> dict:
+    row = self.season_rows.get(season_name)
+    if row is None:
+      return None
+    return _statLines(self.totals[row:row + 1], self.integer, per_game, [season_name], [self.teams[row]])[0]
+
+  def statRow(self, per_game: bool, season_name: str = None) -> np.ndarray:
+    '''The career line, or the line of season_name, as floats in _STAT_NAMES order'''
+    if season_name is None:
+      return _statMatrix(self.career, per_game)[0]
+    row = self.season_rows.get(season_name)
+    if row is None:
+      return None
+    return _statMatrix(self.totals[row:row + 1], per_game)[0]
+
+  def toJson(self) -> dict:
+    return {
+      "career": self.career[0].tolist(),
+      "totals": self.totals.tolist(),
+      "integer": list(self.integer),
+      "seasons": self.seasons,
+      "teams": self.teams
+    }
+
+  @staticmethod
+  def fromJson(data: dict) -> "StatTable":
+    totals = np.array(data["totals"], dtype=float).reshape(-1, len(_STAT_COLUMNS))
+    return StatTable(np.array([data["career"]], dtype=float), totals, tuple(data["integer"]),
+                     data["seasons"], data["teams"])
+
+_career_versions = itertools.count(1)
+
+class Career:
+  '''A player's cached career, materialized to the PlayerStatsOut shape per response'''
+  __slots__ = ('player_id', 'player_name', 'player_headshot', 'tables', 'version')
+
+  def __init__(self, player_id: int, player_name: str, player_headshot: str, tables: dict[str, StatTable]):
+    self.player_id = player_id
+    self.player_name = player_name
+    self.player_headshot = player_headshot
+    self.tables = tables
+    # Careers are replaced, never modified, when refreshed, so this identifies the data
+    self.version = next(_career_versions)
+
+  def stats(self, view: StatView = None) -> dict:
+    '''Builds the stats tree, only computing the lines the view selects'''
+    view = StatView() if view is None else view
+    stats = {}
+    for season_type in view.season_types:
+      table = self.tables.get(season_type)
+      if table is None:
+        continue
+      stats[season_type] = {}
+      for stat_mode in view.stat_modes:
+        per_game = stat_mode == PERGAME_STR
+        lines = {}
+        if CAREER_STR in view.scopes:
+          lines[CAREER_STR] = table.careerLine(per_game)
+        if SEASON_STR in view.scopes:
+          lines[SEASON_STR] = table.seasonLines(per_game)
+        stats[season_type][stat_mode] = lines
+    return stats
+
+  def toStatsOut(self, view: StatView = None) -> PlayerStatsOut:
+    # Built from already validated numbers, so skip pydantic validation
+    return PlayerStatsOut.model_construct(player_name=self.player_name, player_id=self.player_id,
+                                          player_headshot=self.player_headshot, stats=self.stats(view))
+
+  def toJson(self) -> dict:
+    return {
+      "player_id": self.player_id,
+      "player_name": self.player_name,
+      "player_headshot": self.player_headshot,
+      "tables": {season_type: table.toJson() for season_type, table in self.tables.items()}
+    }
+
+  @staticmethod
+  def fromJson(data: dict) -> "Career":
+    tables = {season_type: StatTable.fromJson(table) for season_type, table in data["tables"].items()}
+    return Career(data["player_id"], data["player_name"], data["player_headshot"], tables)
+
+def getSeasonOverlap(*tables: StatTable) -> list[str]:
+  '''Seasons every table has a line for'''
+  return sorted(frozenset.intersection(*(table.season_set for table in tables)))
 
 class PlayerCompareResult(BaseModel):
-  player_1: PlayerStatsOut
-  player_2: PlayerStatsOut
+  # Left out when the client asks for the result only
+  player_1: PlayerStatsOut | None
+  player_2: PlayerStatsOut | None
   mode: CompareMode
   result: dict[str, Statline]
   season_overlap: list[str]
@@ -184,6 +426,25 @@ class PlayerCompareResult(BaseModel):
       res["season_name"] = mode.season_name
     return res
 
+MAX_COMPARE_PLAYERS = 10
+
+class PlayerGroupCompareResult(BaseModel):
+  player_ids: list[int]
+  players: list[PlayerStatsOut] | None
+  mode: CompareMode
+  # Stat mode -> stat -> rank of each player, in player_ids order
+  result: dict[str, dict[str, list[int]]]
+  season_overlap: list[str]
+
+  model_config = {"arbitrary_types_allowed": True}
+
+  @field_serializer("mode")
+  def serialize_mode(self, mode: CompareMode):
+    res = {"mode_type": _mode_str_map[mode.mode_type]}
+    if mode.mode_type == ModeTypeEnum.SEASON:
+      res["season_name"] = mode.season_name
+    return res
+
 class InvalidComparisonException(ValueError):
   pass
 
@@ -193,145 +454,250 @@ class PlayerStatInterface(ABC):
     ...
 
   @abstractmethod
-  def getPlayerStats(player_id: int) -> PlayerStatsOut:
+  def getPlayerStats(player_id: int, view: StatView = None) -> PlayerStatsOut:
     ...
 
   @abstractmethod
-  def comparePlayerStats(p1_id: int, p2_id: int, mode: CompareMode) -> PlayerCompareResult:
+  def comparePlayerStats(p1_id: int, p2_id: int, mode: CompareMode, include_players: bool = True) -> PlayerCompareResult:
     ...
 
-class PlayerStats(PlayerStatInterface):
-  def __init__(self, call_queue: CallQueue):
-    self.stat_cache = {}
-    self.last_access = {}
-    self.call_queue = call_queue
+  @abstractmethod
+  async def getPlayerStatsAsync(player_id: int, view: StatView = None) -> PlayerStatsOut:
+    ...
 
-    self.wait_time = 60
+  @abstractmethod
+  async def comparePlayerStatsAsync(p1_id: int, p2_id: int, mode: CompareMode,
+                                    include_players: bool = True) -> PlayerCompareResult:
+    ...
+
+  @abstractmethod
+  def comparePlayerGroup(player_ids: list[int], mode: CompareMode, include_players: bool = True) -> PlayerGroupCompareResult:
+    ...
 
-  def _getPerGameStats(self, totals: pd.DataFrame) -> pd.DataFrame:
-    divisor = 'GP'
-    ignored_cols = ['GS', divisor, 'FG_PCT', 'FG3_PCT', 'FT_PCT', 'SEASON_ID', 'TEAM_ABBREVIATION', 'PLAYER_AGE']
+  @abstractmethod
+  async def comparePlayerGroupAsync(player_ids: list[int], mode: CompareMode,
+                                    include_players: bool = True) -> PlayerGroupCompareResult:
+    ...
 
-    per_game_stats = totals.copy(deep = True)
-    altered_cols = per_game_stats.columns.difference(ignored_cols)
-    per_game_stats[altered_cols] = per_game_stats[altered_cols].div(per_game_stats[divisor], axis=0)
+class PlayerStats(PlayerStatInterface, CachedService):
+  SOFT_TTL = 60
+  HARD_TTL = 6 * 60 * 60
+  MAX_ENTRIES = 1000
+  MAX_BYTES = 64 * 1024 * 1024
+  # 2: careers are stored as StatTables
+  CACHE_VERSION = 2
+  COMPARE_ENTRIES = 1024
+  COMPARE_BYTES = 8 * 1024 * 1024
+
+  def __init__(self, call_queue: CallQueue, inflight: SingleFlight = None, serve_stale: bool = True,
+               store: CacheStore = None):
+    CachedService.__init__(self, "players", call_queue, inflight, serve_stale, store)
+    self.stat_cache = self.cache
+    # Comparison rankings by player ids and mode, tagged with the career
+    # versions they came from; player payloads are rebuilt per response
+    self.compare_cache = Cache(None, max_entries=self.COMPARE_ENTRIES, max_bytes=self.COMPARE_BYTES)
+
+  def _classify(self, player_id: int, career: Career) -> Freshness:
+    # Retired careers are done changing
+    player_details = nba_players.find_player_by_id(player_id)
+    if player_details is not None and not player_details['is_active']:
+      return Freshness.FINAL
+    return Freshness.LIVE
 
-    return per_game_stats
+  def _serialize(self, career: Career) -> dict:
+    return career.toJson()
 
-  def _getSeasonDict(self, season_series: pd.Series) -> dict:
-    season_dict = Statline.loadFromSeries(season_series).model_dump()
-    season_dict['season'] = season_series.loc['SEASON_ID']
-    season_dict['team'] = season_series.loc['TEAM_ABBREVIATION']
-    return season_dict
+  def _deserialize(self, data: dict) -> Career:
+    return Career.fromJson(data)
 
-  def getPlayerStats(self, player_id: int) -> PlayerStatsOut:
+  def _findPlayer(self, player_id: int) -> dict:
     if not isinstance(player_id, int):
       raise TypeError("player_id must be of type int")
-    
-    player_details = nba_players.find_player_by_id(player_id)
-    if player_details is None:
+    return nba_players.find_player_by_id(player_id)
+
+  def _getCareer(self, player_id: int) -> Career:
+    if self._findPlayer(player_id) is None:
       return None
+    return self._getCached(player_id)
 
-    if player_id in self.stat_cache.keys() and (monotonic() - self.last_access[player_id]) <= self.wait_time:
-      return self.stat_cache[player_id]
-    
-    delay = self.call_queue.addCall().ready_time - monotonic()
-    if (delay > 0):
-      sleep(delay)
-    
+  async def _getCareerAsync(self, player_id: int) -> Career:
+    if self._findPlayer(player_id) is None:
+      return None
+    return await self._getCachedAsync(player_id)
+
+  def getPlayerStats(self, player_id: int, view: StatView = None) -> PlayerStatsOut:
+    career = self._getCareer(player_id)
+    return None if career is None else career.toStatsOut(view)
+
+  async def getPlayerStatsAsync(self, player_id: int, view: StatView = None) -> PlayerStatsOut:
+    career = await self._getCareerAsync(player_id)
+    return None if career is None else career.toStatsOut(view)
+
+  @staticmethod
+  def _buildTables(nba_res: playercareerstats.PlayerCareerStats) -> dict:
+    tables = {
+      REGULAR_STR: StatTable.fromDataSets(nba_res.career_totals_regular_season, nba_res.season_totals_regular_season),
+      PLAYOFF_STR: StatTable.fromDataSets(nba_res.career_totals_post_season, nba_res.season_totals_post_season)
+    }
+    # Season types the player never played are left out
+    return {season_type: table for season_type, table in tables.items() if table is not None}
+
+  @staticmethod
+  def _buildCareer(player_id: int, name: str, headshot: str, nba_res: playercareerstats.PlayerCareerStats) -> Career:
+    return Career(player_id, name, headshot, PlayerStats._buildTables(nba_res))
+
+  @staticmethod
+  def _buildStats(nba_res: playercareerstats.PlayerCareerStats) -> dict:
+    return PlayerStats._buildCareer(None, None, None, nba_res).stats()
+
+  def _fetch(self, player_id: int) -> Career:
+    player_details = nba_players.find_player_by_id(player_id)
     try:
-      nba_res = playercareerstats.PlayerCareerStats(player_id=player_id, per_mode36="Totals")
-    except:
+      nba_res = observe(self.call_queue, playercareerstats.PlayerCareerStats, player_id=player_id, per_mode36="Totals")
+    except UpstreamUnavailable:
+      raise
+    except Exception:
       return None
-    self.last_access[player_id] = monotonic()
-
-    dropped_cols = ['PLAYER_ID', 'LEAGUE_ID', 'TEAM_ID']
-    career_total_regular = nba_res.career_totals_regular_season.get_data_frame().drop(columns=dropped_cols)
-    season_total_regular = nba_res.season_totals_regular_season.get_data_frame().drop(columns=dropped_cols)
-    career_total_playoff = nba_res.career_totals_post_season.get_data_frame().drop(columns=dropped_cols)
-    season_total_playoff = nba_res.season_totals_post_season.get_data_frame().drop(columns=dropped_cols)
-
-    played_regular = False
-    if not career_total_regular.empty:
-      played_regular = True
-      career_pergame_regular = self._getPerGameStats(career_total_regular)
-      season_pergame_regular = self._getPerGameStats(season_total_regular)
-
-    played_playoff = False
-    if not career_total_playoff.empty:
-      played_playoff = True
-      career_pergame_playoff = self._getPerGameStats(career_total_playoff)
-      season_pergame_playoff = self._getPerGameStats(season_total_playoff)
 
     name = player_details['full_name']
     headshot = _getPlayerHeadshot(player_id)
-    stats = {}
-    
-    if played_regular:
-      stats[REGULAR_STR] = {}
-      stats[REGULAR_STR][TOTAL_STR] = {}
-      stats[REGULAR_STR][PERGAME_STR] = {}
-
-      stats[REGULAR_STR][TOTAL_STR][CAREER_STR] = Statline.loadFromSeries(career_total_regular.iloc[0]).model_dump()
-      stats[REGULAR_STR][TOTAL_STR][SEASON_STR] = []
-      for _, row in season_total_regular.iterrows():
-        stats[REGULAR_STR][TOTAL_STR][SEASON_STR].append(self._getSeasonDict(row))
-
-      stats[REGULAR_STR][PERGAME_STR][CAREER_STR] = Statline.loadFromSeries(career_pergame_regular.iloc[0]).model_dump()
-      stats[REGULAR_STR][PERGAME_STR][SEASON_STR] = []
-      for _, row in season_pergame_regular.iterrows():
-        stats[REGULAR_STR][PERGAME_STR][SEASON_STR].append(self._getSeasonDict(row))
-
-    if played_playoff:
-      stats[PLAYOFF_STR] = {}
-      stats[PLAYOFF_STR][TOTAL_STR] = {}
-      stats[PLAYOFF_STR][PERGAME_STR] = {}
-
-      stats[PLAYOFF_STR][TOTAL_STR][CAREER_STR] = Statline.loadFromSeries(career_total_playoff.iloc[0]).model_dump()
-      stats[PLAYOFF_STR][TOTAL_STR][SEASON_STR] = []
-      for _, row in season_total_playoff.iterrows():
-        stats[PLAYOFF_STR][TOTAL_STR][SEASON_STR].append(self._getSeasonDict(row))
-
-      stats[PLAYOFF_STR][PERGAME_STR][CAREER_STR] = Statline.loadFromSeries(career_pergame_playoff.iloc[0]).model_dump()
-      stats[PLAYOFF_STR][PERGAME_STR][SEASON_STR] = []
-      for _, row in season_pergame_playoff.iterrows():
-        stats[PLAYOFF_STR][PERGAME_STR][SEASON_STR].append(self._getSeasonDict(row))
-
-    res = PlayerStatsOut(player_name=name, player_id=player_id, player_headshot=headshot, stats=stats)
-    return res
+    return PlayerStats._buildCareer(player_id, name, headshot, nba_res)
   
-  def comparePlayerStats(self, p1_id: int, p2_id: int, mode: CompareMode) -> PlayerCompareResult:
+  def comparePlayerStats(self, p1_id: int, p2_id: int, mode: CompareMode,
+                         include_players: bool = True) -> PlayerCompareResult:
     # Load player stats
-    player_1 = self.getPlayerStats(p1_id)
-    player_2 = self.getPlayerStats(p2_id)
-    if player_1 is None or player_2 is None:
+    career_1 = self._getCareer(p1_id)
+    career_2 = self._getCareer(p2_id)
+    return self._memoPair(career_1, career_2, mode, include_players)
+
+  async def comparePlayerStatsAsync(self, p1_id: int, p2_id: int, mode: CompareMode,
+                                    include_players: bool = True) -> PlayerCompareResult:
+    career_1, career_2 = await asyncio.gather(self._getCareerAsync(p1_id), self._getCareerAsync(p2_id))
+    return self._memoPair(career_1, career_2, mode, include_players)
+
+  def comparePlayerGroup(self, player_ids: list[int], mode: CompareMode,
+                         include_players: bool = True) -> PlayerGroupCompareResult:
+    player_ids = self._groupIds(player_ids)
+    careers = [self._getCareer(player_id) for player_id in player_ids]
+    return self._memoGroup(player_ids, careers, mode, include_players)
+
+  async def comparePlayerGroupAsync(self, player_ids: list[int], mode: CompareMode,
+                                    include_players: bool = True) -> PlayerGroupCompareResult:
+    player_ids = self._groupIds(player_ids)
+    # Cached careers come straight back, and misses queue for rate-limit slots together
+    careers = await asyncio.gather(*(self._getCareerAsync(player_id) for player_id in player_ids))
+    return self._memoGroup(player_ids, careers, mode, include_players)
+
+  def compareStats(self) -> dict:
+    return self.compare_cache.stats()
+
+  @staticmethod
+  def _modeKey(mode: CompareMode) -> tuple:
+    return (mode.mode_type, mode.season_name if mode.mode_type == ModeTypeEnum.SEASON else None)
+
+  def _memoized(self, key: tuple, careers: list[Career], compute) -> tuple:
+    versions = tuple(career.version for career in careers)
+    entry = self.compare_cache.get(key)
+    if entry is not None and entry[0] == versions:
+      return entry[1]
+    # Refreshed careers overwrite the result computed from their old versions
+    res = compute()
+    self.compare_cache.set(key, (versions, res))
+    return res
+
+  def _memoPair(self, career_1: Career, career_2: Career, mode: CompareMode,
+                include_players: bool) -> PlayerCompareResult:
+    if career_1 is None or career_2 is None:
       return None
-    
+    # Results are kept for the lower id first; the other order just flips the signs
+    flip = career_1.player_id > career_2.player_id
+    low, high = (career_2, career_1) if flip else (career_1, career_2)
+    key = ("pair", low.player_id, high.player_id, self._modeKey(mode))
+    res, season_overlap = self._memoized(key, [low, high], lambda: self._comparePlayers(low, high, mode))
+    if flip:
+      res = {stat_mode: Statline(**{name: -value for name, value in line.model_dump().items()})
+             for stat_mode, line in res.items()}
+    player_1, player_2 = (career_1.toStatsOut(), career_2.toStatsOut()) if include_players else (None, None)
+    return PlayerCompareResult(player_1=player_1, player_2=player_2, mode=mode, result=res,
+                               season_overlap=season_overlap)
+
+  def _memoGroup(self, player_ids: list[int], careers: list[Career], mode: CompareMode,
+                 include_players: bool) -> PlayerGroupCompareResult:
+    if any(career is None for career in careers):
+      return None
+    # Results are kept for the ids in sorted order and rearranged for each request
+    order = sorted(range(len(player_ids)), key=lambda k: player_ids[k])
+    sorted_ids = [player_ids[k] for k in order]
+    sorted_careers = [careers[k] for k in order]
+    key = ("group", tuple(sorted_ids), self._modeKey(mode))
+    res, season_overlap = self._memoized(key, sorted_careers, lambda: self._compareGroup(sorted_careers, mode))
+    if sorted_ids != player_ids:
+      position = {player_id: k for k, player_id in enumerate(sorted_ids)}
+      rows = [position[player_id] for player_id in player_ids]
+      res = {stat_mode: {name: [ranks[row] for row in rows] for name, ranks in lines.items()}
+             for stat_mode, lines in res.items()}
+    players = [career.toStatsOut() for career in careers] if include_players else None
+    return PlayerGroupCompareResult(player_ids=player_ids, players=players, mode=mode, result=res,
+                                    season_overlap=season_overlap)
+
+  @staticmethod
+  def _groupIds(player_ids: list[int]) -> list[int]:
+    player_ids = list(dict.fromkeys(player_ids))
+    if not 2 <= len(player_ids) <= MAX_COMPARE_PLAYERS:
+      raise InvalidComparisonException(f"Comparisons take 2 to {MAX_COMPARE_PLAYERS} distinct players")
+    return player_ids
+
+  def _compareGroup(self, careers: list[Career], mode: CompareMode) -> tuple:
+    if any(REGULAR_STR not in career.tables for career in careers):
+      raise InvalidComparisonException("Every player must have regular season stats")
+    tables = [career.tables[REGULAR_STR] for career in careers]
+
+    season_overlap = getSeasonOverlap(*tables)
+    if mode.mode_type == ModeTypeEnum.SEASON:
+      if any(mode.season_name not in table.season_set for table in tables):
+        raise InvalidComparisonException("No overlap in seasons between given players")
+      season_name = mode.season_name
+    elif mode.mode_type == ModeTypeEnum.CAREER:
+      season_name = None
+    else:
+      raise InvalidComparisonException("Invalid mode of comparison (should be career or season)")
+
+    # One players x stats matrix per stat mode, ranked column-wise in one go
+    res = {}
+    for stat_mode, per_game in ((TOTAL_STR, False), (PERGAME_STR, True)):
+      values = np.vstack([table.statRow(per_game, season_name) for table in tables])
+      ranks = rankStats(values)
+      res[stat_mode] = {name: ranks[:, j].tolist() for j, name in enumerate(_STAT_NAMES)}
+    return res, season_overlap
+
+  def _comparePlayers(self, career_1: Career, career_2: Career, mode: CompareMode) -> tuple:
+    if REGULAR_STR not in career_1.tables or REGULAR_STR not in career_2.tables:
+      raise InvalidComparisonException("Both players must have regular season stats")
+    p1_table = career_1.tables[REGULAR_STR]
+    p2_table = career_2.tables[REGULAR_STR]
+
     # Check for valid comparison mode
-    season_overlap = getSeasonOverlap(player_1, player_2)
-    if mode.mode_type == ModeTypeEnum.SEASON and mode.season_name not in season_overlap:
+    season_overlap = getSeasonOverlap(p1_table, p2_table)
+    if mode.mode_type == ModeTypeEnum.SEASON and not (mode.season_name in p1_table.season_set and
+                                                     mode.season_name in p2_table.season_set):
       raise InvalidComparisonException("No overlap in seasons between given players")
     
     # Finds source statlines for comparison
-    p1_totals_dict = player_1.stats[REGULAR_STR][TOTAL_STR]
-    p2_totals_dict = player_2.stats[REGULAR_STR][TOTAL_STR]
-    p1_pergame_dict = player_1.stats[REGULAR_STR][PERGAME_STR]
-    p2_pergame_dict = player_2.stats[REGULAR_STR][PERGAME_STR]
     if mode.mode_type == ModeTypeEnum.CAREER:
 
-      p1_total: Statline    = p1_totals_dict[CAREER_STR]
-      p2_total: Statline    = p2_totals_dict[CAREER_STR]
+      p1_total: Statline    = p1_table.careerLine(False)
+      p2_total: Statline    = p2_table.careerLine(False)
 
-      p1_pergame: Statline  = p1_pergame_dict[CAREER_STR]
-      p2_pergame: Statline  = p2_pergame_dict[CAREER_STR]
+      p1_pergame: Statline  = p1_table.careerLine(True)
+      p2_pergame: Statline  = p2_table.careerLine(True)
 
     elif mode.mode_type == ModeTypeEnum.SEASON:
 
-      p1_total: Statline    = findSeasonWithName(p1_totals_dict[SEASON_STR], mode.season_name)
-      p2_total: Statline    = findSeasonWithName(p2_totals_dict[SEASON_STR], mode.season_name)
+      p1_total: Statline    = p1_table.seasonLine(False, mode.season_name)
+      p2_total: Statline    = p2_table.seasonLine(False, mode.season_name)
 
-      p1_pergame: Statline  = findSeasonWithName(p1_pergame_dict[SEASON_STR], mode.season_name)
-      p2_pergame: Statline  = findSeasonWithName(p2_pergame_dict[SEASON_STR], mode.season_name)
+      p1_pergame: Statline  = p1_table.seasonLine(True, mode.season_name)
+      p2_pergame: Statline  = p2_table.seasonLine(True, mode.season_name)
 
     else:
       raise InvalidComparisonException("Invalid mode of comparison (should be career or season)")
@@ -364,5 +730,4 @@ class PlayerStats(PlayerStatInterface):
         setattr(pergame_res, name, -1)
       
     res = {TOTAL_STR: total_res, PERGAME_STR: pergame_res}
-
-    return PlayerCompareResult(player_1=player_1, player_2=player_2, mode=mode, result=res, season_overlap=season_overlap)
\ No newline at end of file
+    return res, season_overlap
\ No newline at end of file
@@ -0,0 +1,29 @@
+from datetime import date
+
+# Regular seasons tip off in October. Standings stop moving once the
+# regular season ends in April; nothing about a season changes after the
+# Finals, which are over by July.
+SEASON_START_MONTH = 10
+REGULAR_SEASON_END = (4, 20)
+SEASON_END = (7, 1)
+
+def currentSeasonStartYear(today: date = None) -> int:
+  today = today if today is not None else date.today()
+  if today.month >= SEASON_START_MONTH:
+    return today.year
+  return today.year - 1
+
+def seasonStartYear(season_id: str) -> int:
+  '''Start year of a season id like "2015-16", or None if it cannot be parsed'''
+  if not isinstance(season_id, str) or len(season_id) != 7 or season_id[4] != '-':
+    return None
+  start = season_id[:4]
+  if not start.isnumeric():
+    return None
+  return int(start)
+
+def gameSeasonStartYear(game_id: str) -> int:
+  '''Start year of the season a game id like "0022500397" belongs to'''
+  year = int(game_id[3:5])
+  # Game ids only carry two digits, and the league's records start in 1946
+  return 1900 + year if year >= 46 else 2000 + year
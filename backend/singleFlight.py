@@ -0,0 +1,54 @@
+import asyncio
+from threading import Lock
+
+class SingleFlight:
+  '''
+  Registry of in-progress upstream fetches keyed by (service, key).
+
+  The first caller to miss starts the fetch; anyone who misses on the same key
+  while it is running awaits the same task instead of taking another
+  CallQueue slot.
+  '''
+  def __init__(self):
+    self._inflight: dict[tuple, asyncio.Task] = {}
+    self._lock = Lock()
+    self.fetches = 0
+    self.coalesced = 0
+
+  def __repr__(self) -> str:
+    return f'{self.fetches} fetches | {self.coalesced} coalesced | {len(self._inflight)} in flight'
+
+  def inFlight(self, service: str, key) -> bool:
+    return (service, key) in self._inflight
+
+  async def do(self, service: str, key, fetch):
+    '''Runs fetch() (a coroutine function) unless the same key is already being fetched'''
+    flight_key = (service, key)
+    with self._lock:
+      task = self._inflight.get(flight_key)
+      if task is None:
+        task = asyncio.ensure_future(fetch())
+        self._inflight[flight_key] = task
+        task.add_done_callback(lambda _: self._finish(flight_key, task))
+        self.fetches += 1
+      else:
+        self.coalesced += 1
+
+    # Shield so one caller disconnecting doesn't cancel the fetch for everyone else
+    return await asyncio.shield(task)
+
+  def _finish(self, flight_key: tuple, task: asyncio.Task) -> None:
+    with self._lock:
+      if self._inflight.get(flight_key) is task:
+        del self._inflight[flight_key]
+    # Mark the exception as retrieved in case every waiter went away
+    if not task.cancelled():
+      task.exception()
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        "fetches": self.fetches,
+        "coalesced": self.coalesced,
+        "in_flight": len(self._inflight)
+      }
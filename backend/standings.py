@@ -1,21 +1,28 @@
 from nba_api.stats.endpoints import leaguestandingsv3
 import pandas as pd
-from time import monotonic, sleep
+from datetime import date
 
-from callQueue import Call, CallQueue
+from cachedService import CachedService, Freshness
+from callQueue import CallQueue
+from singleFlight import SingleFlight
+from upstream import observe, UpstreamUnavailable
+from store import CacheStore
+from seasons import seasonStartYear, REGULAR_SEASON_END, SEASON_END
 
 _LEAGUE_ID = "00"
 _SEASON_TYPE = "Regular Season"
 
-class Standings:
-  def __init__(self, call_queue: CallQueue):
-    # Rudimentary cache system
-    self.items = {}
-    self.last_access = {}
-    self.call_queue = call_queue
+class Standings(CachedService):
+  # Delay before updating cache
+  SOFT_TTL = 60
+  HARD_TTL = 6 * 60 * 60
+  MAX_ENTRIES = 100
+  MAX_BYTES = 4 * 1024 * 1024
 
-    # Delay before updating cache
-    self.wait_time = 60
+  def __init__(self, call_queue: CallQueue, inflight: SingleFlight = None, serve_stale: bool = True,
+               store: CacheStore = None):
+    CachedService.__init__(self, "standings", call_queue, inflight, serve_stale, store)
+    self.items = self.cache
 
   @staticmethod
   def _renameDF(df: pd.DataFrame) -> pd.DataFrame:
@@ -52,21 +59,25 @@ class Standings:
     }
     return conferences
 
-  def getStandings(self, season_id: str) -> dict:
-    # If the data is already cached and it's been a short time, just return cached data
-    if season_id in self.items.keys() and (monotonic() - self.last_access[season_id]) <= self.wait_time:
-      return self.items[season_id]
-    
-    c = self.call_queue.addCall()
-    delay = c.ready_time - monotonic()
-    if (delay > 0):
-      sleep(delay)
+  def _classify(self, season_id: str, standings: dict) -> Freshness:
+    start_year = seasonStartYear(season_id)
+    if start_year is None:
+      return Freshness.LIVE
+    today = date.today()
+    if today >= date(start_year + 1, *SEASON_END):
+      return Freshness.FINAL
+    if today >= date(start_year + 1, *REGULAR_SEASON_END):
+      return Freshness.SETTLING
+    return Freshness.LIVE
 
+  def _fetch(self, season_id: str) -> dict:
     try:
-      df = leaguestandingsv3.LeagueStandingsV3(league_id=_LEAGUE_ID, season=season_id, season_type=_SEASON_TYPE).get_data_frames()[0]
-    except:
+      df = observe(self.call_queue, leaguestandingsv3.LeagueStandingsV3, league_id=_LEAGUE_ID, season=season_id,
+                   season_type=_SEASON_TYPE).get_data_frames()[0]
+    except UpstreamUnavailable:
+      raise
+    except Exception:
       return None
-    self.last_access[season_id] = monotonic()
 
     df = Standings._formatDF(df)
     conferences = Standings._getConferenceDicts(df)
@@ -76,5 +87,10 @@ class Standings:
       "east" : conferences["East"],
       "west" : conferences["West"]
     }
-    self.items[season_id] = res
     return res
+
+  def getStandings(self, season_id: str) -> dict:
+    return self._getCached(season_id)
+
+  async def getStandingsAsync(self, season_id: str) -> dict:
+    return await self._getCachedAsync(season_id)
@@ -0,0 +1,123 @@
+from abc import ABC, abstractmethod
+from time import time
+import sqlite3
+import threading
+
+class StoredItem:
+  def __init__(self, payload: str, stored_at: float, soft_ttl: float, hard_ttl: float):
+    self.payload = payload
+    self.stored_at = stored_at
+    self.soft_ttl = soft_ttl
+    self.hard_ttl = hard_ttl
+
+  def age(self) -> float:
+    # Wall clock time, since monotonic clocks aren't comparable between processes
+    return max(0.0, time() - self.stored_at)
+
+class CacheStore(ABC):
+  @abstractmethod
+  def get(self, namespace: str, key: str, version: str) -> StoredItem:
+    ...
+
+  @abstractmethod
+  def set(self, namespace: str, key: str, version: str, payload: str,
+          soft_ttl: float = None, hard_ttl: float = None) -> None:
+    ...
+
+  @abstractmethod
+  def delete(self, namespace: str, key: str) -> None:
+    ...
+
+class SqliteStore(CacheStore):
+  '''
+  Cache entries persisted in a SQLite file.
+
+  WAL mode lets every uvicorn worker on the host read while one writes, so
+  they all share warm data, and the file survives restarts. Rows written
+  under a different version are ignored by get(). Final data is stored
+  without a hard TTL, so prune() also keeps each namespace to its newest
+  max_rows rows; it is meant to be called periodically.
+  '''
+  MAX_ROWS = 5000
+
+  def __init__(self, path: str, timeout: float = 5.0, max_rows: int = MAX_ROWS):
+    self.path = path
+    self.timeout = timeout
+    self.max_rows = max_rows
+    self._local = threading.local()
+
+    conn = self._conn()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS entries (
+        namespace TEXT NOT NULL,
+        key       TEXT NOT NULL,
+        version   TEXT NOT NULL,
+        stored_at REAL NOT NULL,
+        soft_ttl  REAL,
+        hard_ttl  REAL,
+        payload   TEXT NOT NULL,
+        PRIMARY KEY (namespace, key)
+      )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_age ON entries (namespace, stored_at)")
+    conn.commit()
+
+  def __repr__(self) -> str:
+    return f'SqliteStore({self.path})'
+
+  def _conn(self) -> sqlite3.Connection:
+    # sqlite3 connections may not be shared between threads
+    conn = getattr(self._local, 'conn', None)
+    if conn is None:
+      conn = sqlite3.connect(self.path, timeout=self.timeout)
+      conn.execute("PRAGMA synchronous=NORMAL")
+      self._local.conn = conn
+    return conn
+
+  def get(self, namespace: str, key: str, version: str) -> StoredItem:
+    row = self._conn().execute(
+      "SELECT payload, stored_at, soft_ttl, hard_ttl FROM entries WHERE namespace = ? AND key = ? AND version = ?",
+      (namespace, key, version)
+    ).fetchone()
+    if row is None:
+      return None
+    return StoredItem(*row)
+
+  def set(self, namespace: str, key: str, version: str, payload: str,
+          soft_ttl: float = None, hard_ttl: float = None) -> None:
+    conn = self._conn()
+    conn.execute(
+      "INSERT OR REPLACE INTO entries (namespace, key, version, stored_at, soft_ttl, hard_ttl, payload) VALUES (?, ?, ?, ?, ?, ?, ?)",
+      (namespace, key, version, time(), soft_ttl, hard_ttl, payload)
+    )
+    conn.commit()
+
+  def delete(self, namespace: str, key: str) -> None:
+    conn = self._conn()
+    conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+    conn.commit()
+
+  def prune(self, grace: float = 0) -> int:
+    '''
+    Deletes rows that have been past their hard TTL for longer than grace
+    seconds, then the oldest rows of any namespace over max_rows. Returns
+    how many rows were deleted.
+    '''
+    conn = self._conn()
+    expired = conn.execute(
+      "DELETE FROM entries WHERE hard_ttl IS NOT NULL AND stored_at + hard_ttl + ? < ?",
+      (grace, time())
+    ).rowcount
+    evicted = 0
+    if self.max_rows is not None:
+      evicted = conn.execute("""
+        DELETE FROM entries WHERE rowid IN (
+          SELECT rowid FROM (
+            SELECT rowid, ROW_NUMBER() OVER (PARTITION BY namespace ORDER BY stored_at DESC) AS newer
+            FROM entries
+          ) WHERE newer > ?
+        )
+      """, (self.max_rows,)).rowcount
+    conn.commit()
+    return expired + evicted
@@ -1,7 +1,13 @@
+import asyncio
+import threading
 import unittest
 
-from boxscores import Boxscores
+from boxscores import Boxscores, _summaryHeader
+from games import Games
 from callQueue import CallQueue
+from cachedService import Freshness
+from bench_boxscores import (syntheticTraditionalResponse, syntheticSummaryResponse, loadTraditional, loadSummary,
+                             legacyBoxscore, sameBoxscore)
 
 class TestBoxscores(unittest.TestCase):
   def setUp(self):
@@ -141,5 +147,96 @@ class TestBoxscores(unittest.TestCase):
     self.assertTrue(isinstance(res['started'], bool))
     self.assertTrue(isinstance(res['stats'], dict))
 
+  def test_classify_oldfinalgame(self):
+    score = {"status": "Final"}
+    self.assertEqual(self.boxscores._classify("0021500001", score), Freshness.FINAL)
+
+  def test_classify_unfinishedgame(self):
+    score = {"status": "Q3 5:21"}
+    self.assertEqual(self.boxscores._classify("0021500001", score), Freshness.LIVE)
+
+class TestBoxscoreBuild(unittest.TestCase):
+  def setUp(self):
+    self.boxscores = Boxscores(CallQueue(0))
+    self.boxscore = loadTraditional(syntheticTraditionalResponse())
+
+  def test_buildboxscore_matchesrowwise(self):
+    summary = loadSummary(syntheticSummaryResponse())
+    res = self.boxscores._buildBoxscore(self.boxscore, _summaryHeader(summary), True)
+    self.assertTrue(sameBoxscore(legacyBoxscore(self.boxscore, summary, True), res))
+    self.assertEqual(len(res["team_0"]["player_stats"]), 15)
+    self.assertEqual(res["team_1"]["team_city"], "Golden State")
+
+  def test_buildboxscore_noscore(self):
+    summary = loadSummary(syntheticSummaryResponse("7:30 pm ET"))
+    res = self.boxscores._buildBoxscore(None, _summaryHeader(summary), False)
+    self.assertTrue(sameBoxscore(legacyBoxscore(None, summary, False), res))
+    self.assertEqual(res["status"], "7:30 pm ET")
+
+class TestBoxscoreFetch(unittest.TestCase):
+  def setUp(self):
+    self.games = Games(CallQueue(0))
+    self.boxscores = Boxscores(CallQueue(0), games=self.games)
+    self.game_id = "0022500397"
+    self.summary = loadSummary(syntheticSummaryResponse())
+    self.boxscore = loadTraditional(syntheticTraditionalResponse())
+
+  def _scoreboardGame(self, status: str) -> dict:
+    return {
+      "game_id": int(self.game_id), "status": status,
+      "home_team": {"team_id": 1610612739, "city": "Cleveland", "score": 100, "logo": ""},
+      "away_team": {"team_id": 1610612744, "city": "Golden State", "score": 90, "logo": ""}
+    }
+
+  def test_finishedgame_skipssummary(self):
+    self.games._remember([self._scoreboardGame("Final")])
+    def summary(game_id):
+      raise AssertionError("summary should not be fetched")
+    self.boxscores._fetchSummary = summary
+    self.boxscores._fetchTraditional = lambda game_id: (self.boxscore, True)
+
+    res = asyncio.run(self.boxscores._loadAsync(self.game_id))
+    expected = self.boxscores._buildBoxscore(self.boxscore, _summaryHeader(self.summary), True)
+    self.assertTrue(sameBoxscore(expected, res))
+    self.assertEqual(self.boxscores.stats(), {"summaries_fetched": 0, "summaries_skipped": 1})
+
+  def test_finishedgame_noscoreusesscoreboardteams(self):
+    self.games._remember([self._scoreboardGame("Final")])
+    self.boxscores._fetchTraditional = lambda game_id: (None, False)
+    res = self.boxscores._load(self.game_id)
+    self.assertEqual(res["team_0"]["team_city"], "Cleveland")
+    self.assertEqual(res["team_1"]["team_id"], 1610612744)
+
+  def test_unfinishedgame_fetchesconcurrently(self):
+    self.games._remember([self._scoreboardGame("Q3 5:12")])
+    # Each call only returns once the other one has started
+    both = threading.Barrier(2, timeout=5)
+    def summary(game_id):
+      both.wait()
+      return self.summary
+    def traditional(game_id):
+      both.wait()
+      return self.boxscore, True
+    self.boxscores._fetchSummary = summary
+    self.boxscores._fetchTraditional = traditional
+
+    res = asyncio.run(self.boxscores._loadAsync(self.game_id))
+    self.assertEqual(res["status"], "Final")
+    self.assertEqual(self.boxscores.stats(), {"summaries_fetched": 1, "summaries_skipped": 0})
+
+  def test_noburst_fetchesinturn(self):
+    boxscores = Boxscores(CallQueue(60), games=self.games)
+    boxscores._fetchSummary = lambda game_id: None
+    def traditional(game_id):
+      raise AssertionError("traditional should not be fetched")
+    boxscores._fetchTraditional = traditional
+    self.assertIsNone(asyncio.run(boxscores._loadAsync(self.game_id)))
+    self.assertEqual(boxscores.call_queue.total_calls, 1)
+
+  def test_missingsummary_nogame(self):
+    self.boxscores._fetchSummary = lambda game_id: None
+    self.boxscores._fetchTraditional = lambda game_id: (None, False)
+    self.assertIsNone(asyncio.run(self.boxscores._loadAsync(self.game_id)))
+
 if __name__ == "__main__":
   unittest.main()
\ No newline at end of file
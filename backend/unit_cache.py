@@ -0,0 +1,336 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import sqlite3
+import time
+
+from cache import Cache, estimateSize
+from cachedService import CachedService, Freshness
+from callQueue import CallQueue
+import executor
+from executor import runBlocking
+from store import SqliteStore
+from breaker import CircuitBreaker, CircuitOpen, BreakerState
+from upstream import UpstreamUnavailable
+
+def _age(cache: Cache, key, seconds: float):
+  cache._entries[key].fetched_at -= seconds
+
+class TestCache(unittest.TestCase):
+  def setUp(self):
+    self.cache = Cache(10, 100)
+
+  def test_cache_badttls(self):
+    with self.assertRaises(ValueError):
+      Cache(10, 5)
+
+  def test_get_missing(self):
+    self.assertIsNone(self.cache.get("missing"))
+
+  def test_get_fresh(self):
+    self.cache.set("key", 5)
+    self.assertEqual(self.cache.get("key"), 5)
+
+  def test_lookup_stale(self):
+    self.cache.set("key", 5)
+    _age(self.cache, "key", 50)
+    entry = self.cache.lookup("key")
+    self.assertFalse(entry.isFresh())
+    self.assertFalse(entry.isExpired())
+    self.assertIsNone(self.cache.get("key"))
+
+  def test_lookup_expiredkept(self):
+    cache = Cache(10, 100, keep_expired=True)
+    cache.set("key", 5)
+    _age(cache, "key", 500)
+    self.assertTrue(cache.lookup("key").isExpired())
+
+  def test_set_entryttl(self):
+    self.cache.set("key", 5, soft_ttl=1000)
+    _age(self.cache, "key", 50)
+    self.assertEqual(self.cache.get("key"), 5)
+
+  def test_lookup_expireddropped(self):
+    self.cache.set("key", 5)
+    _age(self.cache, "key", 500)
+    self.assertIsNone(self.cache.lookup("key"))
+    self.assertEqual(len(self.cache), 0)
+    self.assertEqual(self.cache.expirations, 1)
+
+  def test_lookup_counters(self):
+    self.cache.set("key", 5)
+    self.cache.lookup("key")
+    self.cache.lookup("missing")
+    _age(self.cache, "key", 50)
+    self.cache.lookup("key")
+    stats = self.cache.stats()
+    self.assertEqual(stats["hits"], 1)
+    self.assertEqual(stats["misses"], 1)
+    self.assertEqual(stats["stale_hits"], 1)
+
+class TestBoundedCache(unittest.TestCase):
+  def test_set_maxentrieslru(self):
+    cache = Cache(10, 100, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.lookup("a")
+    cache.set("c", 3)
+    self.assertIn("a", cache)
+    self.assertNotIn("b", cache)
+    self.assertEqual(cache.evictions, 1)
+
+  def test_set_maxbytes(self):
+    cache = Cache(10, 100, max_bytes=10000)
+    for i in range(20):
+      cache.set(i, "x" * 1000)
+    self.assertLessEqual(cache.total_bytes, 10000)
+    self.assertIn(19, cache)
+    self.assertGreater(cache.evictions, 0)
+
+  def test_set_expiredevictedfirst(self):
+    cache = Cache(10, 100, max_entries=2, keep_expired=True)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    _age(cache, "b", 500)
+    cache.lookup("a")
+    cache.lookup("b")
+    cache.set("c", 3)
+    self.assertIn("a", cache)
+    self.assertNotIn("b", cache)
+
+  def test_set_replacekeepsbytes(self):
+    cache = Cache(10, 100, max_bytes=100000)
+    cache.set("a", "x" * 1000)
+    cache.set("a", "x" * 1000)
+    self.assertLess(cache.total_bytes, 2000)
+
+  def test_estimatesize_nested(self):
+    self.assertGreater(estimateSize({"a": ["x" * 1000]}), 1000)
+
+class FakeService(CachedService):
+  SOFT_TTL = 10
+  HARD_TTL = 100
+
+  def __init__(self, serve_stale: bool = True, store: SqliteStore = None):
+    super().__init__("fake", CallQueue(0), serve_stale=serve_stale, store=store)
+    self.fetches = 0
+    self.fail = False
+    self.down = False
+
+  def _fetch(self, key):
+    self.fetches += 1
+    if self.down:
+      raise UpstreamUnavailable("throttled")
+    if self.fail:
+      return None
+    return f"{key}-{self.fetches}"
+
+class TestCachedService(unittest.IsolatedAsyncioTestCase):
+  def setUp(self):
+    self.service = FakeService()
+
+  async def test_getcached_missfetches(self):
+    self.assertEqual(await self.service._getCachedAsync("a"), "a-1")
+    self.assertEqual(await self.service._getCachedAsync("a"), "a-1")
+    self.assertEqual(self.service.fetches, 1)
+
+  async def test_getcached_staleservedandrefreshed(self):
+    await self.service._getCachedAsync("a")
+    _age(self.service.cache, "a", 50)
+    self.assertEqual(await self.service._getCachedAsync("a"), "a-1")
+    await asyncio.gather(*self.service._refreshes)
+    self.assertEqual(await self.service._getCachedAsync("a"), "a-2")
+
+  async def test_getcached_failedrefreshkeepsentry(self):
+    await self.service._getCachedAsync("a")
+    _age(self.service.cache, "a", 50)
+    self.service.fail = True
+    await self.service._getCachedAsync("a")
+    await asyncio.gather(*self.service._refreshes)
+    self.assertEqual(self.service.cache.lookup("a").value, "a-1")
+
+  async def test_getcached_expiredservedonfailure(self):
+    await self.service._getCachedAsync("a")
+    _age(self.service.cache, "a", 500)
+    self.service.fail = True
+    self.assertEqual(await self.service._getCachedAsync("a"), "a-1")
+
+  async def test_getcached_expirednotservedwhendisabled(self):
+    service = FakeService(serve_stale=False)
+    await service._getCachedAsync("a")
+    _age(service.cache, "a", 500)
+    service.fail = True
+    self.assertIsNone(await service._getCachedAsync("a"))
+
+  async def test_getcached_finalnevergoesstale(self):
+    self.service._classify = lambda key, value: Freshness.FINAL
+    await self.service._getCachedAsync("a")
+    _age(self.service.cache, "a", 10 ** 6)
+    self.assertEqual(await self.service._getCachedAsync("a"), "a-1")
+    self.assertEqual(len(self.service._refreshes), 0)
+
+  def test_getcachedsync_refetchesstale(self):
+    self.service._getCached("a")
+    _age(self.service.cache, "a", 50)
+    self.assertEqual(self.service._getCached("a"), "a-2")
+
+  async def test_getcached_missingkeycachednegatively(self):
+    self.service.fail = True
+    self.assertIsNone(await self.service._getCachedAsync("a"))
+    self.assertIsNone(await self.service._getCachedAsync("a"))
+    self.assertEqual(self.service.fetches, 1)
+    _age(self.service.cache, "a", FakeService.NEGATIVE_TTL + 1)
+    await self.service._getCachedAsync("a")
+    self.assertEqual(self.service.fetches, 2)
+
+  async def test_getcached_emptyrefreshkeepsvalue(self):
+    await self.service._getCachedAsync("a")
+    _age(self.service.cache, "a", 50)
+    self.service.fail = True
+    self.service._store("a", None)
+    self.assertEqual(self.service.cache.peek("a").value, "a-1")
+    # The old value is served without refetching until NEGATIVE_TTL passes
+    self.assertEqual(await self.service._getCachedAsync("a"), "a-1")
+    self.assertEqual(len(self.service._refreshes), 0)
+
+  async def test_getcached_breakeropensafterfailures(self):
+    self.service.down = True
+    for i in range(self.service.breaker.failure_threshold):
+      with self.assertRaises(UpstreamUnavailable):
+        await self.service._getCachedAsync(f"k{i}")
+    with self.assertRaises(CircuitOpen):
+      await self.service._getCachedAsync("other")
+    self.assertEqual(self.service.fetches, self.service.breaker.failure_threshold)
+
+  async def test_getcached_staleservedwhiledown(self):
+    await self.service._getCachedAsync("a")
+    _age(self.service.cache, "a", 500)
+    self.service.down = True
+    self.assertEqual(await self.service._getCachedAsync("a"), "a-1")
+
+class TestCircuitBreaker(unittest.TestCase):
+  def setUp(self):
+    self.breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+
+  def _expire(self):
+    self.breaker.opened_at -= 31
+
+  def test_check_closed(self):
+    self.breaker.recordFailure()
+    self.breaker.check()
+    self.assertEqual(self.breaker.state, BreakerState.CLOSED)
+
+  def test_check_open(self):
+    self.breaker.recordFailure()
+    self.breaker.recordFailure()
+    self.assertFalse(self.breaker.allows())
+    with self.assertRaises(CircuitOpen):
+      self.breaker.check()
+    self.assertEqual(self.breaker.rejected, 1)
+
+  def test_check_halfopensingletrial(self):
+    self.breaker.recordFailure()
+    self.breaker.recordFailure()
+    self._expire()
+    self.breaker.check()
+    self.assertEqual(self.breaker.state, BreakerState.HALF_OPEN)
+    with self.assertRaises(CircuitOpen):
+      self.breaker.check()
+    self.breaker.recordSuccess()
+    self.assertEqual(self.breaker.state, BreakerState.CLOSED)
+
+  def test_recordfailure_trialreopens(self):
+    self.breaker.recordFailure()
+    self.breaker.recordFailure()
+    self._expire()
+    self.breaker.check()
+    self.breaker.recordFailure()
+    self.assertEqual(self.breaker.state, BreakerState.OPEN)
+    self.assertFalse(self.breaker.allows())
+
+  def test_abandontrial_freesslot(self):
+    self.breaker.recordFailure()
+    self.breaker.recordFailure()
+    self._expire()
+    self.breaker.check()
+    self.breaker.abandonTrial()
+    self.breaker.check()
+
+class TestSqliteStore(unittest.IsolatedAsyncioTestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.store = SqliteStore(os.path.join(self.tmpdir.name, "cache.sqlite3"))
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_store_roundtrip(self):
+    self.store.set("fake", "a", "1.1", '{"x": 1}', 10, 100)
+    item = self.store.get("fake", "a", "1.1")
+    self.assertEqual(item.payload, '{"x": 1}')
+    self.assertEqual(item.soft_ttl, 10)
+    self.assertIsNone(self.store.get("fake", "a", "1.2"))
+
+  def test_store_prune(self):
+    self.store.set("fake", "a", "1.1", "1", 0, 0)
+    self.store.set("fake", "b", "1.1", "1", None, None)
+    self.assertEqual(self.store.prune(grace=-1), 1)
+    self.assertIsNotNone(self.store.get("fake", "b", "1.1"))
+
+  def test_store_prunemaxrows(self):
+    store = SqliteStore(self.store.path, max_rows=2)
+    for i in range(4):
+      store.set("fake", str(i), "1.1", "1", None, None)
+    store.set("other", "a", "1.1", "1", None, None)
+    # Oldest first by key, whatever the clock resolution
+    store._conn().execute("UPDATE entries SET stored_at = stored_at + key WHERE namespace = 'fake'")
+    self.assertEqual(store.prune(), 2)
+    self.assertIsNone(store.get("fake", "0", "1.1"))
+    self.assertIsNotNone(store.get("fake", "3", "1.1"))
+    self.assertIsNotNone(store.get("other", "a", "1.1"))
+
+  async def test_getcached_sharedbetweenservices(self):
+    first = FakeService(store=self.store)
+    second = FakeService(store=self.store)
+    await first._getCachedAsync("a")
+    self.assertEqual(await second._getCachedAsync("a"), "a-1")
+    self.assertEqual(second.fetches, 0)
+
+  async def test_getcached_newerstoredentrywins(self):
+    first = FakeService(store=self.store)
+    second = FakeService(store=self.store)
+    await first._getCachedAsync("a")
+    await second._getCachedAsync("a")
+    _age(second.cache, "a", 50)
+    first.cache.clear()
+    await first._getCachedAsync("a")
+    self.assertEqual(await second._getCachedAsync("a"), "a-1")
+    self.assertTrue(second.cache.lookup("a").isFresh())
+
+  async def test_getcached_stalehitwhilefetchpoolbusy(self):
+    service = FakeService(store=self.store)
+    await service._getCachedAsync("a")
+    _age(service.cache, "a", 50)
+    busy = [asyncio.ensure_future(runBlocking(time.sleep, 0.5)) for _ in range(executor.DEFAULT_WORKERS)]
+    await asyncio.sleep(0)
+    start = time.monotonic()
+    self.assertEqual(await service._getCachedAsync("a"), "a-1")
+    self.assertLess(time.monotonic() - start, 0.25)
+    await asyncio.gather(*busy, *service._refreshes)
+
+  async def test_getcached_lockedstore(self):
+    service = FakeService(store=SqliteStore(self.store.path, timeout=0.05))
+    locker = sqlite3.connect(self.store.path)
+    locker.execute("BEGIN EXCLUSIVE")
+    try:
+      with self.assertLogs("cachedService", "WARNING"):
+        self.assertEqual(await service._getCachedAsync("a"), "a-1")
+    finally:
+      locker.rollback()
+      locker.close()
+    self.assertEqual(await service._getCachedAsync("a"), "a-1")
+    self.assertIsNone(self.store.get("fake", "a", service._storeVersion()))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,279 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import sqlite3
+from multiprocessing import Pool
+from time import monotonic, sleep, time
+
+from callQueue import CallQueue, SharedCallQueue, Priority, Outcome
+import executor
+from executor import runBlocking
+import upstream
+from upstream import classify, observe, UpstreamUnavailable
+
+import requests
+
+def _sharedReadyTime(args) -> float:
+  path, delay = args
+  c = SharedCallQueue(delay, path).addCall()
+  # Report in wall clock time so processes can be compared
+  return time() + (c.ready_time - monotonic())
+
+class TestCallQueue(unittest.TestCase):
+  def setUp(self):
+    self.delay = 0.2
+    self.call_queue = CallQueue(self.delay)
+
+  def test_addcall_firstcallready(self):
+    self.assertTrue(self.call_queue.addCall().isReady())
+
+  def test_addcall_spacing(self):
+    first = self.call_queue.addCall()
+    second = self.call_queue.addCall()
+    self.assertAlmostEqual(second.ready_time - first.ready_time, self.delay, places=3)
+
+  def test_addcall_burstafteridle(self):
+    queue = CallQueue(self.delay, burst=3)
+    calls = [queue.addCall() for _ in range(4)]
+    for c in calls[:3]:
+      self.assertTrue(c.isReady())
+    self.assertAlmostEqual(calls[3].ready_time - calls[0].ready_time, self.delay, places=3)
+
+  def test_addcall_burstrefills(self):
+    queue = CallQueue(self.delay, burst=3)
+    for _ in range(3):
+      queue.addCall()
+    queue._tat -= 3 * self.delay
+    self.assertTrue(queue.addCall().isReady())
+
+  def test_addcall_windowcap(self):
+    queue = CallQueue(0.01, burst=5, window_calls=5, window=1.0)
+    calls = [queue.addCall() for _ in range(10)]
+    for earlier, later in zip(calls, calls[5:]):
+      self.assertGreaterEqual(later.ready_time - earlier.ready_time, 1.0 - 1e-9)
+
+  def test_available_burst(self):
+    queue = CallQueue(self.delay, burst=2)
+    self.assertTrue(queue.available(2))
+    queue.addCall()
+    self.assertFalse(queue.available(2))
+    self.assertTrue(queue.available())
+    self.assertFalse(self.call_queue.available(2))
+
+  def test_wait_blocksuntilready(self):
+    self.call_queue.wait()
+    start = monotonic()
+    self.call_queue.wait()
+    self.assertGreaterEqual(monotonic() - start, self.delay * 0.9)
+
+class TestAdaptiveCallQueue(unittest.TestCase):
+  def setUp(self):
+    self.call_queue = CallQueue(6, min_delay=3, max_delay=30)
+
+  def test_callqueue_badbounds(self):
+    with self.assertRaises(ValueError):
+      CallQueue(6, min_delay=10, max_delay=30)
+
+  def test_report_throttledbacksoff(self):
+    self.call_queue.report(Outcome.THROTTLED)
+    self.assertAlmostEqual(self.call_queue.delay, 12)
+    self.assertAlmostEqual(self.call_queue.effective_rate, 5)
+
+  def test_report_backsoffonceperslot(self):
+    self.call_queue.report(Outcome.THROTTLED)
+    self.call_queue.report(Outcome.THROTTLED)
+    self.assertAlmostEqual(self.call_queue.delay, 12)
+
+  def test_report_boundedbymaxdelay(self):
+    for _ in range(5):
+      self.call_queue.report(Outcome.THROTTLED)
+      self.call_queue._last_backoff = -float('inf')
+    self.assertEqual(self.call_queue.delay, 30)
+
+  def test_report_okspeedsup(self):
+    for _ in range(100):
+      self.call_queue.report(Outcome.OK)
+    self.assertEqual(self.call_queue.delay, 3)
+
+  def test_report_failedunchanged(self):
+    self.call_queue.report(Outcome.FAILED)
+    self.assertEqual(self.call_queue.delay, 6)
+    self.assertEqual(self.call_queue.outcomeStats()["failed"], 1)
+
+  def test_report_notadaptivebydefault(self):
+    call_queue = CallQueue(6)
+    call_queue.report(Outcome.THROTTLED)
+    call_queue.report(Outcome.OK)
+    self.assertEqual(call_queue.delay, 6)
+
+  def test_classify_outcomes(self):
+    self.assertEqual(classify(200, 0.5), Outcome.OK)
+    self.assertEqual(classify(200, 30), Outcome.THROTTLED)
+    self.assertEqual(classify(429, 0.5), Outcome.THROTTLED)
+    self.assertEqual(classify(None, 30, requests.exceptions.ReadTimeout()), Outcome.THROTTLED)
+    self.assertEqual(classify(200, 0.5, KeyError("resultSets")), Outcome.FAILED)
+    self.assertEqual(classify(400, 0.5, KeyError("resultSets")), Outcome.FAILED)
+    self.assertEqual(classify(502, 0.5, ValueError("Expecting value")), Outcome.THROTTLED)
+    self.assertEqual(classify(200, 0.5, ValueError("Expecting value")), Outcome.THROTTLED)
+    self.assertEqual(classify(None, 0.5, Exception("InvalidResponse: not JSON")), Outcome.THROTTLED)
+
+  def test_observe_servererrorunavailable(self):
+    def endpoint():
+      upstream._last_response.status = 500
+      return "error body parsed anyway"
+    with self.assertRaises(UpstreamUnavailable):
+      observe(self.call_queue, endpoint)
+    def missing():
+      upstream._last_response.status = 400
+      raise KeyError("resultSets")
+    with self.assertRaises(KeyError):
+      observe(self.call_queue, missing)
+    self.assertEqual(self.call_queue.outcomeStats()["failed"], 1)
+
+class TestCallQueueAsync(unittest.IsolatedAsyncioTestCase):
+  def setUp(self):
+    self.delay = 0.2
+    self.call_queue = CallQueue(self.delay)
+
+  async def test_acquire_doesnotblockloop(self):
+    await self.call_queue.acquire()
+    ticks = 0
+
+    async def ticker():
+      nonlocal ticks
+      while True:
+        ticks += 1
+        await asyncio.sleep(0.01)
+
+    task = asyncio.create_task(ticker())
+    await self.call_queue.acquire()
+    task.cancel()
+    self.assertGreater(ticks, 5)
+
+  async def test_acquire_respectsdelay(self):
+    start = monotonic()
+    await asyncio.gather(*(self.call_queue.acquire() for _ in range(3)))
+    self.assertGreaterEqual(monotonic() - start, 2 * self.delay * 0.9)
+
+  async def test_acquire_interactivejumpsahead(self):
+    await self.call_queue.acquire()
+    order = []
+
+    async def waiter(name, priority):
+      await self.call_queue.acquire(priority)
+      order.append(name)
+
+    tasks = [asyncio.create_task(waiter("prefetch", Priority.PREFETCH)),
+             asyncio.create_task(waiter("refresh", Priority.REFRESH))]
+    await asyncio.sleep(0.05)
+    tasks.append(asyncio.create_task(waiter("interactive", Priority.INTERACTIVE)))
+    await asyncio.gather(*tasks)
+    self.assertEqual(order, ["interactive", "refresh", "prefetch"])
+
+  async def test_acquire_cancelledwaiterskipped(self):
+    await self.call_queue.acquire()
+    cancelled = asyncio.create_task(self.call_queue.acquire())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await self.call_queue.acquire(Priority.PREFETCH)
+    self.assertEqual(self.call_queue.waiting(), 0)
+
+  async def test_waitstats_perpriority(self):
+    await self.call_queue.acquire()
+    await self.call_queue.acquire(Priority.REFRESH)
+    stats = self.call_queue.waitStats()
+    self.assertEqual(stats["interactive"]["calls"], 1)
+    self.assertEqual(stats["refresh"]["calls"], 1)
+    self.assertGreater(stats["refresh"]["max_wait"], 0)
+
+class TestSharedCallQueue(unittest.TestCase):
+  def setUp(self):
+    self.delay = 0.5
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmpdir.name, "calls.sqlite3")
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_addcall_sharedbetweenqueues(self):
+    first = SharedCallQueue(self.delay, self.path)
+    second = SharedCallQueue(self.delay, self.path)
+    a = first.addCall()
+    b = second.addCall()
+    self.assertAlmostEqual(b.ready_time - a.ready_time, self.delay, places=2)
+    self.assertEqual(first.sharedCalls(), 2)
+
+  def test_addcall_sharedbetweenprocesses(self):
+    SharedCallQueue(self.delay, self.path)
+    with Pool(4) as pool:
+      ready_times = sorted(pool.map(_sharedReadyTime, [(self.path, self.delay)] * 4))
+    for earlier, later in zip(ready_times, ready_times[1:]):
+      self.assertGreaterEqual(later - earlier, self.delay * 0.95)
+
+  def test_addcall_sharedburst(self):
+    first = SharedCallQueue(self.delay, self.path, burst=2)
+    second = SharedCallQueue(self.delay, self.path, burst=2)
+    self.assertTrue(first.addCall().isReady())
+    self.assertTrue(second.addCall().isReady())
+    self.assertFalse(first.addCall().isReady())
+
+  def test_available_shared(self):
+    first = SharedCallQueue(self.delay, self.path, burst=2)
+    second = SharedCallQueue(self.delay, self.path, burst=2)
+    self.assertTrue(second.available(2))
+    first.addCall()
+    self.assertFalse(second.available(2))
+    self.assertTrue(second.available())
+
+  def test_report_sharedbetweenqueues(self):
+    first = SharedCallQueue(6, self.path, min_delay=3, max_delay=30)
+    second = SharedCallQueue(6, self.path, min_delay=3, max_delay=30)
+    first.report(Outcome.THROTTLED)
+    second.addCall()
+    self.assertAlmostEqual(second.delay, 12)
+
+  def test_acquire_lockeddbkeepsloopfree(self):
+    queue = SharedCallQueue(self.delay, self.path)
+    locker = sqlite3.connect(self.path, isolation_level=None)
+    locker.execute("BEGIN IMMEDIATE")
+
+    async def run():
+      task = asyncio.ensure_future(queue.acquire())
+      start = monotonic()
+      await asyncio.sleep(0.1)
+      # The loop keeps running while the reservation waits on the file lock
+      self.assertLess(monotonic() - start, 1)
+      self.assertFalse(task.done())
+      locker.execute("ROLLBACK")
+      await task
+
+    try:
+      asyncio.run(run())
+    finally:
+      locker.close()
+    self.assertEqual(queue.sharedCalls(), 1)
+
+  def test_acquire_fetchpoolbusy(self):
+    queue = SharedCallQueue(self.delay, self.path)
+
+    async def run():
+      busy = [asyncio.ensure_future(runBlocking(sleep, 0.5)) for _ in range(executor.DEFAULT_WORKERS)]
+      await asyncio.sleep(0)
+      start = monotonic()
+      await queue.acquire()
+      # Reserving a slot doesn't wait for a fetch thread to free up
+      self.assertLess(monotonic() - start, 0.25)
+      await asyncio.gather(*busy)
+
+    asyncio.run(run())
+
+  def test_reset_clearsshared(self):
+    queue = SharedCallQueue(self.delay, self.path)
+    queue.addCall()
+    queue.reset()
+    self.assertEqual(queue.sharedCalls(), 0)
+    self.assertTrue(queue.addCall().isReady())
+
+if __name__ == "__main__":
+  unittest.main()
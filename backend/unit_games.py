@@ -81,5 +81,19 @@ class TestGames(unittest.TestCase):
     self.assertEquals(requests.get(home_team['logo']).status_code, 200)
     self.assertEquals(requests.get(away_team['logo']).status_code, 200)
 
+class TestKnownGames(unittest.TestCase):
+  def setUp(self):
+    self.games = Games(CallQueue(0))
+
+  def _game(self, game_id: int, status: str) -> dict:
+    team = {"team_id": 1610612739, "city": "Cleveland", "score": 0, "logo": ""}
+    return {"game_id": game_id, "status": status, "home_team": team, "away_team": team}
+
+  def test_finishedgame(self):
+    self.games._deserialize([self._game(22500397, "Final"), self._game(22500398, "Q3 5:12")])
+    self.assertEqual(self.games.finishedGame("0022500397")["status"], "Final")
+    self.assertIsNone(self.games.finishedGame("0022500398"))
+    self.assertIsNone(self.games.finishedGame("0022500399"))
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
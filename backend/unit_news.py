@@ -1,10 +1,17 @@
 import unittest
 
 import requests
-from datetime import datetime
-from time import sleep
+import asyncio
+from datetime import datetime, timedelta, timezone
+from time import sleep, monotonic
 
-from news import News, ArticleInfo
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import json
+
+from news import News, NewsFeed, ArticleInfo, _scriptBody, _extractNbaArticles, _extractYahooStream
+from httpClient import HttpClient
 
 def valid_href(href: str):
   delay = 6
@@ -52,5 +59,195 @@ class TestNews(unittest.TestCase):
     for item in res:
       self.assertTrue(valid_publish_time(item.publish_time))
 
+def _hoursAgo(hours: float) -> str:
+  return (datetime.now(timezone.utc) - timedelta(hours=hours)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _article(source: str, publish_time: str, title: str = None, href: str = None) -> ArticleInfo:
+  title = f"{source} {publish_time}" if title is None else title
+  href = f"https://example.com/{source}/{publish_time}" if href is None else href
+  return ArticleInfo(title=title, source=source, href=href, publish_time=publish_time)
+
+class FakeSource:
+  def __init__(self, name: str, publish_time: str, delay: float = 0):
+    self.name = name
+    self.publish_time = publish_time
+    self.delay = delay
+    self.calls = 0
+    self.fail = False
+
+  def __call__(self, timeout: float):
+    self.calls += 1
+    sleep(self.delay)
+    if self.fail:
+      raise requests.exceptions.ConnectionError("down")
+    return [_article(self.name, self.publish_time)]
+
+class TestNewsRefresh(unittest.IsolatedAsyncioTestCase):
+  def setUp(self):
+    self.a = FakeSource("a", _hoursAgo(1))
+    self.b = FakeSource("b", _hoursAgo(2))
+    self.news = News(wait_time=60, timeout=1, sources={"a": self.a, "b": self.b})
+
+  def test_getnews_merged(self):
+    res = self.news.getNews()
+    self.assertEqual([item.source for item in res], ["a", "b"])
+
+  def test_getnews_cached(self):
+    self.news.getNews()
+    self.news.getNews()
+    self.assertEqual(self.a.calls, 1)
+
+  def test_getnews_failedsourcekeepslast(self):
+    self.news.getNews()
+    self.b.fail = True
+    res = self.news.refresh()
+    self.assertEqual(len(res), 2)
+    self.assertEqual(self.news.failures["b"], 1)
+
+  async def test_refreshasync_concurrent(self):
+    self.a.delay = self.b.delay = 0.3
+    start = monotonic()
+    await self.news.refreshAsync()
+    self.assertLess(monotonic() - start, 0.55)
+
+  async def test_refreshasync_slowsourcetimesout(self):
+    self.b.delay = 2
+    res = await self.news.refreshAsync()
+    self.assertEqual([item.source for item in res], ["a"])
+    self.assertEqual(self.news.failures["b"], 1)
+
+  async def test_getnewsasync_servedfrommemory(self):
+    await self.news.getNewsAsync()
+    self.news.last_update -= 120
+    await self.news.getNewsAsync()
+    await self.news._refreshing
+    self.assertEqual(self.a.calls, 2)
+    self.assertFalse(self.news.isStale())
+
+  async def test_start_refreshesinbackground(self):
+    self.news.start()
+    await asyncio.sleep(0.1)
+    await self.news.stop()
+    self.assertEqual(self.a.calls, 1)
+    self.assertEqual(len(self.news.cache), 2)
+
+class TestNewsFeed(unittest.TestCase):
+  def setUp(self):
+    self.feed = NewsFeed(max_articles=3)
+
+  def test_add_ordered(self):
+    self.feed.add([_article("a", _hoursAgo(3)), _article("a", _hoursAgo(1))])
+    self.feed.add([_article("b", _hoursAgo(2))])
+    self.assertEqual([item.source for item in self.feed.articles()], ["a", "b", "a"])
+
+  def test_add_dedupesurlandtitle(self):
+    self.feed.add([_article("a", _hoursAgo(1), title="Big Trade!", href="https://www.x.com/story/")])
+    added = self.feed.add([_article("b", _hoursAgo(1), href="http://x.com/story"),
+                           _article("c", _hoursAgo(2), title="big trade")])
+    self.assertEqual(added, 0)
+    self.assertEqual(len(self.feed), 1)
+
+  def test_add_normalizestime(self):
+    self.feed.add([_article("a", "2024-01-01T12:00:00.000-05:00")], now=datetime(2024, 1, 2, tzinfo=timezone.utc))
+    self.assertEqual(self.feed.articles()[0].publish_time, "2024-01-01T17:00:00Z")
+
+  def test_add_boundedretention(self):
+    self.feed.add([_article("a", _hoursAgo(i)) for i in range(1, 6)])
+    self.assertEqual(len(self.feed), 3)
+    self.feed.add([_article("a", _hoursAgo(24 * 4))])
+    self.assertEqual(len(self.feed), 3)
+
+  def test_articles_after(self):
+    self.feed.add([_article("a", _hoursAgo(3)), _article("b", _hoursAgo(1))])
+    after = max(item.cursor for item in self.feed.articles())
+    # Published before everything the client has, but added after it
+    self.feed.add([_article("c", _hoursAgo(2))])
+    self.assertEqual([item.source for item in self.feed.articles(after)], ["c"])
+    self.assertEqual(self.feed.articles(max(item.cursor for item in self.feed.articles())), [])
+
+  def test_articles_afterrestart(self):
+    start = datetime.now(timezone.utc)
+    self.feed.add([_article("a", _hoursAgo(3)), _article("b", _hoursAgo(2))], now=start)
+    after = max(item.cursor for item in self.feed.articles())
+    # A restarted worker starts over with an empty feed
+    restarted = NewsFeed(max_articles=3)
+    restarted.add([_article("c", _hoursAgo(1))], now=start + timedelta(minutes=1))
+    self.assertEqual([item.source for item in restarted.articles(after)], ["c"])
+
+class TestNewsExtraction(unittest.TestCase):
+  def test_scriptbody_skipsmarkeroutsidescript(self):
+    page = b'<script>a()</script><div id="m"></div><script>m()</script>'
+    self.assertEqual(_scriptBody(page, b"m("), b"m()")
+    self.assertIsNone(_scriptBody(page, b"zzz"))
+
+  def test_extractnba_nextdata(self):
+    data = {"props": {"pageProps": {"category": {"latest": {"items": [{"shortTitle": "x"}]}}}}}
+    page = f'<script>other()</script><script id="__NEXT_DATA__" type="application/json">{json.dumps(data)}</script>'
+    self.assertEqual(_extractNbaArticles(page.encode()), [{"shortTitle": "x"}])
+
+  def test_extractyahoo_escapedtitle(self):
+    stream = [{"data": {"content": {"title": 'He said "wow"\nagain'}}}]
+    row = "1f:" + json.dumps(["$", "div", None, {"id": "ntk-assetlist-stream", "stream": stream}]) + "\n"
+    page = f'<script>self.__next_f.push({json.dumps([1, row])})</script>'
+    self.assertEqual(_extractYahooStream(page.encode()), stream)
+
+  def test_extractyahoo_missing(self):
+    with self.assertRaises(ValueError):
+      _extractYahooStream(b"<html></html>")
+
+class _EtagHandler(BaseHTTPRequestHandler):
+  body = b'{"articles": []}'
+  etag = '"v1"'
+
+  def do_GET(self):
+    if self.headers.get("If-None-Match") == self.etag:
+      self.send_response(304)
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header("ETag", self.etag)
+    self.send_header("Content-Length", str(len(self.body)))
+    self.end_headers()
+    self.wfile.write(self.body)
+
+  def log_message(self, *args):
+    pass
+
+class TestHttpClient(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _EtagHandler)
+    cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/"
+    Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    self.client = HttpClient()
+    self.parses = 0
+
+  def _parse(self, r):
+    self.parses += 1
+    return r.json()
+
+  def test_get_parses(self):
+    self.assertEqual(self.client.get(self.url, self._parse), {"articles": []})
+
+  def test_get_notmodifiedskipsparse(self):
+    first = self.client.get(self.url, self._parse)
+    second = self.client.get(self.url, self._parse)
+    self.assertIs(first, second)
+    self.assertEqual(self.parses, 1)
+    self.assertEqual(self.client.stats()["not_modified"], 1)
+
+  def test_forget_refetches(self):
+    self.client.get(self.url, self._parse)
+    self.client.forget(self.url)
+    self.client.get(self.url, self._parse)
+    self.assertEqual(self.parses, 2)
+
 if __name__ == "__main__":
   unittest.main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import unittest
+
+from nba_api.stats.static import players as nba_players
+
+from playerSearch import PlayerSearchIndex, foldName
+from players import searchPlayers
+
+def _player(player_id: int, full_name: str, is_active: bool = True) -> dict:
+  return {"id": player_id, "full_name": full_name, "is_active": is_active}
+
+class TestPlayerSearchIndex(unittest.TestCase):
+  def setUp(self):
+    self.index = PlayerSearchIndex([
+      _player(1, "LeBron James"),
+      _player(2, "Bronny James"),
+      _player(3, "Nikola Jokić"),
+      _player(4, "D'Angelo Russell"),
+      _player(5, "James Worthy", False),
+      _player(6, "Anthony Davis"),
+      _player(7, "Antawn Jamison", False),
+    ])
+
+  def _ids(self, query: str, limit: int = None) -> list:
+    return [player["id"] for player in self.index.search(query, limit)]
+
+  def test_foldname_accentsandpunctuation(self):
+    self.assertEqual(foldName("Nikola Jokić"), "nikola jokic")
+    self.assertEqual(foldName(" D'Angelo  Russell "), "dangelo russell")
+    self.assertEqual(foldName("Karl-Anthony"), "karl anthony")
+
+  def test_search_empty(self):
+    self.assertEqual(self._ids(""), [])
+    self.assertEqual(self._ids("  '. "), [])
+
+  def test_search_exactfirst(self):
+    self.assertEqual(self._ids("lebron james")[0], 1)
+    self.assertEqual(self._ids("LEBRONJAMES"), [1])
+
+  def test_search_wordprefixes(self):
+    self.assertEqual(self._ids("jam"), [5, 1, 2, 7])
+    self.assertEqual(self._ids("james leb"), [1])
+
+  def test_search_activefirst(self):
+    self.assertEqual(self._ids("james w"), [5])
+    self.assertEqual(self._ids("ant"), [6, 7])
+
+  def test_search_accentfolded(self):
+    self.assertEqual(self._ids("jokic"), [3])
+    self.assertEqual(self._ids("dangelo"), [4])
+
+  def test_search_substring(self):
+    self.assertEqual(self._ids("bron"), [2, 1])
+
+  def test_search_typos(self):
+    self.assertEqual(self._ids("lebron jmaes"), [1])
+    self.assertEqual(self._ids("nikola jokci"), [3])
+    self.assertEqual(self._ids("xyzzy"), [])
+
+  def test_search_limit(self):
+    self.assertEqual(self._ids("jam", 2), [5, 1])
+
+class TestSearchPlayers(unittest.TestCase):
+  def test_searchplayers_goodshape(self):
+    res = searchPlayers("lebron james")
+    self.assertEqual(res[0]["player_name"], "LeBron James")
+    self.assertEqual(set(res[0]), {"player_id", "player_name", "active", "player_headshot"})
+
+  def test_searchplayers_limitoffset(self):
+    full = searchPlayers("jam")
+    self.assertEqual(searchPlayers("jam", 5), full[:5])
+    self.assertEqual(searchPlayers("jam", 5, 5), full[5:10])
+    self.assertEqual(searchPlayers("jam", offset=3), full[3:])
+    with self.assertRaises(ValueError):
+      searchPlayers("jam", -1)
+
+  def test_searchplayers_sharedpayloads(self):
+    first = searchPlayers("Curry", 3)
+    second = searchPlayers("curry", 3)
+    self.assertIs(first, second)
+    self.assertIs(first[0], searchPlayers("stephen curry")[0])
+
+  def test_searchplayers_fullindex(self):
+    self.assertEqual(len(PlayerSearchIndex(nba_players.get_players())), len(nba_players.get_players()))
+
+if __name__ == "__main__":
+  unittest.main()
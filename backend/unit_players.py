@@ -1,7 +1,13 @@
 import unittest
 
-from players import PlayerStats, PlayerStatsOut, PlayerCompareResult, CompareMode, InvalidComparisonException
+import asyncio
+import json
+
+import numpy as np
+
+from players import PlayerStats, PlayerStatsOut, Career, StatTable, StatView, rankStats, PlayerCompareResult, CompareMode, InvalidComparisonException
 from callQueue import CallQueue
+from bench_players import syntheticCareerResponse, loadCareer, legacyStats, sameStats
 
 class TestPlayerStats(unittest.TestCase):
   def setUp(self):
@@ -57,5 +63,140 @@ class TestPlayerStats(unittest.TestCase):
     with self.assertRaises(InvalidComparisonException):
       self.players.comparePlayerStats(self.valid_id_list[0], self.valid_id_list[1], mode)
 
+class TestPlayerStatsBuild(unittest.TestCase):
+  def test_buildstats_matchesrowwise(self):
+    career = loadCareer(syntheticCareerResponse())
+    self.assertTrue(sameStats(legacyStats(career), PlayerStats._buildStats(career)))
+
+  def test_buildstats_noplayoffs(self):
+    career = loadCareer(syntheticCareerResponse(seasons=2, playoff_seasons=0))
+    stats = PlayerStats._buildStats(career)
+    self.assertEqual(list(stats), ["regular"])
+    self.assertTrue(sameStats(legacyStats(career), stats))
+
+  def test_career_jsonroundtrip(self):
+    nba_res = loadCareer(syntheticCareerResponse())
+    career = PlayerStats._buildCareer(2544, "LeBron James", "headshot.png", nba_res)
+    loaded = Career.fromJson(json.loads(json.dumps(career.toJson())))
+    self.assertTrue(sameStats(legacyStats(nba_res), loaded.stats()))
+    self.assertEqual(loaded.toStatsOut(), career.toStatsOut())
+    self.assertEqual(loaded.toStatsOut().player_name, "LeBron James")
+
+  def test_career_view(self):
+    nba_res = loadCareer(syntheticCareerResponse())
+    career = PlayerStats._buildCareer(2544, "LeBron James", "headshot.png", nba_res)
+    legacy = legacyStats(nba_res)
+    stats = career.stats(StatView("postseason", "pergame", "season"))
+    self.assertEqual(list(stats), ["postseason"])
+    self.assertEqual(list(stats["postseason"]), ["pergame"])
+    self.assertTrue(sameStats(stats["postseason"]["pergame"], {"season": legacy["postseason"]["pergame"]["season"]}))
+
+    stats = career.stats(StatView(stat_mode="total", scope="career"))
+    self.assertEqual(list(stats), ["regular", "postseason"])
+    self.assertTrue(sameStats(stats["regular"]["total"], {"career": legacy["regular"]["total"]["career"]}))
+
+  def test_statview_invalid(self):
+    with self.assertRaises(ValueError):
+      StatView("preseason")
+    with self.assertRaises(ValueError):
+      StatView(scope="game")
+
+class TestPlayerGroupCompare(unittest.TestCase):
+  def setUp(self):
+    self.players = PlayerStats(CallQueue(0))
+    self.ids = [893, 2544, 202711, 1641705]
+    self.fetched = []
+
+    def fetch(player_id):
+      self.fetched.append(player_id)
+      nba_res = loadCareer(syntheticCareerResponse(seed=player_id))
+      return PlayerStats._buildCareer(player_id, str(player_id), "", nba_res)
+    self.players._fetch = fetch
+
+  def test_rankstats_ties(self):
+    values = np.zeros((3, 22))
+    values[:, 0] = [10, 30, 10]
+    values[:, 8] = [1, 3, 2]  # turnovers
+    ranks = rankStats(values)
+    self.assertEqual(ranks[:, 0].tolist(), [2, 1, 2])
+    self.assertEqual(ranks[:, 8].tolist(), [1, 3, 2])
+    self.assertEqual(ranks[:, 1].tolist(), [1, 1, 1])
+
+  def test_comparegroup_matchespairs(self):
+    mode = CompareMode('career')
+    group = asyncio.run(self.players.comparePlayerGroupAsync(self.ids, mode))
+    self.assertEqual(sorted(self.fetched), sorted(self.ids))
+    self.assertEqual(group.player_ids, self.ids)
+    for a in range(len(self.ids)):
+      for b in range(a + 1, len(self.ids)):
+        pair = self.players.comparePlayerStats(self.ids[a], self.ids[b], mode)
+        for stat_mode, lines in pair.result.items():
+          for name, outcome in lines.model_dump().items():
+            ranks = group.result[stat_mode][name]
+            self.assertEqual(outcome, (ranks[a] < ranks[b]) - (ranks[a] > ranks[b]), name)
+    # Everything came from the cache the second time around
+    self.assertEqual(len(self.fetched), len(self.ids))
+
+  def test_comparegroup_season(self):
+    mode = CompareMode('season', '2005-06')
+    group = self.players.comparePlayerGroup(self.ids[:3], mode)
+    self.assertIn('2005-06', group.season_overlap)
+    self.assertEqual(len(group.result['pergame']['pts']), 3)
+    with self.assertRaises(InvalidComparisonException):
+      self.players.comparePlayerGroup(self.ids, CompareMode('season', '1965-66'))
+
+  def test_seasonrows_prefertot(self):
+    totals = np.arange(4 * 21, dtype=float).reshape(4, 21)
+    table = StatTable(totals[:1], totals, (False,) * 21, ['2001-02', '2002-03', '2002-03', '2002-03'],
+                      ['CLE', 'MIA', 'TOT', 'CLE'])
+    self.assertEqual(table.season_rows, {'2001-02': 0, '2002-03': 2})
+    self.assertEqual(table.seasonLine(False, '2002-03')['team'], 'TOT')
+    self.assertIsNone(table.seasonLine(False, '1999-00'))
+    loaded = StatTable.fromJson(json.loads(json.dumps(table.toJson())))
+    self.assertEqual(loaded.season_set, {'2001-02', '2002-03'})
+
+  def test_compare_memoized(self):
+    mode = CompareMode('career')
+    first = self.players.comparePlayerStats(893, 2544, mode)
+    self.assertEqual(self.players.comparePlayerStats(893, 2544, mode).result, first.result)
+    reverse = self.players.comparePlayerStats(2544, 893, mode)
+    self.assertEqual(reverse.player_1.player_id, 2544)
+    self.assertEqual(reverse.result['total'].pts, -first.result['total'].pts)
+    self.assertEqual(self.players.compareStats()['hits'], 2)
+
+    group = self.players.comparePlayerGroup([2544, 893, 202711], mode)
+    reordered = self.players.comparePlayerGroup([202711, 2544, 893], mode)
+    self.assertEqual(reordered.result['total']['pts'], [group.result['total']['pts'][k] for k in (2, 0, 1)])
+    self.assertEqual([player.player_id for player in reordered.players], [202711, 2544, 893])
+    # Only rankings are kept, not the players' stats
+    self.assertLess(self.players.compareStats()['bytes'], 64 * 1024)
+
+  def test_compare_refreshinvalidates(self):
+    mode = CompareMode('career')
+    first = self.players.comparePlayerStats(893, 2544, mode)
+    nba_res = loadCareer(syntheticCareerResponse(seed=1))
+    self.players._store(2544, PlayerStats._buildCareer(2544, "2544", "", nba_res))
+    second = self.players.comparePlayerStats(893, 2544, mode)
+    self.assertNotEqual(second.result['total'].model_dump(), first.result['total'].model_dump())
+    self.assertEqual(self.players.comparePlayerStats(893, 2544, mode).result, second.result)
+    # The refreshed result replaces the old one instead of sitting next to it
+    self.assertEqual(self.players.compareStats()['entries'], 1)
+
+  def test_compare_withoutplayers(self):
+    mode = CompareMode('career')
+    res = self.players.comparePlayerStats(2544, 893, mode, include_players=False)
+    self.assertIsNone(res.player_1)
+    self.assertLess(len(res.model_dump_json()), 1000)
+    group = self.players.comparePlayerGroup([2544, 893], mode, include_players=False)
+    self.assertIsNone(group.players)
+
+  def test_comparegroup_size(self):
+    mode = CompareMode('career')
+    with self.assertRaises(InvalidComparisonException):
+      self.players.comparePlayerGroup([2544, 2544], mode)
+    with self.assertRaises(InvalidComparisonException):
+      self.players.comparePlayerGroup(list(range(11)), mode)
+    self.assertIsNone(self.players.comparePlayerGroup([2544, -5], mode))
+
 if __name__ == "__main__":
   unittest.main()
\ No newline at end of file
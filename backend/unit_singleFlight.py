@@ -0,0 +1,53 @@
+import unittest
+import asyncio
+
+from singleFlight import SingleFlight
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+  def setUp(self):
+    self.inflight = SingleFlight()
+    self.calls = 0
+
+  async def _fetch(self):
+    self.calls += 1
+    await asyncio.sleep(0.05)
+    return {"value": self.calls}
+
+  async def test_do_coalescesconcurrentmisses(self):
+    res = await asyncio.gather(*(self.inflight.do("games", "key", self._fetch) for _ in range(5)))
+    self.assertEqual(self.calls, 1)
+    self.assertEqual(self.inflight.fetches, 1)
+    self.assertEqual(self.inflight.coalesced, 4)
+    for item in res:
+      self.assertIs(item, res[0])
+
+  async def test_do_separatekeys(self):
+    await asyncio.gather(self.inflight.do("games", 1, self._fetch), self.inflight.do("games", 2, self._fetch),
+                         self.inflight.do("standings", 1, self._fetch))
+    self.assertEqual(self.calls, 3)
+
+  async def test_do_refetchesafterfinish(self):
+    await self.inflight.do("games", "key", self._fetch)
+    await self.inflight.do("games", "key", self._fetch)
+    self.assertEqual(self.calls, 2)
+    self.assertFalse(self.inflight.inFlight("games", "key"))
+
+  async def test_do_exceptionreachesallwaiters(self):
+    async def failing():
+      await asyncio.sleep(0.01)
+      raise RuntimeError("upstream down")
+
+    res = await asyncio.gather(*(self.inflight.do("games", "key", failing) for _ in range(3)), return_exceptions=True)
+    for item in res:
+      self.assertIsInstance(item, RuntimeError)
+
+  async def test_do_cancelledwaiterdoesnotcancelfetch(self):
+    first = asyncio.create_task(self.inflight.do("games", "key", self._fetch))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(self.inflight.do("games", "key", self._fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    self.assertEqual((await second)["value"], 1)
+
+if __name__ == "__main__":
+  unittest.main()
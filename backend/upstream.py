@@ -0,0 +1,70 @@
+from time import monotonic
+import threading
+
+import requests
+from nba_api.stats.library.http import NBAStatsHTTP
+
+from callQueue import CallQueue, Outcome
+
+# Statuses stats.nba.com answers with when it wants us to slow down
+THROTTLE_STATUSES = {429, 503}
+# Successful calls slower than this count as a sign of congestion
+SLOW_LATENCY = 8.0
+
+# nba_api constructs its endpoints without exposing the HTTP status, so a
+# response hook on its shared session records it per fetch thread
+_last_response = threading.local()
+
+class UpstreamUnavailable(Exception):
+  '''stats.nba.com is throttling us, failing or can't be reached, as opposed to having no data'''
+  pass
+
+def _recordStatus(response: requests.Response, *args, **kwargs) -> None:
+  _last_response.status = response.status_code
+
+NBAStatsHTTP.get_session().hooks['response'].append(_recordStatus)
+
+def _serverError(status: int) -> bool:
+  return status is not None and status >= 500
+
+def _unparsable(error: Exception) -> bool:
+  # nba_api raises these when the body isn't JSON, e.g. an HTML error page
+  return isinstance(error, ValueError) or str(error).startswith("InvalidResponse")
+
+def classify(status: int, latency: float, error: Exception = None) -> Outcome:
+  if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+    return Outcome.THROTTLED
+  if status in THROTTLE_STATUSES or _serverError(status):
+    return Outcome.THROTTLED
+  if error is not None and _unparsable(error):
+    return Outcome.THROTTLED
+  if error is not None or (status is not None and status >= 400):
+    return Outcome.FAILED
+  if latency > SLOW_LATENCY:
+    return Outcome.THROTTLED
+  return Outcome.OK
+
+def observe(call_queue: CallQueue, endpoint, *args, **kwargs):
+  '''
+  Calls an nba_api endpoint constructor and reports the outcome to
+  call_queue so it can adapt its rate. Throttling, server errors, unparsable
+  responses and connection problems are raised as UpstreamUnavailable, so
+  callers never mistake them for missing data. Anything else, such as a 4xx
+  for a bad id, is re-raised as is.
+  '''
+  _last_response.status = None
+  start = monotonic()
+  try:
+    res = endpoint(*args, **kwargs)
+  except Exception as e:
+    latency = monotonic() - start
+    outcome = classify(_last_response.status, latency, e)
+    call_queue.report(outcome)
+    if outcome == Outcome.THROTTLED:
+      raise UpstreamUnavailable(f"{endpoint.__name__} failed: {e}") from e
+    raise
+  latency = monotonic() - start
+  call_queue.report(classify(_last_response.status, latency))
+  if _serverError(_last_response.status):
+    raise UpstreamUnavailable(f"{endpoint.__name__} failed: status {_last_response.status}")
+  return res
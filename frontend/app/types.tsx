@@ -81,6 +81,7 @@ type ArticleInfo = {
   source: string;
   href: string;
   publish_time: string;
+  cursor: number;
 }
 
 type CompareMode = {